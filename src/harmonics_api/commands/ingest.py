@@ -0,0 +1,383 @@
+"""
+Module for the 'ingest' command.
+
+Upserts the artists of local JSON files into the catalog, in batches spread
+over a pool of workers. A file holds a list of artists (or, if it ends in
+'.ndjson' or '.jsonl', one per line, like the artist export), each with its
+ID, name, genres, bio, optional Spotify popularity and releases with their
+tracks.
+
+Each artist stores the hash of the data it was last ingested from, so the
+artists that didn't change since are skipped without writing anything. The
+graph of a batch is written first, with idempotent MERGEs, then its artist
+documents, with one bulk write guarded by their versions, so a rating or a
+follower flush landing in the meantime makes the artist retry instead of
+being overwritten. The hash is only stored once the views and the search
+entries of the artist are refreshed, so an interrupted ingest picks up
+where it stopped when run again.
+
+The follower and rating counters are kept, and releases missing from a file
+are left as they are, as they may have ratings. When the genres of an
+artist change, the genre leaderboard counts of its followers are moved to
+its new genres.
+
+A batch that fails on a database error is reported and the others go on,
+so running the command again retries it.
+"""
+import hashlib
+import json
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from neo4j.exceptions import DriverError, Neo4jError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from harmonics_api.configs import mongodb, neo4j
+from harmonics_api.utils import followers, leaderboard, search, views
+
+MAX_ATTEMPTS = 5
+
+RELEASE_FIELDS = ("name", "release_date", "tracks")
+
+# The Spotify popularity comes from the files, while the follower popularity
+# is only set on creation, as the follower flushes own it afterwards
+ARTISTS_STATEMENT = f"""
+    UNWIND $artists AS artist
+    MERGE (a:Artist {{id: artist.id}})
+    ON CREATE SET a.follower_popularity = artist.follower_popularity
+    SET a.popularity = artist.popularity
+    SET a.score = {followers.SCORE_EXPRESSION}
+    WITH a, artist
+    OPTIONAL MATCH (a)-[b:BELONGS_TO]->(g:Genre)
+    WHERE NOT g.name IN artist.genres
+    DELETE b
+    """
+
+GENRES_STATEMENT = """
+    UNWIND $artists AS artist
+    MATCH (a:Artist {id: artist.id})
+    UNWIND artist.genres AS name
+    MERGE (g:Genre {name: name})
+    MERGE (a)-[:BELONGS_TO]->(g)
+    """
+
+RELEASES_STATEMENT = """
+    UNWIND $artists AS artist
+    MATCH (a:Artist {id: artist.id})
+    UNWIND artist.releases AS release_id
+    MERGE (r:Release {id: release_id})
+    MERGE (a)-[:RELEASED]->(r)
+    """
+
+def run(paths: list, workers: int, batch_size: int) -> int:
+    """
+    Run the command and return its exit code.
+    """
+    if workers <= 0 or batch_size <= 0:
+        print("The number of workers and the batch size must be positive")
+        return 2
+
+    totals = {
+        "written": 0,
+        "unchanged": 0,
+        "genres_changed": 0,
+        "invalid": 0,
+        "failed": [],
+    }
+
+    def collect(done) -> None:
+        for future in done:
+            counts = future.result()
+            for key, value in counts.items():
+                totals[key] += value
+            print(
+                f"Ingested {totals['written'] + totals['unchanged']} artists "
+                f"({totals['written']} written, {totals['unchanged']} unchanged)"
+            )
+
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        in_flight = set()
+        for batch in _batches(_read_artists(paths, totals), batch_size):
+            # Keeps up to two batches per worker in flight, so a large NDJSON
+            # file is read as it's ingested
+            if len(in_flight) >= 2 * workers:
+                done, in_flight = wait(in_flight, return_when = FIRST_COMPLETED)
+                collect(done)
+            in_flight.add(executor.submit(_ingest_batch, batch))
+        collect(wait(in_flight).done)
+
+    print(
+        f"Done: {totals['written']} artists written, {totals['unchanged']} unchanged, "
+        f"{totals['invalid']} invalid"
+    )
+    if totals["genres_changed"]:
+        print(
+            f"The genres of {totals['genres_changed']} existing artists changed, "
+            "and the leaderboard counts of their followers were moved"
+        )
+    for message in totals["failed"]:
+        print(f"Not ingested, run again to retry: {message}")
+    return 1 if totals["failed"] or totals["invalid"] else 0
+
+def _read_artists(paths: list, totals: dict):
+    # Yields the artists of the files, counting the invalid ones
+    for path in paths:
+        with open(path, encoding = "utf-8") as file:
+            if path.endswith((".ndjson", ".jsonl")):
+                records = (json.loads(line) for line in file if line.strip())
+            else:
+                records = json.load(file)
+            for position, record in enumerate(records, start = 1):
+                # The checkpoint lines of an export
+                if isinstance(record, dict) and "checkpoint" in record:
+                    continue
+                artist = _normalize(record)
+                if artist is None:
+                    print(f"Invalid artist: '{path}', #{position}")
+                    totals["invalid"] += 1
+                    continue
+                yield artist
+
+def _normalize(record) -> dict | None:
+    # Picks the catalog fields of an artist record, or None if it's malformed
+    try:
+        artist = {
+            "id": record.get("id", record.get("_id")),
+            "name": record["name"],
+            "genres": list(record.get("genres", [])),
+            "bio": record.get("bio"),
+            "popularity": record.get("popularity"),
+            "releases": [
+                {
+                    "id": release["id"],
+                    "name": release["name"],
+                    "release_date": release["release_date"],
+                    "tracks": [
+                        {
+                            "track_number": track["track_number"],
+                            "name": track["name"],
+                            "duration": track["duration"],
+                        }
+                        for track in release["tracks"]
+                    ],
+                }
+                for release in record["releases"]
+            ],
+        }
+    except (AttributeError, KeyError, TypeError):
+        return None
+    if not isinstance(artist["id"], str) or not artist["releases"]:
+        return None
+    return artist
+
+def _batches(artists, batch_size: int):
+    # Groups the artists into lists of up to batch_size
+    batch = []
+    for artist in artists:
+        batch.append(artist)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _hash(artist: dict) -> str:
+    # Hashes the data an artist is ingested from
+    return hashlib.sha256(
+        json.dumps(artist, sort_keys = True, ensure_ascii = False).encode("utf-8"),
+    ).hexdigest()
+
+def _ingest_batch(artists: list) -> dict:
+    # Ingests a batch of artists and returns its counts, with a database
+    # error failing the rest of the batch instead of the whole run
+    counts = {
+        "written": 0,
+        "unchanged": 0,
+        "genres_changed": 0,
+        "failed": [],
+    }
+    try:
+        _ingest(artists, counts)
+    except (PyMongoError, Neo4jError, DriverError) as e:
+        counts["failed"].append(
+            f"batch of artists '{artists[0]['id']}' to '{artists[-1]['id']}': {e}"
+        )
+    return counts
+
+def _ingest(artists: list, counts: dict) -> None:
+    # Ingests a batch of artists, adding to its counts
+    hashes = {artist["id"]: _hash(artist) for artist in artists}
+    stored_hashes = {
+        document["_id"]: document.get("ingest_hash")
+        for document in mongodb.db.artists.find(
+            {
+                "_id": {
+                    "$in": list(hashes),
+                },
+            },
+            {
+                "ingest_hash": True,
+            },
+        )
+    }
+    pending = [
+        artist
+        for artist in artists
+        if stored_hashes.get(artist["id"]) != hashes[artist["id"]]
+    ]
+    counts["unchanged"] = len(artists) - len(pending)
+    if not pending:
+        return
+
+    _write_graph(pending)
+
+    for _ in range(MAX_ATTEMPTS):
+        current = _find(artist["id"] for artist in pending)
+        errors = _write_documents(pending, current)
+        counts["failed"].extend(errors.values())
+        pending = [artist for artist in pending if artist["id"] not in errors]
+
+        written = _find(artist["id"] for artist in pending)
+        applied = [artist for artist in pending if _applied(written.get(artist["id"]), artist)]
+        for artist in applied:
+            # The write was guarded by the version read, so the genres read
+            # are the ones it replaced
+            previous = current.get(artist["id"])
+            if previous is not None and previous["genres"] != artist["genres"]:
+                leaderboard.move_artist(artist["id"], previous["genres"], artist["genres"])
+                counts["genres_changed"] += 1
+            views.refresh_artist_view(written[artist["id"]])
+            search.index_tracks(written[artist["id"]])
+            search.index_artist_name(written[artist["id"]], artist["popularity"])
+        if applied:
+            mongodb.db.artists.bulk_write(
+                [
+                    UpdateOne(
+                        {
+                            "_id": artist["id"],
+                        },
+                        {
+                            "$set": {
+                                "ingest_hash": hashes[artist["id"]],
+                            },
+                        },
+                    )
+                    for artist in applied
+                ],
+                ordered = False,
+            )
+        counts["written"] += len(applied)
+
+        pending = [artist for artist in pending if artist not in applied]
+        if not pending:
+            break
+
+    counts["failed"].extend(f"artist '{artist['id']}' kept changing" for artist in pending)
+
+def _write_graph(artists: list) -> None:
+    # Merges the artists, their genres and their releases into the graph
+    parameters = [
+        {
+            "id": artist["id"],
+            "popularity": artist["popularity"],
+            "follower_popularity": followers.popularity(0),
+            "genres": artist["genres"],
+            "releases": [release["id"] for release in artist["releases"]],
+        }
+        for artist in artists
+    ]
+    for statement in (ARTISTS_STATEMENT, GENRES_STATEMENT, RELEASES_STATEMENT):
+        neo4j.driver.execute_query(statement, artists = parameters)
+
+def _find(artist_ids) -> dict:
+    # Maps the ID of each artist found to its document
+    return {
+        document["_id"]: document
+        for document in mongodb.db.artists.find(
+            {
+                "_id": {
+                    "$in": list(artist_ids),
+                },
+            },
+        )
+    }
+
+def _write_documents(artists: list, current: dict) -> dict:
+    # Upserts the artist documents, each guarded by the version it was read
+    # at, and maps the ID of each artist that failed to the reason
+    operations = []
+    for artist in artists:
+        document = current.get(artist["id"])
+        if document is None:
+            operations.append(UpdateOne(
+                {
+                    "_id": artist["id"],
+                },
+                {
+                    "$setOnInsert": {
+                        "name": artist["name"],
+                        "genres": artist["genres"],
+                        "bio": artist["bio"],
+                        "qt_followers": 0,
+                        "releases": _merge_releases(artist["releases"], []),
+                    },
+                },
+                upsert = True,
+            ))
+            continue
+
+        operations.append(UpdateOne(
+            {
+                "_id": artist["id"],
+                "version": document.get("version"),
+            },
+            {
+                "$set": {
+                    "name": artist["name"],
+                    "genres": artist["genres"],
+                    "bio": artist["bio"],
+                    "releases": _merge_releases(artist["releases"], document["releases"]),
+                },
+                "$inc": {
+                    "version": 1,
+                },
+            },
+        ))
+
+    try:
+        mongodb.db.artists.bulk_write(operations, ordered = False)
+    except BulkWriteError as e:
+        return {
+            artists[error["index"]]["id"]: (
+                f"artist '{artists[error['index']]['id']}': {error['errmsg']}"
+            )
+            for error in e.details["writeErrors"]
+        }
+    return {}
+
+def _merge_releases(releases: list, current_releases: list) -> list:
+    # Updates the current releases with the ingested ones, keeping their
+    # rating counters and the releases that weren't ingested
+    remaining = {release["id"]: release for release in current_releases}
+    merged = []
+    for release in releases:
+        current = remaining.pop(release["id"], None)
+        if current is None:
+            merged.append({**release, "rating_sum": 0, "qt_ratings": 0})
+        elif any(current.get(field) != release[field] for field in RELEASE_FIELDS):
+            merged.append({**current, **release, "version": current.get("version", 0) + 1})
+        else:
+            merged.append(current)
+    merged.extend(remaining.values())
+    return merged
+
+def _applied(document: dict | None, artist: dict) -> bool:
+    # Checks whether the document holds the ingested data of the artist
+    if document is None:
+        return False
+    if any(document.get(field) != artist[field] for field in ("name", "genres", "bio")):
+        return False
+    releases = {release["id"]: release for release in document["releases"]}
+    return all(
+        release["id"] in releases
+        and all(releases[release["id"]].get(field) == release[field] for field in RELEASE_FIELDS)
+        for release in artist["releases"]
+    )
@@ -0,0 +1,213 @@
+"""
+Module for the 'migrate' command.
+
+Creates every index and constraint the API relies on, then checks the query
+plan of each MongoDB pipeline and Cypher query of the app, failing if any of
+them falls back to a full scan.
+"""
+import re
+from pymongo import MongoClient
+from pymongo.server_api import ServerApi
+from harmonics_api.configs import mongodb, neo4j
+from harmonics_api.commands import ingest
+from harmonics_api.routes import releases, users, recs
+from harmonics_api.utils import export, followers, helper, mutuals, outbox, search
+
+MONGO_INDEXES = (
+    ("users", "username", True),
+    ("artists", "releases.id", True),
+    ("track_search", "tokens", False),
+    ("track_search", "artist.id", False),
+    ("name_search", [("kind", 1), ("grams", 1)], False),
+    ("artist_views", "releases.id", False),
+    ("ratings", [("release_id", 1), ("username", 1)], True),
+    ("ratings", [("release_id", 1), ("created_at", 1)], False),
+    ("ratings", [("username", 1), ("created_at", 1)], False),
+    ("genre_leaderboard", [("genre", 1), ("username", 1)], True),
+    ("genre_leaderboard", [("genre", 1), ("follows", -1)], False),
+    ("genre_leaderboard", [("username", 1), ("follows", -1)], False),
+)
+
+NEO4J_SCHEMA = (
+    "CREATE CONSTRAINT artist_id IF NOT EXISTS FOR (a:Artist) REQUIRE a.id IS UNIQUE",
+    "CREATE CONSTRAINT genre_name IF NOT EXISTS FOR (g:Genre) REQUIRE g.name IS UNIQUE",
+    "CREATE CONSTRAINT release_id IF NOT EXISTS FOR (r:Release) REQUIRE r.id IS UNIQUE",
+    "CREATE CONSTRAINT user_username IF NOT EXISTS FOR (u:User) REQUIRE u.username IS UNIQUE",
+    "CREATE INDEX artist_score IF NOT EXISTS FOR (a:Artist) ON (a.score)",
+)
+
+NEO4J_SCAN_OPERATORS = {
+    "AllNodesScan",
+    "NodeByLabelScan",
+    "DirectedAllRelationshipsScan",
+    "UndirectedAllRelationshipsScan",
+    "DirectedRelationshipTypeScan",
+    "UndirectedRelationshipTypeScan",
+}
+
+# Parameters that EXPLAIN needs with a specific type, the others are given ""
+NEO4J_DUMMY_PARAMS = {
+    "events": [],
+    "artists": [],
+    "max_friends": 1,
+    "max_degree": 1,
+    "max_candidates": 1,
+    "limit": 1,
+}
+
+def run() -> int:
+    """
+    Run the command and return its exit code.
+    """
+    create_schema()
+
+    failures = verify_mongo_plans() + verify_neo4j_plans()
+    for name in failures:
+        print(f"Full scan: {name}")
+
+    return 1 if failures else 0
+
+def create_schema() -> None:
+    """
+    Idempotently create the MongoDB indexes and the Neo4j constraints and indexes.
+    """
+    for collection, keys, unique in MONGO_INDEXES:
+        name = mongodb.db[collection].create_index(keys, unique = unique)
+        print(f"MongoDB index '{collection}.{name}' ready")
+
+    for statement in NEO4J_SCHEMA:
+        neo4j.driver.execute_query(statement)
+    neo4j.driver.execute_query("CALL db.awaitIndexes(300)")
+    print(f"{len(NEO4J_SCHEMA)} Neo4j constraints and indexes ready")
+
+def mongo_plans() -> dict:
+    """
+    Map a name to the collection and pipeline of each MongoDB read of the app.
+    """
+    return {
+        "views.get_artist_view": ("artist_views", [{"$match": {"_id": ""}}]),
+        "views.add_rating": ("artist_views", [{"$match": {"releases.id": ""}}]),
+        "releases.get_release": ("artists", releases.release_pipeline([""])),
+        "releases.get_release_ratings": ("artists", releases.release_ratings_pipeline("")),
+        "users.get_user": ("users", users.user_pipeline([""])),
+        "users.get_user_items": ("users", users.user_items_pipeline("", "friends")),
+        "helper.release_summary": ("artists", helper.release_summary_pipeline("")),
+        "helper.exists(user)": ("users", [{"$match": {"username": ""}}]),
+        "helper.exists(artist)": ("artists", [{"$match": {"_id": ""}}]),
+        "helper.exists(release)": ("artists", [{"$match": {"releases.id": ""}}]),
+        "ratings.exists": ("ratings", [{"$match": {"release_id": "", "username": ""}}]),
+        "ratings.get_user_ratings": (
+            "ratings",
+            [{"$match": {"username": ""}}, {"$sort": {"created_at": 1}}],
+        ),
+        "ratings.get_release_ratings": (
+            "ratings",
+            [{"$match": {"release_id": ""}}, {"$sort": {"created_at": 1}}],
+        ),
+        "search.search_tracks": ("track_search", [{"$match": {"tokens": {"$regex": "^a"}}}]),
+        "leaderboard.get_top_genre": (
+            "genre_leaderboard",
+            [{"$match": {"username": ""}}, {"$sort": {"follows": -1}}],
+        ),
+        "leaderboard.get_top_users": (
+            "genre_leaderboard",
+            [{"$match": {"genre": ""}}, {"$sort": {"follows": -1}}],
+        ),
+        "search.search_names": (
+            "name_search",
+            search.search_names_pipeline("artist", ["  a"]),
+        ),
+        "export.artists": (
+            "artists",
+            [{"$match": {"_id": {"$gt": ""}}}, {"$sort": {"_id": 1}}],
+        ),
+        "ingest.find": ("artists", [{"$match": {"_id": {"$in": [""]}}}]),
+        "export.users": (
+            "users",
+            [{"$match": {"username": {"$gt": ""}}}, {"$sort": {"username": 1}}],
+        ),
+    }
+
+def neo4j_plans() -> dict:
+    """
+    Map a name to each Cypher query of the app.
+    """
+    plans = {
+        "recs.TOP_GENRE_QUERY": recs.TOP_GENRE_QUERY,
+        "recs.GENRE_CANDIDATES_QUERY": recs.GENRE_CANDIDATES_QUERY,
+        "recs.ARTIST_RECS_QUERY": recs.ARTIST_RECS_QUERY,
+        "recs.FRIENDS_RATINGS_QUERY": recs.FRIENDS_RATINGS_QUERY,
+        "mutuals.MUTUAL_FRIENDS_QUERY": mutuals.MUTUAL_FRIENDS_QUERY,
+        "recs.FRIEND_RECS_BY_REVIEWS_QUERY": recs.FRIEND_RECS_BY_REVIEWS_QUERY,
+    }
+    for entity, query in helper.EXISTS_QUERIES.items():
+        plans[f"helper.exists({entity})"] = query
+    plans["followers.POPULARITY_STATEMENT"] = followers.POPULARITY_STATEMENT
+    for event_type, statement in outbox.STATEMENTS.items():
+        plans[f"outbox.{event_type}"] = statement
+    for edge_type, query in export.EDGE_QUERIES.items():
+        plans[f"export.edges({edge_type})"] = query
+    plans["ingest.ARTISTS_STATEMENT"] = ingest.ARTISTS_STATEMENT
+    plans["ingest.GENRES_STATEMENT"] = ingest.GENRES_STATEMENT
+    plans["ingest.RELEASES_STATEMENT"] = ingest.RELEASES_STATEMENT
+    return plans
+
+def verify_mongo_plans() -> list:
+    """
+    Explain every MongoDB pipeline and return the names of those doing a COLLSCAN.
+    """
+    # The Stable API strict mode used by the app rejects the 'explain' command
+    explain_client = MongoClient(mongodb.URI, server_api = ServerApi(version = "1"))
+    explain_db = explain_client[mongodb.db.name]
+
+    failures = []
+    for name, (collection, pipeline) in mongo_plans().items():
+        plan = explain_db.command(
+            "explain",
+            {
+                "aggregate": collection,
+                "pipeline": pipeline,
+                "cursor": {},
+            },
+            verbosity = "queryPlanner",
+        )
+        if _has_collscan(plan):
+            failures.append(name)
+        else:
+            print(f"MongoDB plan '{name}' uses an index")
+
+    explain_client.close()
+    return failures
+
+def verify_neo4j_plans() -> list:
+    """
+    EXPLAIN every Cypher query and return the names of those doing a scan.
+    """
+    failures = []
+    for name, query in neo4j_plans().items():
+        params = {
+            parameter: NEO4J_DUMMY_PARAMS.get(parameter, "")
+            for parameter in re.findall(r"\$(\w+)", query)
+        }
+        summary = neo4j.driver.execute_query(f"EXPLAIN {query}", params).summary
+        if _has_scan_operator(summary.plan):
+            failures.append(name)
+        else:
+            print(f"Neo4j plan '{name}' uses an index")
+
+    return failures
+
+def _has_collscan(node) -> bool:
+    if isinstance(node, dict):
+        if node.get("stage") == "COLLSCAN":
+            return True
+        return any(_has_collscan(value) for value in node.values())
+    if isinstance(node, list):
+        return any(_has_collscan(value) for value in node)
+    return False
+
+def _has_scan_operator(plan: dict) -> bool:
+    operator = plan.get("operatorType", "").split("@")[0]
+    if operator in NEO4J_SCAN_OPERATORS:
+        return True
+    return any(_has_scan_operator(child) for child in plan.get("children", []))
@@ -0,0 +1,221 @@
+"""
+Module for the 'migrate-ratings' command.
+
+Moves the ratings embedded in the releases and in the users into the
+'ratings' collection while the API keeps serving. Each release and user is
+moved on its own: its ratings are copied in batches, then its array is
+swapped for rating counters only if the document's version didn't change in
+the meantime, so a rating written or removed during the copy makes the
+release or user start over instead of being lost. Running it again resumes
+where it stopped.
+"""
+from pymongo import UpdateOne
+from harmonics_api.configs import mongodb
+
+MAX_ATTEMPTS = 5
+
+def run(batch_size: int) -> int:
+    """
+    Run the command and return its exit code.
+    """
+    migrated, skipped = 0, []
+
+    artists_cursor = mongodb.db.artists.find(
+        {
+            "releases.ratings": {
+                "$exists": True,
+            },
+        },
+        {
+            "releases.id": True,
+        },
+        batch_size = batch_size,
+    )
+    for artist in artists_cursor:
+        for release in artist["releases"]:
+            if _migrate_release(release["id"], batch_size):
+                migrated += 1
+            else:
+                skipped.append(f"release '{release['id']}'")
+    print(f"Migrated the ratings of {migrated} releases")
+
+    migrated = 0
+    users_cursor = mongodb.db.users.find(
+        {
+            "ratings": {
+                "$exists": True,
+            },
+        },
+        {
+            "username": True,
+        },
+        batch_size = batch_size,
+    )
+    for user in users_cursor:
+        if _migrate_user(user["username"], batch_size):
+            migrated += 1
+        else:
+            skipped.append(f"user '{user['username']}'")
+    print(f"Migrated the ratings of {migrated} users")
+
+    for name in skipped:
+        print(f"Kept changing during the migration, run again to retry: {name}")
+    return 1 if skipped else 0
+
+def _migrate_release(release_id: str, batch_size: int) -> bool:
+    # Moves the ratings of a release, returning False if it kept changing
+    for _ in range(MAX_ATTEMPTS):
+        artist = mongodb.db.artists.find_one(
+            {
+                "releases.id": release_id,
+            },
+            {
+                "name": True,
+                "releases": {
+                    "$elemMatch": {
+                        "id": release_id,
+                    },
+                },
+            },
+        )
+        release = artist["releases"][0] if artist else {}
+        if "ratings" not in release:
+            return True
+
+        inserted_ids = _copy(
+            [
+                (
+                    {
+                        "release_id": release_id,
+                        "username": rating["username"],
+                    },
+                    {
+                        "artist": artist["name"],
+                        "name": release["name"],
+                        **_rating_fields(rating),
+                    },
+                )
+                for rating in release["ratings"]
+            ],
+            batch_size,
+        )
+
+        result = mongodb.db.artists.update_one(
+            {
+                "releases": {
+                    "$elemMatch": {
+                        "id": release_id,
+                        "version": release.get("version"),
+                    },
+                },
+            },
+            {
+                "$unset": {
+                    "releases.$.ratings": True,
+                },
+                "$set": {
+                    "releases.$.rating_sum": sum(rating["rating"] for rating in release["ratings"]),
+                    "releases.$.qt_ratings": len(release["ratings"]),
+                },
+            },
+        )
+        if result.modified_count > 0:
+            return True
+        _discard(inserted_ids)
+
+    return False
+
+def _migrate_user(username: str, batch_size: int) -> bool:
+    # Moves the ratings of a user, returning False if they kept changing
+    for _ in range(MAX_ATTEMPTS):
+        user = mongodb.db.users.find_one(
+            {
+                "username": username,
+            },
+            {
+                "version": True,
+                "ratings": True,
+            },
+        )
+        if not user or "ratings" not in user:
+            return True
+
+        inserted_ids = _copy(
+            [
+                (
+                    {
+                        "release_id": rating["id"],
+                        "username": username,
+                    },
+                    {
+                        "artist": rating["artist"],
+                        "name": rating["name"],
+                        **_rating_fields(rating),
+                    },
+                )
+                for rating in user["ratings"]
+            ],
+            batch_size,
+        )
+
+        result = mongodb.db.users.update_one(
+            {
+                "username": username,
+                "version": user.get("version"),
+            },
+            {
+                "$unset": {
+                    "ratings": True,
+                },
+                "$set": {
+                    "qt_ratings": len(user["ratings"]),
+                },
+            },
+        )
+        if result.modified_count > 0:
+            return True
+        _discard(inserted_ids)
+
+    return False
+
+def _rating_fields(rating: dict) -> dict:
+    # Ratings from before the activity feeds have no creation date
+    fields = {
+        "rating": rating["rating"],
+    }
+    if "created_at" in rating:
+        fields["created_at"] = rating["created_at"]
+    return fields
+
+def _copy(ratings: list, batch_size: int) -> list:
+    # Upserts the (key, fields) pairs of the ratings in batches, leaving the
+    # ones the API already wrote untouched, and returns the IDs inserted
+    inserted_ids = []
+    for first in range(0, len(ratings), batch_size):
+        result = mongodb.db.ratings.bulk_write(
+            [
+                UpdateOne(
+                    key,
+                    {
+                        "$setOnInsert": fields,
+                    },
+                    upsert = True,
+                )
+                for key, fields in ratings[first:first + batch_size]
+            ],
+            ordered = False,
+        )
+        inserted_ids.extend(result.upserted_ids.values())
+    return inserted_ids
+
+def _discard(inserted_ids: list) -> None:
+    # Deletes the copies of an attempt whose swap failed, as some of them may
+    # be of ratings removed in the meantime
+    if inserted_ids:
+        mongodb.db.ratings.delete_many(
+            {
+                "_id": {
+                    "$in": inserted_ids,
+                },
+            },
+        )
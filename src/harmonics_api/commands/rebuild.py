@@ -0,0 +1,34 @@
+"""
+Module for the 'rebuild' command.
+
+Rebuilds the data derived from the catalog, for backfills or after the
+catalog was changed outside of the ingest.
+"""
+from harmonics_api.utils import followers, leaderboard, search, similar, views
+
+TARGETS = {
+    "follower-counts": followers.rebuild,
+    "artist-views": views.rebuild_artist_views,
+    "track-search": search.rebuild_tracks,
+    "artist-search": search.rebuild_artist_names,
+    "user-search": search.rebuild_user_names,
+    "genre-leaderboard": leaderboard.rebuild,
+    "similar-artists": similar.rebuild,
+}
+# The similar artists index is a heavier offline job, run on its own schedule
+DEFAULT_TARGETS = [target for target in TARGETS if target != "similar-artists"]
+
+def run(targets: list) -> int:
+    """
+    Run the command and return its exit code.
+    """
+    unknown_targets = set(targets) - set(TARGETS)
+    if unknown_targets:
+        print(f"Unknown targets: {', '.join(sorted(unknown_targets))}")
+        return 2
+
+    for target in targets or DEFAULT_TARGETS:
+        qt_documents = TARGETS[target]()
+        print(f"Rebuilt '{target}' from {qt_documents} documents")
+
+    return 0
@@ -0,0 +1,163 @@
+"""
+Module for the 'harmonics-replay' command.
+
+Replays a traffic capture against a running instance, keeping the time
+between the requests divided by the speed, and reports the throughput,
+error rates and latency percentiles of each route. The captured bodies only
+have their shapes, so they're filled with made-up values: a unique string
+for each string, so registrations don't collide, and 1 for each number.
+
+It's a command of its own, rather than one of 'harmonics-api', as it only
+talks to the target over HTTP and can run without the database credentials.
+"""
+import argparse
+import json
+import math
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+
+PERCENTILES = (50, 90, 99)
+TIMEOUT_SECONDS = 30
+
+# Made-up value of each type of a captured body, strings being unique instead
+FILLERS = {
+    "int": 1,
+    "float": 1.0,
+    "bool": True,
+}
+
+def main() -> None:
+    """
+    Entry point of the 'harmonics-replay' command.
+    """
+    parser = argparse.ArgumentParser(prog = "harmonics-replay")
+    parser.add_argument("capture_file", help = "file written with CAPTURE_FILE")
+    parser.add_argument(
+        "--target",
+        default = "http://localhost:5000",
+        help = "base URL of the instance to replay against (default: http://localhost:5000)",
+    )
+    parser.add_argument(
+        "--speed",
+        type = float,
+        default = 1.0,
+        help = "how many times faster than captured to replay, e.g. 1, 10 or 100 (default: 1)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type = int,
+        default = 16,
+        help = "maximum requests in flight (default: 16)",
+    )
+    args = parser.parse_args()
+
+    sys.exit(run(args.capture_file, args.target, args.speed, args.concurrency))
+
+def run(capture_file: str, target: str, speed: float, concurrency: int) -> int:
+    """
+    Run the command and return its exit code.
+    """
+    if speed <= 0 or concurrency <= 0:
+        print("The speed and the concurrency must be positive")
+        return 2
+    with open(capture_file, encoding = "utf-8") as file:
+        records = sorted(
+            (json.loads(line) for line in file if line.strip()),
+            key = lambda record: record["time"],
+        )
+    if not records:
+        print(f"No requests captured in '{capture_file}'")
+        return 2
+
+    lock = threading.Lock()
+    results = {}
+
+    def send(record: dict) -> None:
+        outcome = _send(target.rstrip("/") + quote(record["path"], safe = "/?&=%,:+"), record)
+        with lock:
+            results.setdefault(record["route"], []).append(outcome)
+
+    print(f"Replaying {len(records)} requests at {speed:g}x with {concurrency} workers")
+    first = records[0]["time"]
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers = concurrency) as executor:
+        for record in records:
+            delay = start + (record["time"] - first) / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, record)
+    elapsed = time.monotonic() - start
+
+    _report(results, elapsed)
+    return 0
+
+def _send(url: str, record: dict) -> tuple:
+    # Sends a request and returns its status (None if it got no response)
+    # and its latency in seconds
+    data, headers = None, {}
+    if record["body"] is not None:
+        data = json.dumps(_fill(record["body"])).encode("utf-8")
+        headers["Content-Type"] = "application/json"
+
+    started = time.monotonic()
+    try:
+        with urlopen(
+            Request(url, data = data, headers = headers, method = record["method"]),
+            timeout = TIMEOUT_SECONDS,
+        ) as response:
+            response.read()
+            status = response.status
+    except HTTPError as e:
+        status = e.code
+    except (URLError, OSError):
+        status = None
+    return status, time.monotonic() - started
+
+def _fill(shape):
+    # Builds a body with made-up values from its captured shape
+    if isinstance(shape, dict):
+        return {key: _fill(item) for key, item in shape.items()}
+    if isinstance(shape, list):
+        return [_fill(item) for item in shape]
+    if shape == "str":
+        return f"replay-{uuid.uuid4().hex[:12]}"
+    return FILLERS.get(shape)
+
+def _percentile(latencies: list, percentile: int) -> float:
+    # Nearest-rank percentile of sorted latencies
+    rank = max(math.ceil(percentile / 100 * len(latencies)), 1)
+    return latencies[rank - 1]
+
+def _report(results: dict, elapsed: float) -> None:
+    # Prints the throughput, error rates and latencies of each route
+    header = (
+        f"{'route':<45} {'reqs':>6} {'req/s':>8} {'4xx':>6} {'5xx':>6} {'failed':>6} "
+        + " ".join(f"{f'p{percentile} ms':>8}" for percentile in PERCENTILES)
+    )
+    print(header)
+    for route, outcomes in sorted(results.items(), key = lambda item: -len(item[1])):
+        statuses = [status for status, _ in outcomes]
+        latencies = sorted(latency for _, latency in outcomes)
+        print(
+            f"{route:<45} {len(outcomes):>6} {len(outcomes) / elapsed:>8.1f} "
+            f"{_share(statuses, 400, 500):>6} {_share(statuses, 500, 600):>6} "
+            f"{statuses.count(None) / len(statuses):>6.1%} "
+            + " ".join(
+                f"{_percentile(latencies, percentile) * 1000:>8.1f}"
+                for percentile in PERCENTILES
+            )
+        )
+
+    qt_requests = sum(len(outcomes) for outcomes in results.values())
+    print(f"{qt_requests} requests in {elapsed:.1f}s ({qt_requests / elapsed:.1f} req/s)")
+
+def _share(statuses: list, low: int, high: int) -> str:
+    # Formats the share of the statuses in [low, high)
+    share = sum(1 for status in statuses if status is not None and low <= status < high)
+    return f"{share / len(statuses):.1%}"
@@ -85,6 +85,30 @@ class Error(Enum):
         },
         404,
     )
+    NO_FRIEND_RECS_BY_REVIEWS_FOUND = (
+        {
+            "code": "NoFriendRecsByReviewsFound",
+            "message": (
+                "No friend recommendations found for user '{username}' "
+                "by the ratings of release '{release_id}'."
+            ),
+        },
+        404,
+    )
+    SIMILAR_ARTISTS_NOT_FOUND = (
+        {
+            "code": "SimilarArtistsNotFound",
+            "message": "No similar artists found for artist with ID '{id}'.",
+        },
+        404,
+    )
+    NO_MUTUAL_FRIEND_RECS_FOUND = (
+        {
+            "code": "NoMutualFriendRecsFound",
+            "message": "No friend recommendations by mutual friends found for user '{username}'.",
+        },
+        404,
+    )
 
     # Entity already exists errors
     USER_ALREADY_EXISTS = (
@@ -147,6 +171,27 @@ class Error(Enum):
         },
         400,
     )
+    INVALID_QUERY_PARAMETER = (
+        {
+            "code": "InvalidQueryParameter",
+            "message": "Invalid value '{value}' for query parameter '{parameter}'.",
+        },
+        400,
+    )
+    TOO_MANY_IDS = (
+        {
+            "code": "TooManyIds",
+            "message": "At most {max_ids} items can be requested at once.",
+        },
+        400,
+    )
+    UNKNOWN_FIELDS = (
+        {
+            "code": "UnknownFields",
+            "message": "Unknown fields requested: {fields}.",
+        },
+        400,
+    )
     INVALID_REC_METHOD = (
         {
             "code": "InvalidRecMethod",
@@ -183,6 +228,38 @@ class Error(Enum):
         404,
     )
 
+    # Debug errors
+    UNAUTHORIZED = (
+        {
+            "code": "Unauthorized",
+            "message": "Missing or invalid debug token.",
+        },
+        401,
+    )
+    PROFILE_IN_PROGRESS = (
+        {
+            "code": "ProfileInProgress",
+            "message": "A profile is already running in this worker.",
+        },
+        409,
+    )
+
+    # Availability errors
+    DEADLINE_EXCEEDED = (
+        {
+            "code": "DeadlineExceeded",
+            "message": "The request didn't finish within its deadline of {seconds} seconds.",
+        },
+        504,
+    )
+    OVERLOADED = (
+        {
+            "code": "Overloaded",
+            "message": "Too many '{endpoint_class}' requests, retry in {retry_after} seconds.",
+        },
+        503,
+    )
+
     def response(self, **kwargs) -> Tuple[Dict[str, str], int]:
         """Format the error message with provided parameters."""
         body, status_code = self.value
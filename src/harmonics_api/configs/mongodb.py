@@ -3,15 +3,65 @@ Singleton for the connection to MongoDB
 """
 import os
 import dotenv
-from pymongo import MongoClient
+from pymongo import MongoClient, ReadPreference
+from pymongo.monitoring import ConnectionPoolListener
 from pymongo.server_api import ServerApi
+from harmonics_api.utils import tracing
 
 dotenv.load_dotenv()
 
-client = MongoClient(
-    (f"mongodb+srv://{os.getenv('MONGODB_USERNAME')}:{os.getenv('MONGODB_PASSWORD')}"
+URI = (
+    f"mongodb+srv://{os.getenv('MONGODB_USERNAME')}:{os.getenv('MONGODB_PASSWORD')}"
     "@projeto-bd.9scqvyv.mongodb.net/"
-    "?retryWrites=true&w=majority&appName=projeto-bd"),
+    "?retryWrites=true&w=majority&appName=projeto-bd"
+)
+
+# Connections of the pool in use, and checkouts that failed (e.g. waiting for a free one)
+pool_stats = {
+    "checked_out": 0,
+    "max_checked_out": 0,
+    "checkout_failures": 0,
+}
+
+class _PoolListener(ConnectionPoolListener):
+    def connection_checked_out(self, event):
+        pool_stats["checked_out"] += 1
+        if pool_stats["checked_out"] > pool_stats["max_checked_out"]:
+            pool_stats["max_checked_out"] = pool_stats["checked_out"]
+
+    def connection_checked_in(self, event):
+        pool_stats["checked_out"] -= 1
+
+    def connection_check_out_failed(self, event):
+        pool_stats["checkout_failures"] += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+client = MongoClient(
+    URI,
+    event_listeners = [_PoolListener(), *([tracing.CommandListener()] if tracing.ENABLED else [])],
     server_api = ServerApi(
         version = "1",
         strict = True,
@@ -20,3 +70,9 @@ client = MongoClient(
 )
 
 db = client["music_catalog"]
+
+# Same database, with the reads served by the secondaries when one is available
+secondary_db = client.get_database(
+    "music_catalog",
+    read_preference = ReadPreference.SECONDARY_PREFERRED,
+)
@@ -0,0 +1,65 @@
+"""
+Module for the application settings read from the environment.
+"""
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+# "sync" writes to Neo4j inside the request, "outbox" defers it to the outbox worker
+NEO4J_SYNC_MODE = os.getenv("NEO4J_SYNC_MODE", "sync")
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "1.0"))
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "30"))
+
+# "neo4j" runs the recommendation traversals as Cypher queries, "memory" in-process
+GRAPH_ENGINE = os.getenv("GRAPH_ENGINE", "neo4j")
+GRAPH_RESYNC_SECONDS = int(os.getenv("GRAPH_RESYNC_SECONDS", "600"))
+
+# Follower counters are buffered in each worker and flushed this often
+FOLLOWERS_FLUSH_SECONDS = float(os.getenv("FOLLOWERS_FLUSH_SECONDS", "5.0"))
+
+# Where the versions of the similar artists index are written
+SIMILAR_ARTISTS_DIR = os.getenv("SIMILAR_ARTISTS_DIR", "similar_artists")
+
+# "secondary" lets the GET endpoints read from Neo4j followers and MongoDB secondaries,
+# "primary" keeps them on the primaries; READ_ROUTING_OVERRIDES sets it per endpoint
+READ_ROUTING_DEFAULT = os.getenv("READ_ROUTING_DEFAULT", "secondary")
+READ_ROUTING_OVERRIDES = os.getenv("READ_ROUTING_OVERRIDES", "")
+READ_YOUR_WRITES_SECONDS = int(os.getenv("READ_YOUR_WRITES_SECONDS", "30"))
+# Key signing the Harmonics-Consistency tokens, shared by the workers that honor each other's
+CONSISTENCY_SECRET = os.getenv("CONSISTENCY_SECRET", "")
+
+# Concurrent requests and waiting requests of each endpoint class ("class=amount,...")
+ADMISSION_LIMITS = os.getenv(
+    "ADMISSION_LIMITS",
+    "recs=8,search=16,export=2,catalog=64,writes=32",
+)
+ADMISSION_QUEUES = os.getenv(
+    "ADMISSION_QUEUES",
+    "recs=16,search=32,export=0,catalog=128,writes=64",
+)
+ADMISSION_WAIT_SECONDS = float(os.getenv("ADMISSION_WAIT_SECONDS", "1.0"))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "1"))
+
+# Time each request has for its queries, and per-endpoint overrides ("endpoint=seconds,...")
+DEADLINE_SECONDS = float(os.getenv("DEADLINE_SECONDS", "10.0"))
+DEADLINE_OVERRIDES = os.getenv("DEADLINE_OVERRIDES", "")
+
+# Bearer token of the '/debug' endpoints, which are disabled without one
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN", "")
+
+# Where the request traces are written (tracing is off without it), and how they're rotated
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(10 * 1024 * 1024)))
+TRACE_BACKUP_COUNT = int(os.getenv("TRACE_BACKUP_COUNT", "5"))
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+# Times a query shape can run in a request before the request is flagged
+TRACE_REPEAT_THRESHOLD = int(os.getenv("TRACE_REPEAT_THRESHOLD", "10"))
+
+# Where the sampled requests are captured for replays (capture is off without it)
+CAPTURE_FILE = os.getenv("CAPTURE_FILE", "")
+CAPTURE_SAMPLE_RATE = float(os.getenv("CAPTURE_SAMPLE_RATE", "1.0"))
+
+# Records per MongoDB batch, Neo4j fetch and checkpoint of the exports
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
@@ -1,24 +1,118 @@
 """
 Server for the Harmonics API
 """
+import argparse
+import sys
 from flask import Flask
 from harmonics_api.configs import mongodb, neo4j
-from harmonics_api.routes import artists, releases, users, recs
+from harmonics_api.commands import ingest, migrate, migrate_ratings, rebuild
+from harmonics_api.routes import artists, releases, users, recs, metrics, search, debug, export
+from harmonics_api.utils import (
+    admission, capture, deadlines, followers, graph, outbox, profiler, routing, tracing,
+)
 
 def main() -> None:
+    """
+    Entry point of the 'harmonics-api' command. Runs the server when no
+    subcommand is given.
+    """
+    parser = argparse.ArgumentParser(prog = "harmonics-api")
+    subparsers = parser.add_subparsers(dest = "command")
+    subparsers.add_parser("serve", help = "run the API server (default)")
+    subparsers.add_parser(
+        "migrate",
+        help = "create indexes and constraints and verify the query plans",
+    )
+    rebuild_parser = subparsers.add_parser(
+        "rebuild",
+        help = "rebuild the data derived from the catalog",
+    )
+    rebuild_parser.add_argument(
+        "targets",
+        nargs = "*",
+        help = f"what to rebuild, among {', '.join(rebuild.TARGETS)} (default: everything)",
+    )
+    migrate_ratings_parser = subparsers.add_parser(
+        "migrate-ratings",
+        help = "move the embedded ratings into the 'ratings' collection, while the API serves",
+    )
+    migrate_ratings_parser.add_argument(
+        "--batch-size",
+        type = int,
+        default = 500,
+        help = "number of ratings copied per write (default: 500)",
+    )
+    ingest_parser = subparsers.add_parser(
+        "ingest",
+        help = "upsert the artists, releases and tracks of JSON files into the catalog",
+    )
+    ingest_parser.add_argument(
+        "paths",
+        nargs = "+",
+        help = "JSON files with a list of artists, or NDJSON files ('.ndjson', '.jsonl')",
+    )
+    ingest_parser.add_argument(
+        "--workers",
+        type = int,
+        default = 4,
+        help = "number of batches ingested in parallel (default: 4)",
+    )
+    ingest_parser.add_argument(
+        "--batch-size",
+        type = int,
+        default = 100,
+        help = "number of artists per bulk write (default: 100)",
+    )
+    args = parser.parse_args()
+
+    exit_code = 0
+    match args.command:
+        case "migrate":
+            exit_code = migrate.run()
+        case "rebuild":
+            exit_code = rebuild.run(args.targets)
+        case "migrate-ratings":
+            exit_code = migrate_ratings.run(args.batch_size)
+        case "ingest":
+            exit_code = ingest.run(args.paths, args.workers, args.batch_size)
+        case _:
+            serve()
+
+    mongodb.client.close()
+    neo4j.driver.close()
+    sys.exit(exit_code)
+
+def serve() -> None:
+    """
+    Run the API server.
+    """
     app = Flask("Harmonics API")
     app.json.sort_keys = False
     app.url_map.strict_slashes = False
+    capture.init_app(app)
+    admission.init_app(app)
+    deadlines.init_app(app)
+    profiler.init_app(app)
+    tracing.init_app(app)
+    routing.init_app(app)
 
     app.register_blueprint(artists.bp, url_prefix = "/v1/artists")
     app.register_blueprint(releases.bp, url_prefix = "/v1/releases")
     app.register_blueprint(users.bp, url_prefix = "/v1/users")
     app.register_blueprint(recs.bp, url_prefix = "/v1/recs")
+    app.register_blueprint(search.bp, url_prefix = "/v1/search")
+    app.register_blueprint(metrics.bp, url_prefix = "/v1/metrics")
+    app.register_blueprint(export.bp, url_prefix = "/v1/export")
+    app.register_blueprint(debug.bp, url_prefix = "/debug")
 
-    app.run(debug = True)
+    if outbox.ENABLED:
+        outbox.start_worker()
+    if graph.ENABLED:
+        graph.start()
+    followers.start()
 
-    mongodb.client.close()
-    neo4j.driver.close()
+    app.run(debug = True)
+    followers.flush()
 
 if __name__=="__main__":
     main()
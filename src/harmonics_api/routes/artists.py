@@ -1,152 +1,186 @@
 """
 Module for the 'artists/' route.
 """
-from flask import Blueprint, jsonify
-from harmonics_api.configs import mongodb
+from flask import Blueprint, jsonify, request
 from harmonics_api.configs.errors import Error
+from harmonics_api.utils import coalesce, helper, similar, views
 
 bp = Blueprint("artists", __name__)
 
+MAX_IDS = 100
+MAX_SIMILAR = 50
+
+# View fields read for each optional field of the artist resource, the ID is always included
+ARTIST_VIEW_FIELDS = {
+    "name": ("name",),
+    "genres": ("genres",),
+    "bio": ("bio",),
+    "qt_followers": ("qt_followers",),
+    "average_rating": ("rating_sum", "qt_ratings"),
+    "releases": ("releases",),
+}
+
+def view_fields(fields: list) -> tuple:
+    """
+    Get the view fields needed for the given artist resource fields.
+    """
+    return tuple(
+        view_field
+        for field in fields
+        for view_field in ARTIST_VIEW_FIELDS[field]
+    )
+
+def artist_resource(view: dict, fields: list) -> dict:
+    """
+    Build the artist resource, with the given fields, from the artist's view.
+    """
+    artist = {
+        "id": view["_id"],
+    }
+    for field in fields:
+        if field == "average_rating":
+            artist[field] = (
+                view["rating_sum"] / view["qt_ratings"] if view["qt_ratings"] > 0 else None
+            )
+        else:
+            artist[field] = view[field]
+    return artist
+
+@bp.route("/", methods = ["GET"])
+def get_artists():
+    """
+    Endpoint for getting several artist resources by artist IDs, in the order
+    requested.
+    """
+    artist_ids = helper.split_list_parameter(request.args.get("ids", default = "", type = str))
+    if not artist_ids:
+        body, code = Error.NO_QUERY_PARAMETER.response(parameter = "ids")
+        return jsonify(body), code
+    if len(artist_ids) > MAX_IDS:
+        body, code = Error.TOO_MANY_IDS.response(max_ids = MAX_IDS)
+        return jsonify(body), code
+    fields, unknown_fields = helper.parse_fields(
+        request.args.get("fields"),
+        ARTIST_VIEW_FIELDS,
+        "id",
+    )
+    if unknown_fields:
+        body, code = Error.UNKNOWN_FIELDS.response(fields = ", ".join(unknown_fields))
+        return jsonify(body), code
+
+    views_found = views.get_artist_views(list(set(artist_ids)), view_fields(fields))
+
+    items = []
+    for artist_id in artist_ids:
+        if artist_id in views_found:
+            items.append(artist_resource(views_found[artist_id], fields))
+            continue
+        body, _ = Error.ARTIST_NOT_FOUND.response(id = artist_id)
+        items.append({
+            "id": artist_id,
+            "error": body,
+        })
+
+    return jsonify({"items": items}), 200
+
 @bp.route("/<artist_id>", methods = ["GET"])
 def get_artist(artist_id):
     """
     Endpoint for getting the artist resource by artist ID.
     """
-    artist_cursor = mongodb.db.artists.aggregate([
-        {
-            "$match": {
-                "_id": artist_id
-            }
-        },
-        {
-            "$addFields": {
-                "allRatings": {
-                    "$reduce": {
-                        "input": "$releases",
-                        "initialValue": [],
-                        "in": {
-                            "$concatArrays": [
-                                "$$value",
-                                "$$this.ratings"
-                            ]
-                        }
-                    }
-                },
-                "mappedReleases": {
-                    "$map": {
-                        "input": "$releases",
-                        "as": "release",
-                        "in": {
-                            "id": "$$release.id",
-                            "name": "$$release.name",
-                            "release_year": {
-                                "$year": {
-                                    "$dateFromString": {
-                                        "dateString": "$$release.release_date"
-                                    }
-                                }
-                            }
-                        }
-                    }
-                }
-            }
-        },
-        {
-            "$project": {
-                "_id": False,
-                "id": "$_id",
-                "name": True,
-                "genres": True,
-                "bio": True,
-                "qt_followers": True,
-                "average_rating": {
-                    "$cond": {
-                        "if": {
-                            "$gt": [{"$size": "$allRatings"}, 0],
-                        },
-                        "then": {
-                            "$avg": "$allRatings.rating"
-                        },
-                        "else": None
-                    }
-                },
-                "releases": "$mappedReleases"
-            }
-        }
-    ])
+    fields, unknown_fields = helper.parse_fields(
+        request.args.get("fields"),
+        ARTIST_VIEW_FIELDS,
+        "id",
+    )
+    if unknown_fields:
+        body, code = Error.UNKNOWN_FIELDS.response(fields = ", ".join(unknown_fields))
+        return jsonify(body), code
+
+    # The ETag is built before the artist is read, so it can only be older
+    # than the response, never newer
+    etag = helper.get_etag("artist", artist_id, fields)
+    if etag is None:
+        body, code = Error.ARTIST_NOT_FOUND.response(id = artist_id)
+        return jsonify(body), code
+    if request.if_none_match.contains(etag):
+        return helper.not_modified(etag)
 
-    artists_retrieved = tuple(artist_cursor)
-    if not artists_retrieved:
+    view = coalesce.do(
+        "artist",
+        (artist_id, view_fields(fields)),
+        lambda: views.get_artist_view(artist_id, view_fields(fields)),
+    )
+    if not view:
         body, code = Error.ARTIST_NOT_FOUND.response(id = artist_id)
         return jsonify(body), code
 
-    return jsonify(artists_retrieved[0]), 200
+    response = jsonify(artist_resource(view, fields))
+    response.set_etag(etag)
+    return response, 200
 
 @bp.route("/<artist_id>/tracks", methods = ["GET"])
 def get_artist_tracks(artist_id):
     """
     Endpoint for getting all tracks from an artist in alphabetical order.
     """
-    tracks_cursor = mongodb.db.artists.aggregate([
-        {
-            "$match": {
-                "_id": artist_id,
-            },
-        },
-        {
-            "$unwind": "$releases",
-        },
-        {
-            "$unwind": "$releases.tracks",
-        },
-        {
-            "$group": {
-                "_id": {
-                    "artist_id": "$_id",
-                    "artist_name": "$name",
-                    "track_name": "$releases.tracks.name"
-                },
-                "releases": {
-                    "$push": {
-                        "id": "$releases.id",
-                        "name": "$releases.name",
-                    },
-                },
-            },
-        },
-        {
-            "$group": {
-                "_id": {
-                    "id": "$_id.artist_id",
-                    "name": "$_id.artist_name"
-                },
-                "items": {
-                    "$push": {
-                        "name": "$_id.track_name",
-                        "releases": "$releases",
-                    },
-                },
-            },
-        },
-        {
-            "$project": {
-                "_id": False,
-                "artist": "$_id",
-                "items": {
-                    "$sortArray": {
-                        "input": "$items",
-                        "sortBy": {
-                            "name": 1,
-                        },
-                    },
-                },
-            },
+    view = coalesce.do(
+        "artist",
+        (artist_id, ("name", "tracks")),
+        lambda: views.get_artist_view(artist_id, ("name", "tracks")),
+    )
+    if not view:
+        body, code = Error.ARTIST_NOT_FOUND.response(id = artist_id)
+        return jsonify(body), code
+
+    tracks = {
+        "artist": {
+            "id": view["_id"],
+            "name": view["name"],
         },
-    ])
+        "items": view["tracks"],
+    }
+
+    return jsonify(tracks), 200
+
+@bp.route("/<artist_id>/similar", methods = ["GET"])
+def get_similar_artists(artist_id):
+    """
+    Endpoint for getting the artists most similar to an artist, by their
+    followers and genres.
+    """
+    value = request.args.get("limit")
+    limit = helper.parse_limit(value, 10, MAX_SIMILAR)
+    if limit is None:
+        body, code = Error.INVALID_QUERY_PARAMETER.response(value = value, parameter = "limit")
+        return jsonify(body), code
 
-    tracks_results = tuple(tracks_cursor)
-    if not tracks_results:
-        body, code =  Error.ARTIST_NOT_FOUND.response(id = artist_id)
+    similar_artists = similar.get_similar(artist_id, limit)
+    if similar_artists is None:
+        if not helper.exists("artist", artist_id):
+            body, code = Error.ARTIST_NOT_FOUND.response(id = artist_id)
+            return jsonify(body), code
+        body, code = Error.SIMILAR_ARTISTS_NOT_FOUND.response(id = artist_id)
         return jsonify(body), code
 
-    return jsonify(tracks_results[0]), 200
+    views_found = views.get_artist_views(
+        [similar_artist["id"] for similar_artist in similar_artists],
+        ("name",),
+    )
+
+    similar_items = {
+        "artist": {
+            "id": artist_id,
+        },
+        "items": [
+            {
+                "id": similar_artist["id"],
+                "name": views_found[similar_artist["id"]]["name"],
+                "score": similar_artist["score"],
+            }
+            for similar_artist in similar_artists
+            if similar_artist["id"] in views_found
+        ],
+    }
+
+    return jsonify(similar_items), 200
@@ -0,0 +1,50 @@
+"""
+Module for the 'debug/' route.
+"""
+import hmac
+from flask import Blueprint, Response, jsonify, request
+from harmonics_api.configs import settings
+from harmonics_api.configs.errors import Error
+from harmonics_api.utils import profiler
+
+bp = Blueprint("debug", __name__)
+
+@bp.before_request
+def authenticate():
+    """
+    Only let through the requests with the debug token, and none if there's
+    no debug token set.
+    """
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not settings.DEBUG_TOKEN or not hmac.compare_digest(token, settings.DEBUG_TOKEN):
+        body, code = Error.UNAUTHORIZED.response()
+        return jsonify(body), code
+    return None
+
+@bp.route("/profile", methods = ["GET"])
+def get_profile():
+    """
+    Endpoint for sampling the stacks of this worker's request threads for
+    some seconds, as JSON or as collapsed stacks for flame graphs.
+    """
+    value = request.args.get("seconds", default = "10", type = str)
+    try:
+        seconds = float(value)
+    except ValueError:
+        seconds = None
+    if seconds is None or not 0 < seconds <= profiler.MAX_SECONDS:
+        body, code = Error.INVALID_QUERY_PARAMETER.response(value = value, parameter = "seconds")
+        return jsonify(body), code
+    output = request.args.get("format", default = "json", type = str)
+    if output not in ("json", "collapsed"):
+        body, code = Error.INVALID_QUERY_PARAMETER.response(value = output, parameter = "format")
+        return jsonify(body), code
+
+    result = profiler.profile(seconds)
+    if result is None:
+        body, code = Error.PROFILE_IN_PROGRESS.response()
+        return jsonify(body), code
+
+    if output == "collapsed":
+        return Response(result["collapsed"] + "\n", mimetype = "text/plain"), 200
+    return jsonify(result), 200
@@ -0,0 +1,68 @@
+"""
+Module for the 'export/' route.
+"""
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from harmonics_api.configs.errors import Error
+from harmonics_api.utils import export
+
+bp = Blueprint("export", __name__)
+
+NDJSON = "application/x-ndjson"
+
+@bp.route("/artists", methods = ["GET"])
+def export_artists():
+    """
+    Endpoint for streaming every artist as NDJSON, resuming after the
+    checkpoint in 'after' if given.
+    """
+    after = export.decode_checkpoint(request.args.get("after"), 1)
+    if after is None:
+        body, code = Error.INVALID_QUERY_PARAMETER.response(
+            value = request.args.get("after"),
+            parameter = "after",
+        )
+        return jsonify(body), code
+
+    return Response(stream_with_context(export.artists(after)), mimetype = NDJSON), 200
+
+@bp.route("/users", methods = ["GET"])
+def export_users():
+    """
+    Endpoint for streaming every user as NDJSON, resuming after the
+    checkpoint in 'after' if given.
+    """
+    after = export.decode_checkpoint(request.args.get("after"), 1)
+    if after is None:
+        body, code = Error.INVALID_QUERY_PARAMETER.response(
+            value = request.args.get("after"),
+            parameter = "after",
+        )
+        return jsonify(body), code
+
+    return Response(stream_with_context(export.users(after)), mimetype = NDJSON), 200
+
+@bp.route("/edges", methods = ["GET"])
+def export_edges():
+    """
+    Endpoint for streaming every relationship of a type as NDJSON, resuming
+    after the checkpoint in 'after' if given.
+    """
+    edge_type = request.args.get("type", type = str)
+    if not edge_type:
+        body, code = Error.NO_QUERY_PARAMETER.response(parameter = "type")
+        return jsonify(body), code
+    if edge_type not in export.EDGE_QUERIES:
+        body, code = Error.INVALID_QUERY_PARAMETER.response(value = edge_type, parameter = "type")
+        return jsonify(body), code
+    after = export.decode_checkpoint(request.args.get("after"), 2)
+    if after is None:
+        body, code = Error.INVALID_QUERY_PARAMETER.response(
+            value = request.args.get("after"),
+            parameter = "after",
+        )
+        return jsonify(body), code
+
+    return Response(
+        stream_with_context(export.edges(edge_type, after)),
+        mimetype = NDJSON,
+    ), 200
@@ -0,0 +1,50 @@
+"""
+Module for the 'metrics/' route.
+"""
+from flask import Blueprint, jsonify
+from harmonics_api.utils import admission, coalesce, followers, graph, outbox, tracing
+
+bp = Blueprint("metrics", __name__)
+
+@bp.route("/outbox", methods = ["GET"])
+def get_outbox_metrics():
+    """
+    Endpoint for getting the Neo4j sync backlog and lag.
+    """
+    return jsonify(outbox.metrics()), 200
+
+@bp.route("/graph", methods = ["GET"])
+def get_graph_metrics():
+    """
+    Endpoint for getting the size and resync state of the in-process graph.
+    """
+    return jsonify(graph.metrics()), 200
+
+@bp.route("/coalescing", methods = ["GET"])
+def get_coalescing_metrics():
+    """
+    Endpoint for getting how many reads of each kind were coalesced.
+    """
+    return jsonify(coalesce.stats), 200
+
+@bp.route("/followers", methods = ["GET"])
+def get_followers_metrics():
+    """
+    Endpoint for getting the follower deltas waiting for a flush.
+    """
+    return jsonify(followers.metrics()), 200
+
+@bp.route("/admission", methods = ["GET"])
+def get_admission_metrics():
+    """
+    Endpoint for getting the load and shed requests of each endpoint class.
+    """
+    return jsonify(admission.metrics()), 200
+
+@bp.route("/tracing", methods = ["GET"])
+def get_tracing_metrics():
+    """
+    Endpoint for getting how many requests were traced and flagged for
+    repeating a query.
+    """
+    return jsonify(tracing.metrics()), 200
@@ -3,12 +3,85 @@ Module for the 'recs/' route.
 """
 import random
 from flask import Blueprint, jsonify, request
-from harmonics_api.configs import mongodb, neo4j
 from harmonics_api.configs.errors import Error
-from harmonics_api.utils import helper
+from harmonics_api.utils import coalesce, graph, helper, leaderboard, mutuals, routing
 
 bp = Blueprint("recs", __name__)
 
+ARTIST_RECS = 10
+GENRE_CANDIDATES = 200
+
+# The most popular artists of a genre are the same for every user, so artist
+# recommendations read them apart from the user's top genre (and the artists
+# of it the user follows), which lets concurrent requests share that read
+TOP_GENRE_QUERY = """
+    MATCH (:User {username: $username})-[:FOLLOWS]->(a:Artist)-[:BELONGS_TO]->(g:Genre)
+    WITH g.name AS genre, collect(DISTINCT a.id) AS followed_ids
+    ORDER BY size(followed_ids) DESC
+    LIMIT 1
+    RETURN genre, followed_ids
+    """
+
+GENRE_CANDIDATES_QUERY = """
+    MATCH (a:Artist)-[:BELONGS_TO]->(:Genre {name: $genre})
+    RETURN a.id AS id
+    ORDER BY a.score DESC
+    LIMIT $limit
+    """
+
+# Each other Neo4j recommendation method is a single statement: the top genre (or rated
+# release) of the user is found first and the candidates are collected by a
+# subquery, which always returns one row. No rows means the user has no
+# genre (or rating) data, and an empty list means no recommendations.
+ARTIST_RECS_QUERY = """
+    MATCH (:User {username: $username})-[:FOLLOWS]->(a:Artist)-[:BELONGS_TO]->(g:Genre)
+    WITH g.name AS genre, count(DISTINCT a) AS genre_follows
+    ORDER BY genre_follows DESC
+    LIMIT 1
+    CALL {
+        WITH genre
+        MATCH (a:Artist)-[:BELONGS_TO]->(:Genre {name: genre})
+        WHERE NOT EXISTS {
+            MATCH (:User {username: $username})-[:FOLLOWS]->(a)
+        }
+        WITH a
+        ORDER BY a.score DESC
+        LIMIT 10
+        RETURN collect(a.id) AS artist_ids
+    }
+    RETURN genre, artist_ids
+    """
+
+FRIENDS_RATINGS_QUERY = """
+    MATCH (u:User {username: $username})-[:FRIENDS_WITH]-(friend:User)-[r:RATED]->(rel:Release)
+    WHERE r.rating >= 6
+    RETURN friend.username AS friend_username, rel.id AS release_id, r.rating AS rating
+    ORDER BY r.rating DESC
+    LIMIT 10
+    """
+
+FRIEND_RECS_BY_REVIEWS_QUERY = """
+    MATCH (:User {username: $username})-[r:RATED]->(rel:Release)
+    WHERE r.rating >= 6
+    WITH rel
+    ORDER BY rand()
+    LIMIT 1
+    CALL {
+        WITH rel
+        MATCH (u:User)-[r:RATED]->(rel)
+        WHERE r.rating >= 6
+        AND NOT EXISTS {
+            MATCH (:User {username: $username})-[:FRIENDS_WITH]-(u)
+        }
+        AND u.username <> $username
+        WITH u, r
+        ORDER BY r.rating DESC
+        LIMIT 10
+        RETURN collect({username: u.username, rating: r.rating}) AS candidates
+    }
+    RETURN rel.id AS release_id, candidates
+    """
+
 @bp.route("/<username>/artists", methods = ["GET"])
 def get_artist_recs_by_genre(username):
     """
@@ -18,46 +91,27 @@ def get_artist_recs_by_genre(username):
         body, code = Error.USER_NOT_FOUND.response(username = username)
         return jsonify(body), code
 
-    genre_result = neo4j.driver.execute_query(
-        """
-        MATCH (:User {username: $username})-[:FOLLOWS]->(a:Artist)-[:BELONGS_TO]->(g:Genre)
-        WITH g.name AS genre, count(DISTINCT a) AS follows_count
-        ORDER BY follows_count DESC
-        LIMIT 1
-        RETURN genre
-        """,
-        username=username,
-    )
+    if graph.ENABLED:
+        recs = graph.artist_recs(username)
+    else:
+        recs = get_artist_recs(username)
 
-    if not genre_result.records:
+    if not recs:
         body, code = Error.NO_GENRE_DATA_FOUND.response(username=username)
         return jsonify(body), code
 
-    most_common_genre = genre_result.records[0]["genre"]
+    most_common_genre = recs["genre"]
 
-    records, _, _ = neo4j.driver.execute_query(
-        """
-        MATCH (a:Artist)-[:BELONGS_TO]->(g:Genre {name: $genre})
-        WHERE NOT EXISTS {
-            MATCH (u:User {username: $username})-[:FOLLOWS]->(a)
-        }
-        ORDER BY a.popularity DESC
-        LIMIT 10
-        RETURN a.id AS id
-        """,
-        genre=most_common_genre,
-        username=username,
-    )
-    if not records:
+    if not recs["artist_ids"]:
         body, code = Error.ARTIST_RECS_NOT_FOUND.response(
             username=username,
             genre=most_common_genre,
         )
         return jsonify(body), code
 
-    selected_artist_id = random.choice(records)["id"]
+    selected_artist_id = random.choice(recs["artist_ids"])
 
-    artist = mongodb.db.artists.find_one(
+    artist = routing.db().artists.find_one(
         {
             "_id": selected_artist_id,
         },
@@ -82,6 +136,44 @@ def get_artist_recs_by_genre(username):
 
     return jsonify(response), 200
 
+def get_artist_recs(username: str) -> dict | None:
+    """
+    Get the user's top genre and the most popular artists of it the user
+    doesn't follow, or None if the user follows no artist with a genre.
+    """
+    top_genre = routing.read_single(TOP_GENRE_QUERY, username = username)
+    if not top_genre:
+        return None
+
+    genre = top_genre["genre"]
+    candidates = coalesce.do(
+        "genre_candidates",
+        genre,
+        lambda: get_genre_candidates(genre),
+    )
+    followed_ids = set(top_genre["followed_ids"])
+    artist_ids = [artist_id for artist_id in candidates if artist_id not in followed_ids]
+
+    # Only a user following nearly all the candidates needs the per-user query
+    if len(artist_ids) < ARTIST_RECS and len(candidates) == GENRE_CANDIDATES:
+        return routing.read_single(ARTIST_RECS_QUERY, username = username)
+
+    return {
+        "genre": genre,
+        "artist_ids": artist_ids[:ARTIST_RECS],
+    }
+
+def get_genre_candidates(genre: str) -> list:
+    """
+    Get the IDs of the most popular artists of a genre.
+    """
+    records = routing.read(
+        GENRE_CANDIDATES_QUERY,
+        genre = genre,
+        limit = GENRE_CANDIDATES,
+    )
+    return [record["id"] for record in records]
+
 @bp.route("/<username>/releases", methods = ["GET"])
 def get_release_recs_by_friends(username):
     """
@@ -91,19 +183,13 @@ def get_release_recs_by_friends(username):
         body, code = Error.USER_NOT_FOUND.response(username=username)
         return jsonify(body), code
 
-    friends_rating = neo4j.driver.execute_query(
-        """
-        MATCH (u:User {username: $username})-[:FRIENDS_WITH]-(friend:User)-[r:RATED]->(rel:Release)
-        WHERE r.rating >= 6
-        RETURN friend.username AS friend_username, rel.id AS release_id, r.rating AS rating
-        ORDER BY r.rating DESC
-        LIMIT 10
-        """,
-        username = username
-    )
+    if graph.ENABLED:
+        records = graph.friends_ratings(username)
+    else:
+        records = routing.read(FRIENDS_RATINGS_QUERY, username = username)
 
     results = []
-    for record in friends_rating.records:
+    for record in records:
         results.append({
             "friend_username": record["friend_username"],
             "release_id": record["release_id"],
@@ -115,29 +201,9 @@ def get_release_recs_by_friends(username):
 
     result = random.choice(results)
 
-    release_cursor = mongodb.db.artists.aggregate([
-        {
-            "$match": {
-                "releases.id": result["release_id"],
-            },
-        },
-        {
-            "$unwind": "$releases",
-        },
-        {
-            "$match": {
-                "releases.id": result["release_id"],
-            },
-        },
-        {
-            "$project": {
-                "_id": False,
-                "id": "$releases.id",
-                "name": "$releases.name",
-                "artist": "$name",
-            },
-        },
-    ])
+    release_cursor = routing.db().artists.aggregate(
+        helper.release_summary_pipeline(result["release_id"]),
+    )
 
     release_results = tuple(release_cursor)
 
@@ -167,7 +233,7 @@ def get_friend_recs(username):
         )
         return jsonify(body), code
 
-    valid_methods = ["genre", "reviews"]
+    valid_methods = ["genre", "reviews", "mutual"]
     if by not in valid_methods:
         body, code = Error.INVALID_REC_METHOD.response(
             method=by,
@@ -180,51 +246,41 @@ def get_friend_recs(username):
 
     if by == "genre":
         return get_friend_recs_by_genre(username)
+    if by == "mutual":
+        return get_friend_recs_by_mutual(username)
     return get_friend_recs_by_reviews(username)
 
 def get_friend_recs_by_genre(username):
     """
     Endpoint for getting friend recommendations by genre affinity.
     """
-    genre_result = neo4j.driver.execute_query(
-        """
-        MATCH (:User {username: $username})-[:FOLLOWS]->(a:Artist)-[:BELONGS_TO]->(g:Genre)
-        WITH g.name AS genre, count(DISTINCT a) AS follows_count
-        ORDER BY follows_count DESC
-        LIMIT 1
-        RETURN genre
-        """,
-        username=username,
-    )
+    most_common_genre = leaderboard.get_top_genre(username)
 
-    if not genre_result.records:
+    if not most_common_genre:
         body, code = Error.NO_GENRE_DATA_FOUND.response(username = username)
         return jsonify(body), code
 
-    most_common_genre = genre_result.records[0]["genre"]
-
-    recs_result = neo4j.driver.execute_query(
-        """
-        MATCH (u:User)-[:FOLLOWS]->(a:Artist)-[:BELONGS_TO]->(g:Genre {name: $genre})
-        WHERE NOT EXISTS {
-            MATCH (:User {username: $username})-[:FRIENDS_WITH]-(u)
-        }
-        WITH u, count(a) AS follows_count
-        ORDER BY follows_count DESC
-        LIMIT 10
-        RETURN u.username AS recommended_user
-        """,
-        genre=most_common_genre,
-        username=username,
+    user = routing.db().users.find_one(
+        {
+            "username": username,
+        },
+        {
+            "friends": True,
+        },
+    )
+    recommended_users = leaderboard.get_top_users(
+        most_common_genre,
+        {username, *user["friends"]},
+        10,
     )
 
-    if not recs_result.records:
+    if not recommended_users:
         body, code = Error.NO_FRIEND_RECS_FOUND.response(username=username, genre=most_common_genre)
         return jsonify(body), code
 
-    selected_username = random.choice(recs_result.records)["recommended_user"]
+    selected_username = random.choice(recommended_users)
 
-    user_details = mongodb.db.users.find_one(
+    user_details = routing.db().users.find_one(
         {
             "username": selected_username,
         },
@@ -257,56 +313,30 @@ def get_friend_recs_by_reviews(username):
     """
     Endpoint for getting friend recommendations by review similarity.
     """
-    # Get user's highest rated releases
-    reviews = neo4j.driver.execute_query(
-        """
-        MATCH (u:User {username: $username})-[r:RATED]->(rel:Release)
-        WHERE r.rating >= 6
-        RETURN rel.id AS release_id, r.rating AS rating
-        ORDER BY r.rating DESC
-        """,
-        username = username
-    )
+    # One of the user's highest rated releases is picked at random in the query
+    if graph.ENABLED:
+        recs = graph.friend_recs_by_reviews(username)
+    else:
+        recs = routing.read_single(FRIEND_RECS_BY_REVIEWS_QUERY, username = username)
 
-    rated_releases = []
-    for record in reviews.records:
-        rated_releases.append(record["release_id"])
-
-    if not rated_releases:
+    if not recs:
         body, code = Error.NO_RATINGS_FOUND.response(username = username)
         return jsonify(body), code
 
-    selected_release = random.choice(rated_releases)
-
-    rated_reviews = neo4j.driver.execute_query(
-        """
-        MATCH (u:User)-[r:RATED]->(rel:Release)
-        WHERE rel.id = $release_id
-        AND r.rating >= 6
-        AND NOT EXISTS {
-            MATCH (:User {username: $username})-[:FRIENDS_WITH]-(u)
-        }
-        AND u.username <> $username
-        RETURN u.username AS username, r.rating AS rating
-        ORDER BY r.rating DESC
-        LIMIT 10
-        """,
-        release_id=selected_release,
-        username=username
-    )
+    selected_release = recs["release_id"]
 
-    if not rated_reviews.records:
-        body, code = Error.NO_FRIEND_RECS_FOUND.response(
+    if not recs["candidates"]:
+        body, code = Error.NO_FRIEND_RECS_BY_REVIEWS_FOUND.response(
             username = username,
             release_id = selected_release,
         )
         return jsonify(body), code
 
-    recommended_user = random.choice(rated_reviews.records)
+    recommended_user = random.choice(recs["candidates"])
     selected_username = recommended_user["username"]
     friend_rating = recommended_user["rating"]
 
-    user_details = mongodb.db.users.find_one(
+    user_details = routing.db().users.find_one(
         {
             "username": selected_username,
         },
@@ -326,29 +356,9 @@ def get_friend_recs_by_reviews(username):
         body, code = Error.USER_NOT_FOUND.response(username=selected_username)
         return jsonify(body), code
 
-    release_cursor = mongodb.db.artists.aggregate([
-        {
-            "$match": {
-                "releases.id": selected_release,
-            },
-        },
-        {
-            "$unwind": "$releases",
-        },
-        {
-            "$match": {
-                "releases.id": selected_release,
-            },
-        },
-        {
-            "$project": {
-                "_id": False,
-                "id": "$releases.id",
-                "name": "$releases.name",
-                "artist": "$name",
-            },
-        },
-    ])
+    release_cursor = routing.db().artists.aggregate(
+        helper.release_summary_pipeline(selected_release),
+    )
 
     release_results = tuple(release_cursor)
 
@@ -367,3 +377,48 @@ def get_friend_recs_by_reviews(username):
     }
 
     return jsonify(response), 200
+
+def get_friend_recs_by_mutual(username):
+    """
+    Endpoint for getting friend recommendations by mutual friends.
+    """
+    candidates = mutuals.get_candidates(username)
+
+    if not candidates:
+        body, code = Error.NO_MUTUAL_FRIEND_RECS_FOUND.response(username = username)
+        return jsonify(body), code
+
+    recommended_user = random.choice(candidates)
+
+    user_details = routing.db().users.find_one(
+        {
+            "username": recommended_user["username"],
+        },
+        {
+            "_id": False,
+            "username": True,
+            "name": {
+                "$ifNull": ["$name", None],
+            },
+            "bio": {
+                "$ifNull": ["$bio", None],
+            },
+        },
+    )
+
+    if not user_details:
+        body, code = Error.USER_NOT_FOUND.response(username = recommended_user["username"])
+        return jsonify(body), code
+
+    response = {
+        "user": {
+            "username": user_details["username"],
+            "name": user_details["name"],
+            "bio": user_details["bio"],
+        },
+        "by": {
+            "mutual_friends": recommended_user["mutual_friends"],
+        },
+    }
+
+    return jsonify(response), 200
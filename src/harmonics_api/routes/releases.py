@@ -1,21 +1,58 @@
 """
 Module for the 'releases/' route.
 """
-from flask import Blueprint, jsonify
-from harmonics_api.configs import mongodb
+from flask import Blueprint, jsonify, request
 from harmonics_api.configs.errors import Error
+from harmonics_api.utils import coalesce, helper, ratings, routing
 
 bp = Blueprint("releases", __name__)
 
-@bp.route("/<release_id>", methods = ["GET"])
-def get_release(release_id):
+MAX_IDS = 100
+
+# Projection of each optional field of the release resource, the ID is always included
+RELEASE_PROJECTION = {
+    "name": "$releases.name",
+    "artist": {
+        "id": "$_id",
+        "name": "$name",
+    },
+    "release_date": "$releases.release_date",
+    # Releases not migrated to the 'ratings' collection yet still embed their ratings
+    "rating_average": {
+        "$cond": {
+            "if": {
+                "$isArray": "$releases.ratings",
+            },
+            "then": {
+                "$avg": "$releases.ratings.rating",
+            },
+            "else": {
+                "$cond": {
+                    "if": {
+                        "$gt": [{"$ifNull": ["$releases.qt_ratings", 0]}, 0],
+                    },
+                    "then": {
+                        "$divide": ["$releases.rating_sum", "$releases.qt_ratings"],
+                    },
+                    "else": None,
+                },
+            },
+        },
+    },
+    "tracks": "$releases.tracks",
+}
+
+def release_pipeline(release_ids: list, fields: list = tuple(RELEASE_PROJECTION)) -> list:
     """
-    Endpoint for getting the release resource by release ID.
+    Build the aggregation pipeline for the release resources of the given IDs,
+    projecting only the given fields.
     """
-    release_cursor = mongodb.db.artists.aggregate([
+    return [
         {
             "$match": {
-                "releases.id": release_id,
+                "releases.id": {
+                    "$in": release_ids,
+                },
             },
         },
         {
@@ -23,48 +60,26 @@ def get_release(release_id):
         },
         {
             "$match": {
-                "releases.id": release_id,
+                "releases.id": {
+                    "$in": release_ids,
+                },
             },
         },
         {
             "$project": {
                 "_id": False,
                 "id": "$releases.id",
-                "name": "$releases.name",
-                "artist": {
-                    "id": "$_id",
-                    "name": "$name",
-                },
-                "release_date": "$releases.release_date",
-                "rating_average": {
-                    "$cond": {
-                        "if": {
-                            "$gt": [{"$size": "$releases.ratings"}, 0],
-                        },
-                        "then": {
-                            "$avg": "$releases.ratings.rating",
-                        },
-                        "else": None,
-                    },
-                },
-                "tracks": "$releases.tracks",
+                **{field: RELEASE_PROJECTION[field] for field in fields},
             },
         },
-    ])
-
-    release_results = tuple(release_cursor)
-    if not release_results:
-        body, code = Error.RELEASE_NOT_FOUND.response(id = release_id)
-        return jsonify(body), code
-
-    return jsonify(release_results[0]), 200
+    ]
 
-@bp.route("/<release_id>/ratings", methods = ["GET"])
-def get_release_ratings(release_id):
+def release_ratings_pipeline(release_id: str) -> list:
     """
-    Endpoint for getting all ratings for a specific release.
+    Build the aggregation pipeline for the release's summary, with its
+    ratings if they weren't migrated to the 'ratings' collection yet.
     """
-    release_cursor = mongodb.db.artists.aggregate([
+    return [
         {
             "$match": {
                 "releases.id": release_id,
@@ -89,11 +104,105 @@ def get_release_ratings(release_id):
                 "items": "$releases.ratings",
             },
         },
-    ])
+    ]
+
+@bp.route("/<release_id>", methods = ["GET"])
+def get_release(release_id):
+    """
+    Endpoint for getting the release resource by release ID.
+    """
+    fields, unknown_fields = helper.parse_fields(
+        request.args.get("fields"),
+        RELEASE_PROJECTION,
+        "id",
+    )
+    if unknown_fields:
+        body, code = Error.UNKNOWN_FIELDS.response(fields = ", ".join(unknown_fields))
+        return jsonify(body), code
 
-    release_results = tuple(release_cursor)
+    # The ETag is built before the release is read, so it can only be older
+    # than the response, never newer
+    etag = helper.get_etag("release", release_id, fields)
+    if etag is None:
+        body, code = Error.RELEASE_NOT_FOUND.response(id = release_id)
+        return jsonify(body), code
+    if request.if_none_match.contains(etag):
+        return helper.not_modified(etag)
+
+    release_results = coalesce.do(
+        "release",
+        (release_id, tuple(fields)),
+        lambda: tuple(routing.db().artists.aggregate(release_pipeline([release_id], fields))),
+    )
+    if not release_results:
+        body, code = Error.RELEASE_NOT_FOUND.response(id = release_id)
+        return jsonify(body), code
+
+    response = jsonify(release_results[0])
+    response.set_etag(etag)
+    return response, 200
+
+@bp.route("/", methods = ["GET"])
+def get_releases():
+    """
+    Endpoint for getting several release resources by release IDs, in the
+    order requested.
+    """
+    release_ids = helper.split_list_parameter(request.args.get("ids", default = "", type = str))
+    if not release_ids:
+        body, code = Error.NO_QUERY_PARAMETER.response(parameter = "ids")
+        return jsonify(body), code
+    if len(release_ids) > MAX_IDS:
+        body, code = Error.TOO_MANY_IDS.response(max_ids = MAX_IDS)
+        return jsonify(body), code
+    fields, unknown_fields = helper.parse_fields(
+        request.args.get("fields"),
+        RELEASE_PROJECTION,
+        "id",
+    )
+    if unknown_fields:
+        body, code = Error.UNKNOWN_FIELDS.response(fields = ", ".join(unknown_fields))
+        return jsonify(body), code
+
+    release_cursor = routing.db().artists.aggregate(
+        release_pipeline(list(set(release_ids)), fields),
+    )
+    releases_found = {release["id"]: release for release in release_cursor}
+
+    items = []
+    for release_id in release_ids:
+        if release_id in releases_found:
+            items.append(releases_found[release_id])
+            continue
+        body, _ = Error.RELEASE_NOT_FOUND.response(id = release_id)
+        items.append({
+            "id": release_id,
+            "error": body,
+        })
+
+    return jsonify({"items": items}), 200
+
+@bp.route("/<release_id>/ratings", methods = ["GET"])
+def get_release_ratings(release_id):
+    """
+    Endpoint for getting all ratings for a specific release.
+    """
+    release_results = coalesce.do(
+        "release_ratings",
+        release_id,
+        lambda: _read_release_ratings(release_id),
+    )
     if not release_results:
         body, code = Error.RELEASE_NOT_FOUND.response(id = release_id)
         return jsonify(body), code
 
     return jsonify(release_results[0]), 200
+
+def _read_release_ratings(release_id: str) -> tuple:
+    # Reads the release's ratings from its document or, once migrated, from
+    # the 'ratings' collection
+    release_results = tuple(routing.db().artists.aggregate(release_ratings_pipeline(release_id)))
+    for release_ratings in release_results:
+        if "items" not in release_ratings:
+            release_ratings["items"] = ratings.get_release_ratings(release_id)
+    return release_results
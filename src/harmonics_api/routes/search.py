@@ -0,0 +1,86 @@
+"""
+Module for the 'search/' route.
+"""
+from flask import Blueprint, jsonify, request
+from harmonics_api.configs.errors import Error
+from harmonics_api.utils import helper, search
+
+bp = Blueprint("search", __name__)
+
+@bp.route("/tracks", methods = ["GET"])
+def search_tracks():
+    """
+    Endpoint for searching tracks by name, with autocomplete of the last word.
+    """
+    query = request.args.get("q", type = str)
+    if not query or not query.strip():
+        body, code = Error.NO_QUERY_PARAMETER.response(parameter = "q")
+        return jsonify(body), code
+    value = request.args.get("limit")
+    limit = helper.parse_limit(value, 20)
+    if limit is None:
+        body, code = Error.INVALID_QUERY_PARAMETER.response(value = value, parameter = "limit")
+        return jsonify(body), code
+
+    response = {
+        "query": query,
+        "items": search.search_tracks(query, limit),
+    }
+
+    return jsonify(response), 200
+
+@bp.route("/artists", methods = ["GET"])
+def search_artists():
+    """
+    Endpoint for searching artists by name, tolerating typos.
+    """
+    query = request.args.get("q", type = str)
+    if not query or not query.strip():
+        body, code = Error.NO_QUERY_PARAMETER.response(parameter = "q")
+        return jsonify(body), code
+    value = request.args.get("limit")
+    limit = helper.parse_limit(value, 20)
+    if limit is None:
+        body, code = Error.INVALID_QUERY_PARAMETER.response(value = value, parameter = "limit")
+        return jsonify(body), code
+
+    response = {
+        "query": query,
+        "items": [
+            {
+                "id": artist["key"],
+                "name": artist["name"],
+            }
+            for artist in search.search_names("artist", query, limit)
+        ],
+    }
+
+    return jsonify(response), 200
+
+@bp.route("/users", methods = ["GET"])
+def search_users():
+    """
+    Endpoint for searching users by username or name, tolerating typos.
+    """
+    query = request.args.get("q", type = str)
+    if not query or not query.strip():
+        body, code = Error.NO_QUERY_PARAMETER.response(parameter = "q")
+        return jsonify(body), code
+    value = request.args.get("limit")
+    limit = helper.parse_limit(value, 20)
+    if limit is None:
+        body, code = Error.INVALID_QUERY_PARAMETER.response(value = value, parameter = "limit")
+        return jsonify(body), code
+
+    response = {
+        "query": query,
+        "items": [
+            {
+                "username": user["key"],
+                "name": user["name"],
+            }
+            for user in search.search_names("user", query, limit)
+        ],
+    }
+
+    return jsonify(response), 200
@@ -2,60 +2,77 @@
 Module for the 'users/' route.
 """
 import hashlib
+from datetime import datetime, timezone
 from flask import Blueprint, jsonify, request
-from harmonics_api.configs import mongodb, neo4j
+from pymongo import ReturnDocument
+from harmonics_api.configs import mongodb
 from harmonics_api.configs.errors import Error
-from harmonics_api.utils import helper
+from harmonics_api.utils import (
+    feeds, followers, helper, leaderboard, mutuals, outbox, ratings, routing, search, views,
+)
 
 bp = Blueprint("users", __name__)
 
-@bp.route("/<username>", methods = ["GET"])
-def get_user(username):
+MAX_USERNAMES = 100
+
+# Projection of each optional field of the user resource, the username is always included
+USER_PROJECTION = {
+    "name": {
+        "$ifNull": ["$name", None],
+    },
+    "bio": {
+        "$ifNull": ["$bio", None],
+    },
+    "qt_friends": {
+        "$size": "$friends",
+    },
+    # Users not migrated to the 'ratings' collection yet still embed their ratings
+    "qt_ratings": {
+        "$cond": {
+            "if": {
+                "$isArray": "$ratings",
+            },
+            "then": {
+                "$size": "$ratings",
+            },
+            "else": {
+                "$ifNull": ["$qt_ratings", 0],
+            },
+        },
+    },
+    "qt_follows": {
+        "$size": "$follows",
+    },
+}
+
+def user_pipeline(usernames: list, fields: list = tuple(USER_PROJECTION)) -> list:
     """
-    Endpoint for getting the user resource by username.
+    Build the aggregation pipeline for the user resources of the given
+    usernames, projecting only the given fields.
     """
-    user_cursor = mongodb.db.users.aggregate([
+    return [
         {
             "$match": {
-                "username": username,
+                "username": {
+                    "$in": usernames,
+                },
             },
         },
         {
             "$project": {
                 "_id": False,
                 "username": True,
-                "name": {
-                    "$ifNull": ["$name", None],
-                },
-                "bio": {
-                    "$ifNull": ["$bio", None],
-                },
-                "qt_friends": {
-                    "$size": "$friends",
-                },
-                "qt_ratings": {
-                    "$size": "$ratings",
-                },
-                "qt_follows": {
-                    "$size": "$follows",
-                },
+                **{field: USER_PROJECTION[field] for field in fields},
             },
         },
-    ])
-
-    user_results = tuple(user_cursor)
-    if not user_results:
-        body, code = Error.USER_NOT_FOUND.response(username = username)
-        return jsonify(body), code
+    ]
 
-    return jsonify(user_results[0]), 200
-
-@bp.route("/<username>/friends", methods = ["GET"])
-def get_user_friends(username):
+def user_items_pipeline(username: str, field: str) -> list:
     """
-    Endpoint for getting all friends of a user.
+    Build the aggregation pipeline for one of the user's lists
+    ('friends' or 'follows').
     """
-    user_cursor = mongodb.db.users.aggregate([
+    return [
         {
             "$match": {
                 "username": username,
@@ -65,10 +82,91 @@ def get_user_friends(username):
             "$project": {
                 "_id": False,
                 "username": True,
-                "items": "$friends",
+                "items": f"${field}",
             },
         },
-    ])
+    ]
+
+@bp.route("/<username>", methods = ["GET"])
+def get_user(username):
+    """
+    Endpoint for getting the user resource by username.
+    """
+    fields, unknown_fields = helper.parse_fields(
+        request.args.get("fields"),
+        USER_PROJECTION,
+        "username",
+    )
+    if unknown_fields:
+        body, code = Error.UNKNOWN_FIELDS.response(fields = ", ".join(unknown_fields))
+        return jsonify(body), code
+
+    # The ETag is built before the user is read, so it can only be older
+    # than the response, never newer
+    etag = helper.get_etag("user", username, fields)
+    if etag is None:
+        body, code = Error.USER_NOT_FOUND.response(username = username)
+        return jsonify(body), code
+    if request.if_none_match.contains(etag):
+        return helper.not_modified(etag)
+
+    user_cursor = routing.db().users.aggregate(user_pipeline([username], fields))
+
+    user_results = tuple(user_cursor)
+    if not user_results:
+        body, code = Error.USER_NOT_FOUND.response(username = username)
+        return jsonify(body), code
+
+    response = jsonify(user_results[0])
+    response.set_etag(etag)
+    return response, 200
+
+@bp.route("/", methods = ["GET"])
+def get_users():
+    """
+    Endpoint for getting several user resources by usernames, in the order
+    requested.
+    """
+    usernames = helper.split_list_parameter(
+        request.args.get("usernames", default = "", type = str),
+    )
+    if not usernames:
+        body, code = Error.NO_QUERY_PARAMETER.response(parameter = "usernames")
+        return jsonify(body), code
+    if len(usernames) > MAX_USERNAMES:
+        body, code = Error.TOO_MANY_IDS.response(max_ids = MAX_USERNAMES)
+        return jsonify(body), code
+    fields, unknown_fields = helper.parse_fields(
+        request.args.get("fields"),
+        USER_PROJECTION,
+        "username",
+    )
+    if unknown_fields:
+        body, code = Error.UNKNOWN_FIELDS.response(fields = ", ".join(unknown_fields))
+        return jsonify(body), code
+
+    user_cursor = routing.db().users.aggregate(user_pipeline(list(set(usernames)), fields))
+    users_found = {user["username"]: user for user in user_cursor}
+
+    items = []
+    for username in usernames:
+        if username in users_found:
+            items.append(users_found[username])
+            continue
+        body, _ = Error.USER_NOT_FOUND.response(username = username)
+        items.append({
+            "username": username,
+            "error": body,
+        })
+
+    return jsonify({"items": items}), 200
+
+@bp.route("/<username>/friends", methods = ["GET"])
+def get_user_friends(username):
+    """
+    Endpoint for getting all friends of a user.
+    """
+    user_cursor = routing.db().users.aggregate(user_items_pipeline(username, "friends"))
 
     user_results = tuple(user_cursor)
     if not user_results:
@@ -82,20 +180,24 @@ def get_user_ratings(username):
     """
     Endpoint for getting all ratings of a user.
     """
-    user_cursor = mongodb.db.users.aggregate([
-        {
-            "$match": {
-                "username": username,
-            }
-        },
-        {
-            "$project": {
-                "_id": False,
-                "username": True,
-                "items": "$ratings",
-            },
-        },
-    ])
+    items = ratings.get_user_ratings(username)
+    if items is None:
+        body, code = Error.USER_NOT_FOUND.response(username = username)
+        return jsonify(body), code
+
+    user_ratings = {
+        "username": username,
+        "items": items,
+    }
+
+    return jsonify(user_ratings), 200
+
+@bp.route("/<username>/follows", methods = ["GET"])
+def get_user_follows(username):
+    """
+    Endpoint for getting all artists followed by a user.
+    """
+    user_cursor = routing.db().users.aggregate(user_items_pipeline(username, "follows"))
 
     user_results = tuple(user_cursor)
     if not user_results:
@@ -104,32 +206,51 @@ def get_user_ratings(username):
 
     return jsonify(user_results[0]), 200
 
-@bp.route("/<username>/follows", methods = ["GET"])
-def get_user_follows(username):
+@bp.route("/<username>/feed", methods = ["GET"])
+def get_user_feed(username):
     """
-    Endpoint for getting all artists followed by a user.
+    Endpoint for getting the latest activities of a user's friends, newest
+    first, paginated by the 'before' cursor (or a timestamp).
     """
-    user_cursor = mongodb.db.users.aggregate([
+    value = request.args.get("limit")
+    limit = helper.parse_limit(value, 20, feeds.MAX_PAGE_SIZE)
+    if limit is None:
+        body, code = Error.INVALID_QUERY_PARAMETER.response(value = value, parameter = "limit")
+        return jsonify(body), code
+    before = request.args.get("before")
+    if before:
+        before = feeds.decode_cursor(before)
+        if before is None:
+            body, code = Error.INVALID_QUERY_PARAMETER.response(
+                value = request.args.get("before"),
+                parameter = "before",
+            )
+            return jsonify(body), code
+
+    user = routing.db().users.find_one(
         {
-            "$match": {
-                "username": username,
-            }
+            "username": username,
         },
         {
-            "$project": {
-                "_id": False,
-                "username": True,
-                "items": "$follows",
-            },
+            "friends": True,
         },
-    ])
-
-    user_results = tuple(user_cursor)
-    if not user_results:
+    )
+    if not user:
         body, code = Error.USER_NOT_FOUND.response(username = username)
         return jsonify(body), code
 
-    return jsonify(user_results[0]), 200
+    items = feeds.get_feed(username, user["friends"], before, limit)
+    next_cursor = feeds.encode_cursor(items[-1]) if len(items) == limit else None
+    for item in items:
+        item["created_at"] = item["created_at"].isoformat()
+
+    feed = {
+        "username": username,
+        "items": items,
+        "next": next_cursor,
+    }
+
+    return jsonify(feed), 200
 
 @bp.route("/", methods = ["POST"])
 def register_user():
@@ -161,17 +282,14 @@ def register_user():
     if bio:
         user["bio"] = bio
     user["friends"] = []
-    user["ratings"] = []
+    user["qt_ratings"] = 0
     user["follows"] = []
 
-    mongodb.db.users.insert_one(user)
+    with outbox.transaction() as session:
+        mongodb.db.users.insert_one(user, session = session)
+        outbox.publish("create_user", session, username = username)
 
-    neo4j.driver.execute_query(
-        """
-        MERGE (u:User {username: $username})
-        """,
-        username = username
-    )
+    search.index_user_name(user)
 
     return jsonify(), 201
 
@@ -186,7 +304,6 @@ def delete_user(username):
         },
         {
             "friends": True,
-            "ratings": True,
             "follows": True,
         },
     )
@@ -194,57 +311,44 @@ def delete_user(username):
         body, code = Error.USER_NOT_FOUND.response(username = username)
         return jsonify(body), code
 
-    for friend in user["friends"]:
-        mongodb.db.users.update_one(
-            {
-                "username": friend,
-            },
-            {
-                "$pull": {
-                    "friends": username,
+    with outbox.transaction() as session:
+        for friend in user["friends"]:
+            mongodb.db.users.update_one(
+                {
+                    "username": friend,
                 },
-            },
-        )
-
-    for rating in user["ratings"]:
-        mongodb.db.artists.update_one(
-            {
-                "releases.id": rating["id"],
-            },
-            {
-                "$pull": {
-                    "releases.$.ratings": {
-                        "username": username,
+                {
+                    "$pull": {
+                        "friends": username,
+                    },
+                    "$inc": {
+                        "version": 1,
                     },
                 },
-            },
-        )
+                session = session,
+            )
 
-    for follow in user["follows"]:
-        mongodb.db.artists.update_one(
-            {
-                "_id": follow["id"],
-            },
+        user_ratings = ratings.remove_user(username, session)
+        for release_id, rating in user_ratings.items():
+            views.add_rating(release_id, rating, -1, session)
+
+        leaderboard.remove_user(username, session)
+
+        mongodb.db.users.delete_one(
             {
-                "$inc": {
-                    "qt_followers": -1,
-                },
+                "username": username,
             },
+            session = session,
         )
 
-    mongodb.db.users.delete_one(
-        {
-            "username": username,
-        },
-    )
+        outbox.publish("delete_user", session, username = username)
 
-    neo4j.driver.execute_query(
-        """
-        MATCH (u:User {username: $username})
-        DETACH DELETE u
-        """,
-        username = username,
-    )
+    for follow in user["follows"]:
+        followers.add(follow["id"], -1)
+    search.unindex_user_name(username)
+    search.refresh_user_popularities(user["friends"])
+    feeds.forget(username, user["friends"])
+    mutuals.invalidate(username, user["friends"])
 
     return jsonify(), 200
 
@@ -284,19 +388,33 @@ def update_user(username):
         body, code = Error.NO_VALID_FIELDS.response()
         return jsonify(body), code
 
-    update_doc = {}
+    update_doc = {
+        "$inc": {
+            "version": 1,
+        },
+    }
     if update_ops:
         update_doc["$set"] = update_ops
     if unset_ops:
         update_doc["$unset"] = unset_ops
 
-    mongodb.db.users.update_one(
+    user = mongodb.db.users.find_one_and_update(
         {
             "username": username,
         },
         update_doc,
+        {
+            "_id": False,
+            "username": True,
+            "name": True,
+            "friends": True,
+        },
+        return_document = ReturnDocument.AFTER,
     )
 
+    if "name" in update_ops or "name" in unset_ops:
+        search.index_user_name(user)
+
     return jsonify(), 200
 
 @bp.route("/<username>/ratings", methods = ["POST"])
@@ -319,29 +437,7 @@ def rate_release(username):
         body, code = Error.USER_NOT_FOUND.response(username = username)
         return jsonify(body), code
 
-    release_cursor = mongodb.db.artists.aggregate([
-        {
-            "$match": {
-                "releases.id": release_id,
-            },
-        },
-        {
-            "$unwind": "$releases",
-        },
-        {
-            "$match": {
-                "releases.id": release_id,
-            },
-        },
-        {
-            "$project": {
-                "_id": False,
-                "id": "$releases.id",
-                "artist": "$name",
-                "name": "$releases.name",
-            }
-        }
-    ])
+    release_cursor = mongodb.db.artists.aggregate(helper.release_summary_pipeline(release_id))
 
     release_results = tuple(release_cursor)
     if not release_results:
@@ -357,46 +453,29 @@ def rate_release(username):
         )
         return jsonify(body), code
 
-    mongodb.db.users.update_one(
-        {
-            "username": username,
-        },
-        {
-            "$push": {
-                "ratings": {
-                    "id": release["id"],
-                    "artist": release["artist"],
-                    "name": release["name"],
-                    "rating": rating,
-                },
-            },
-        },
-    )
+    created_at = datetime.now(timezone.utc)
+
+    with outbox.transaction() as session:
+        friends = ratings.add(username, release, rating, created_at, session)
+        views.add_rating(release_id, rating, 1, session)
 
-    mongodb.db.artists.update_one(
+        outbox.publish(
+            "rate",
+            session,
+            username = username,
+            release_id = release["id"],
+            rating = rating,
+        )
+
+    feeds.record(
+        username,
+        friends,
         {
-            "releases.id": release_id,
+            "type": "rating",
+            "created_at": created_at,
+            "release": release,
+            "rating": rating,
         },
-        {
-            "$push": {
-                "releases.$.ratings": {
-                    "username": username,
-                    "rating": rating
-                }
-            }
-        }
-    )
-
-    neo4j.driver.execute_query(
-        """
-        MATCH (r:Release {id: $release_id})
-        MATCH (u:User {username: $username})
-        MERGE (u)-[rel:RATED]->(r)
-        ON CREATE SET rel.rating = $rating
-        """,
-        release_id = release["id"],
-        username = username,
-        rating = rating,
     )
 
     return jsonify(), 201
@@ -419,40 +498,17 @@ def unrate_release(username, release_id):
         )
         return jsonify(body), code
 
-    mongodb.db.users.update_one(
-        {
-            "username": username,
-        },
-        {
-            "$pull": {
-                "ratings": {
-                    "id": release_id,
-                },
-            },
-        },
-    )
+    with outbox.transaction() as session:
+        rating = ratings.remove(username, release_id, session)
+        if rating is not None:
+            views.add_rating(release_id, rating, -1, session)
 
-    mongodb.db.artists.update_one(
-        {
-            "releases.id": release_id,
-        },
-        {
-            "$pull": {
-                "releases.$.ratings": {
-                    "username": username,
-                },
-            },
-        },
-    )
-
-    neo4j.driver.execute_query(
-        """
-        MATCH (u:User {username: $username})-[r:RATED]->(rel:Release {id: $release_id})
-        DELETE r
-        """,
-        username = username,
-        release_id = release_id,
-    )
+        outbox.publish(
+            "unrate",
+            session,
+            username = username,
+            release_id = release_id,
+        )
 
     return jsonify(), 200
 
@@ -478,6 +534,7 @@ def follow_artist(username):
         {
             "_id": True,
             "name": True,
+            "genres": True,
         },
     )
     if not artist:
@@ -491,41 +548,54 @@ def follow_artist(username):
         )
         return jsonify(body), code
 
-    mongodb.db.users.update_one(
-        {
-            "username": username,
-        },
-        {
-            "$push": {
-                "follows": {
-                    "id": artist_id,
-                    "name": artist["name"],
+    created_at = datetime.now(timezone.utc)
+
+    with outbox.transaction() as session:
+        user = mongodb.db.users.find_one_and_update(
+            {
+                "username": username,
+            },
+            {
+                "$push": {
+                    "follows": {
+                        "id": artist_id,
+                        "name": artist["name"],
+                        "created_at": created_at,
+                    },
+                },
+                "$inc": {
+                    "version": 1,
                 },
             },
-        },
-    )
+            {
+                "friends": True,
+            },
+            session = session,
+        )
 
-    mongodb.db.artists.update_one(
-        {
-            "_id": artist_id,
-        },
+        leaderboard.add_follow(username, artist["genres"], 1, session)
+
+        outbox.publish(
+            "follow",
+            session,
+            username = username,
+            artist_id = artist_id,
+        )
+
+    followers.add(artist_id, 1)
+    feeds.record(
+        username,
+        user["friends"],
         {
-            "$inc": {
-                "qt_followers": 1,
+            "type": "follow",
+            "created_at": created_at,
+            "artist": {
+                "id": artist_id,
+                "name": artist["name"],
             },
         },
     )
 
-    neo4j.driver.execute_query(
-        """
-        MATCH (u:User {username: $username})
-        MATCH (a:Artist {id: $artist_id})
-        MERGE (u)-[:FOLLOWS]->(a)
-        """,
-        artist_id = artist_id,
-        username = username,
-    )
-
     return jsonify(), 201
 
 @bp.route("/<username>/follows/<artist_id>", methods = ["DELETE"])
@@ -536,7 +606,15 @@ def unfollow_artist(username, artist_id):
     if not helper.exists("user", username):
         body, code = Error.USER_NOT_FOUND.response(username = username)
         return jsonify(body), code
-    if not helper.exists("artist", artist_id):
+    artist = mongodb.db.artists.find_one(
+        {
+            "_id": artist_id,
+        },
+        {
+            "genres": True,
+        },
+    )
+    if not artist:
         body, code = Error.ARTIST_NOT_FOUND.response(id = artist_id)
         return jsonify(body), code
     if not helper.exists("follow", username, artist_id):
@@ -546,38 +624,34 @@ def unfollow_artist(username, artist_id):
         )
         return jsonify(body), code
 
-    mongodb.db.users.update_one(
-        {
-            "username": username,
-        },
-        {
-            "$pull": {
-                "follows": {
-                    "id": artist_id,
+    with outbox.transaction() as session:
+        mongodb.db.users.update_one(
+            {
+                "username": username,
+            },
+            {
+                "$pull": {
+                    "follows": {
+                        "id": artist_id,
+                    },
+                },
+                "$inc": {
+                    "version": 1,
                 },
             },
-        },
-    )
+            session = session,
+        )
 
-    mongodb.db.artists.update_one(
-        {
-            "_id": artist_id,
-        },
-        {
-            "$inc": {
-                "qt_followers": -1,
-            },
-        },
-    )
+        leaderboard.add_follow(username, artist["genres"], -1, session)
 
-    neo4j.driver.execute_query(
-        """
-        MATCH (u:User {username: $username})-[f:FOLLOWS]->(a:Artist {id: $artist_id})
-        DELETE f
-        """,
-        username = username,
-        artist_id = artist_id,
-    )
+        outbox.publish(
+            "unfollow",
+            session,
+            username = username,
+            artist_id = artist_id,
+        )
+
+    followers.add(artist_id, -1)
 
     return jsonify(), 200
 
@@ -605,38 +679,53 @@ def befriend_user(username):
         )
         return jsonify(body), code
 
-    mongodb.db.users.update_one(
-        {
-            "username": username,
-        },
-        {
-            "$push": {
-                "friends": friend_username,
+    with outbox.transaction() as session:
+        user = mongodb.db.users.find_one_and_update(
+            {
+                "username": username,
             },
-        },
-    )
+            {
+                "$push": {
+                    "friends": friend_username,
+                },
+                "$inc": {
+                    "version": 1,
+                },
+            },
+            {
+                "friends": True,
+            },
+            session = session,
+        )
 
-    mongodb.db.users.update_one(
-        {
-            "username": friend_username,
-        },
-        {
-            "$push": {
-                "friends": username,
+        friend = mongodb.db.users.find_one_and_update(
+            {
+                "username": friend_username,
             },
-        },
-    )
+            {
+                "$push": {
+                    "friends": username,
+                },
+                "$inc": {
+                    "version": 1,
+                },
+            },
+            {
+                "friends": True,
+            },
+            session = session,
+        )
 
-    neo4j.driver.execute_query(
-        """
-        MATCH (u1:User {username: $username})
-        MATCH (u2:User {username: $friend_username})
-        MERGE (u1)-[:FRIENDS_WITH]->(u2)
-        MERGE (u1)<-[:FRIENDS_WITH]-(u2)
-        """,
-        username = username,
-        friend_username = friend_username,
-    )
+        outbox.publish(
+            "befriend",
+            session,
+            username = username,
+            friend_username = friend_username,
+        )
+
+    mutuals.invalidate(username, user["friends"])
+    mutuals.invalidate(friend_username, friend["friends"])
+    search.refresh_user_popularities([username, friend_username])
 
     return jsonify(), 201
 
@@ -658,36 +747,53 @@ def unfriend_user(username, friend_username):
         )
         return jsonify(body), code
 
-    mongodb.db.users.update_one(
-        {
-            "username": username,
-        },
-        {
-            "$pull": {
-                "friends": friend_username,
+    with outbox.transaction() as session:
+        user = mongodb.db.users.find_one_and_update(
+            {
+                "username": username,
             },
-        },
-    )
+            {
+                "$pull": {
+                    "friends": friend_username,
+                },
+                "$inc": {
+                    "version": 1,
+                },
+            },
+            {
+                "friends": True,
+            },
+            session = session,
+        )
 
-    mongodb.db.users.update_one(
-        {
-            "username": friend_username,
-        },
-        {
-            "$pull": {
-                "friends": username,
+        friend = mongodb.db.users.find_one_and_update(
+            {
+                "username": friend_username,
             },
-        },
-    )
+            {
+                "$pull": {
+                    "friends": username,
+                },
+                "$inc": {
+                    "version": 1,
+                },
+            },
+            {
+                "friends": True,
+            },
+            session = session,
+        )
 
-    neo4j.driver.execute_query(
-        """
-        MATCH (u1:User {username: $username1})-[f1:FRIENDS_WITH]->(u2:User {username: $username2})
-        MATCH (u1)<-[f2:FRIENDS_WITH]-(u2)
-        DELETE f1, f2
-        """,
-        username1 = username,
-        username2 = friend_username,
-    )
+        outbox.publish(
+            "unfriend",
+            session,
+            username = username,
+            friend_username = friend_username,
+        )
+
+    mutuals.invalidate(username, user["friends"])
+    mutuals.invalidate(friend_username, friend["friends"])
+    search.refresh_user_popularities([username, friend_username])
+    feeds.unlink(username, friend_username)
 
     return jsonify(), 200
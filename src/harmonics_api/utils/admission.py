@@ -0,0 +1,145 @@
+"""
+Module for the admission control of the API.
+
+Every request belongs to an endpoint class: the recommendations, the search,
+the exports, the rest of the GET endpoints (the catalog) and the mutations
+(the writes).
+Each class runs at most its ADMISSION_LIMITS requests at a time, and the ones
+above it wait, up to its ADMISSION_QUEUES requests and ADMISSION_WAIT_SECONDS
+each. The rest are shed right away with a 503 and a Retry-After header, so a
+slow class fills its own queue instead of the database connection pools the
+other classes need. The metrics and debug endpoints are never shed.
+"""
+import threading
+from flask import g, jsonify, request
+from harmonics_api.configs import mongodb, settings
+from harmonics_api.configs.errors import Error
+
+# Class of the GET endpoints of each blueprint, the others being the catalog
+BLUEPRINT_CLASSES = {
+    "recs": "recs",
+    "search": "search",
+    "export": "export",
+}
+EXEMPT_BLUEPRINTS = ("metrics", "debug")
+
+def _parse(value: str) -> dict:
+    # Parses a "class=amount,..." setting
+    amounts = {}
+    for item in value.split(","):
+        if "=" in item:
+            endpoint_class, amount = item.split("=", 1)
+            amounts[endpoint_class.strip()] = int(amount)
+    return amounts
+
+LIMITS = _parse(settings.ADMISSION_LIMITS)
+QUEUES = _parse(settings.ADMISSION_QUEUES)
+
+for _endpoint_class in ("recs", "search", "export", "catalog", "writes"):
+    if _endpoint_class not in LIMITS or _endpoint_class not in QUEUES:
+        raise ValueError(f"Missing admission limit or queue for: {_endpoint_class}")
+
+# Slots of each class, and what happened to its requests
+_classes = {
+    endpoint_class: {
+        "condition": threading.Condition(),
+        "active": 0,
+        "waiting": 0,
+        "max_active": 0,
+        "admitted": 0,
+        "queued": 0,
+        "shed_queue_full": 0,
+        "shed_timeout": 0,
+    }
+    for endpoint_class in LIMITS
+}
+
+def init_app(app) -> None:
+    """
+    Register the request hooks that admit or shed each request and free its
+    slot once it's done.
+    """
+    app.before_request(_before_request)
+    app.teardown_request(_teardown_request)
+
+def classify() -> str | None:
+    """
+    Get the endpoint class of the current request, or None if it's exempt.
+    """
+    blueprint = request.blueprint
+    if blueprint in EXEMPT_BLUEPRINTS:
+        return None
+    if request.method not in ("GET", "HEAD"):
+        return "writes"
+    return BLUEPRINT_CLASSES.get(blueprint, "catalog")
+
+def metrics() -> dict:
+    """
+    Report how full each class is and how many of its requests were shed,
+    along with the use of the MongoDB connection pool.
+    """
+    classes = {}
+    for endpoint_class, state in _classes.items():
+        with state["condition"]:
+            classes[endpoint_class] = {
+                "limit": LIMITS[endpoint_class],
+                "queue": QUEUES[endpoint_class],
+                **{key: value for key, value in state.items() if key != "condition"},
+            }
+
+    return {
+        "wait_seconds": settings.ADMISSION_WAIT_SECONDS,
+        "classes": classes,
+        "mongodb_pool": dict(mongodb.pool_stats),
+    }
+
+def _before_request():
+    endpoint_class = classify()
+    if endpoint_class is None:
+        return None
+
+    state = _classes[endpoint_class]
+    limit = LIMITS[endpoint_class]
+    with state["condition"]:
+        if state["active"] >= limit or state["waiting"] > 0:
+            if state["waiting"] >= QUEUES[endpoint_class]:
+                state["shed_queue_full"] += 1
+                return _shed(endpoint_class)
+
+            state["waiting"] += 1
+            state["queued"] += 1
+            admitted = state["condition"].wait_for(
+                lambda: state["active"] < limit,
+                timeout = settings.ADMISSION_WAIT_SECONDS,
+            )
+            state["waiting"] -= 1
+            if not admitted:
+                state["shed_timeout"] += 1
+                return _shed(endpoint_class)
+
+        state["active"] += 1
+        state["admitted"] += 1
+        state["max_active"] = max(state["max_active"], state["active"])
+
+    g.admission_class = endpoint_class
+    return None
+
+def _teardown_request(_error) -> None:
+    endpoint_class = g.pop("admission_class", None)
+    if endpoint_class is None:
+        return
+
+    state = _classes[endpoint_class]
+    with state["condition"]:
+        state["active"] -= 1
+        state["condition"].notify()
+
+def _shed(endpoint_class: str):
+    # Builds the 503 of a request that didn't get a slot
+    body, code = Error.OVERLOADED.response(
+        endpoint_class = endpoint_class,
+        retry_after = settings.ADMISSION_RETRY_AFTER_SECONDS,
+    )
+    response = jsonify(body)
+    response.headers["Retry-After"] = str(settings.ADMISSION_RETRY_AFTER_SECONDS)
+    return response, code
@@ -0,0 +1,68 @@
+"""
+Module for capturing the traffic of the API, to be replayed by the 'replay'
+command.
+
+With CAPTURE_FILE set, a CAPTURE_SAMPLE_RATE share of the requests is
+appended to it as JSON lines, with the method, the path (and query string),
+the route, the time of arrival and the time since the previous captured
+request of the worker. Only the shape of the JSON body is kept, with each
+value replaced by its type, as bodies can hold passwords. The metrics and
+debug endpoints aren't captured.
+"""
+import json
+import random
+import threading
+import time
+from flask import request
+from harmonics_api.configs import settings
+
+ENABLED = bool(settings.CAPTURE_FILE)
+
+EXCLUDED_BLUEPRINTS = ("metrics", "debug")
+
+_lock = threading.Lock()
+_state = {
+    "last_arrival": None,
+}
+
+def init_app(app) -> None:
+    """
+    Register the request hook that captures the sampled requests.
+    """
+    if ENABLED:
+        app.before_request(_before_request)
+
+def shape(value):
+    """
+    Replace the values of a JSON document with their types, keeping its
+    structure.
+    """
+    if isinstance(value, dict):
+        return {key: shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [shape(item) for item in value]
+    if value is None:
+        return "null"
+    return type(value).__name__
+
+def _before_request() -> None:
+    if request.blueprint in EXCLUDED_BLUEPRINTS:
+        return
+    if random.random() >= settings.CAPTURE_SAMPLE_RATE:
+        return
+
+    body = request.get_json(silent = True) if request.is_json else None
+    arrival = time.time()
+    with _lock:
+        last_arrival = _state["last_arrival"]
+        _state["last_arrival"] = arrival
+        record = {
+            "time": arrival,
+            "gap": arrival - last_arrival if last_arrival is not None else None,
+            "method": request.method,
+            "path": request.full_path.rstrip("?"),
+            "route": f"{request.method} {request.url_rule.rule if request.url_rule else '-'}",
+            "body": shape(body) if body is not None else None,
+        }
+        with open(settings.CAPTURE_FILE, "a", encoding = "utf-8") as file:
+            file.write(json.dumps(record) + "\n")
@@ -0,0 +1,56 @@
+"""
+Module for coalescing concurrent identical reads (single-flight).
+
+While a read for a key is in flight, every other thread of the worker asking
+for the same key waits for it and gets its result, instead of sending the
+same query to the database again. Results are shared, so callers must not
+modify them.
+"""
+import threading
+from harmonics_api.utils import routing
+
+_lock = threading.Lock()
+_calls = {}
+
+stats = {}
+
+def do(namespace: str, key, function):
+    """
+    Call the function for the key of a namespace, or wait for the call
+    already in flight for it and return (or raise) its result.
+    """
+    # A request pinned to the primaries can't take the result of a read
+    # served by a secondary, which may be behind its own writes
+    key = (namespace, key, routing.use_secondaries())
+    with _lock:
+        counters = stats.setdefault(namespace, {"calls": 0, "coalesced": 0})
+        counters["calls"] += 1
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = {
+                "done": threading.Event(),
+                "result": None,
+                "error": None,
+            }
+            _calls[key] = call
+        else:
+            counters["coalesced"] += 1
+
+    if not leader:
+        call["done"].wait()
+        if call["error"]:
+            raise call["error"]
+        return call["result"]
+
+    try:
+        call["result"] = function()
+    except BaseException as error:
+        call["error"] = error
+        raise
+    finally:
+        with _lock:
+            del _calls[key]
+        call["done"].set()
+
+    return call["result"]
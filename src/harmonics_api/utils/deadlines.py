@@ -0,0 +1,92 @@
+"""
+Module for the deadlines of the requests.
+
+Each request gets DEADLINE_SECONDS (or its DEADLINE_OVERRIDES) from when it's
+admitted. Every MongoDB operation of the request runs under pymongo's
+client-side timeout, which sends the time left as 'maxTimeMS', and every
+Neo4j transaction gets the time left as its transaction timeout, so a query
+still running when the client has given up is cancelled by the database.
+A query cut short by the deadline ends the request with a 504.
+"""
+import time
+from contextlib import ExitStack
+import pymongo
+from flask import g, has_request_context, jsonify, request
+from neo4j.exceptions import ClientError
+from pymongo.errors import PyMongoError
+from harmonics_api.configs import settings
+from harmonics_api.configs.errors import Error
+
+# Deadline of each endpoint overridden by DEADLINE_OVERRIDES ("endpoint=seconds,...")
+ENDPOINT_DEADLINES = {
+    endpoint.strip(): float(seconds)
+    for endpoint, seconds in (
+        override.split("=", 1)
+        for override in settings.DEADLINE_OVERRIDES.split(",")
+        if "=" in override
+    )
+}
+
+# Exports stream for as long as the dataset takes, so they have no deadline
+EXEMPT_BLUEPRINTS = ("export",)
+
+# Shortest Neo4j transaction timeout, as a timeout of 0 means no timeout at all
+MIN_NEO4J_TIMEOUT = 0.001
+
+def init_app(app) -> None:
+    """
+    Register the request hooks that start and end the deadline of each
+    request, and the handlers that turn the timeouts into 504s.
+    """
+    app.before_request(_before_request)
+    app.teardown_request(_teardown_request)
+    app.register_error_handler(PyMongoError, _handle_mongodb_error)
+    app.register_error_handler(ClientError, _handle_neo4j_error)
+
+def remaining() -> float | None:
+    """
+    Get the seconds left until the deadline of the current request, or None
+    outside of a request.
+    """
+    if not has_request_context() or "deadline" not in g:
+        return None
+    return g.deadline - time.monotonic()
+
+def neo4j_timeout() -> float | None:
+    """
+    Get the transaction timeout for a Neo4j query of the current request, or
+    None outside of a request.
+    """
+    seconds = remaining()
+    if seconds is None:
+        return None
+    return max(seconds, MIN_NEO4J_TIMEOUT)
+
+def _before_request() -> None:
+    if request.blueprint in EXEMPT_BLUEPRINTS:
+        return
+    seconds = ENDPOINT_DEADLINES.get(request.endpoint, settings.DEADLINE_SECONDS)
+    g.deadline_seconds = seconds
+    g.deadline = time.monotonic() + seconds
+    g.deadline_stack = ExitStack()
+    g.deadline_stack.enter_context(pymongo.timeout(seconds))
+
+def _teardown_request(_error) -> None:
+    stack = g.pop("deadline_stack", None)
+    if stack is not None:
+        stack.close()
+
+def _handle_mongodb_error(error: PyMongoError):
+    if not error.timeout:
+        raise error
+    return _deadline_exceeded()
+
+def _handle_neo4j_error(error: ClientError):
+    if "TransactionTimedOut" not in (error.code or ""):
+        raise error
+    return _deadline_exceeded()
+
+def _deadline_exceeded():
+    # Builds the 504 of a request whose queries were cut short by its deadline
+    body, code = Error.DEADLINE_EXCEEDED.response(seconds = g.get("deadline_seconds"))
+    return jsonify(body), code
@@ -0,0 +1,182 @@
+"""
+Module for the NDJSON exports of the catalog and the social graph.
+
+Each export is read in a fixed order (artist ID, username, or source and
+target of the edges), straight from a MongoDB cursor or from Neo4j pages of
+EXPORT_BATCH_SIZE records, and written out one line per record as
+it's read, so a worker's memory doesn't grow with the size of the export.
+
+Every EXPORT_BATCH_SIZE records, and at the end, a '{"checkpoint": ...}'
+line holds a token of the last record written. Passing the token as 'after'
+resumes the export right after it, and the last line of an export that
+finished also has '"done": true'.
+"""
+import base64
+import binascii
+import json
+from harmonics_api.configs import settings
+from harmonics_api.utils import routing
+
+# The edges are read a page at a time, the users in the order of the
+# username index and the edges of each user sorted on their own, so Neo4j
+# never sorts the whole edge set
+EDGE_QUERIES = {
+    "FOLLOWS": """
+        MATCH (u:User)
+        WHERE u.username >= $source
+        WITH u
+        ORDER BY u.username
+        CALL {
+            WITH u
+            MATCH (u)-[:FOLLOWS]->(a:Artist)
+            WHERE u.username > $source OR a.id > $target
+            RETURN a.id AS target
+            ORDER BY target
+            LIMIT $limit
+        }
+        RETURN u.username AS source, target
+        LIMIT $limit
+        """,
+    "RATED": """
+        MATCH (u:User)
+        WHERE u.username >= $source
+        WITH u
+        ORDER BY u.username
+        CALL {
+            WITH u
+            MATCH (u)-[r:RATED]->(rel:Release)
+            WHERE u.username > $source OR rel.id > $target
+            RETURN rel.id AS target, r.rating AS rating
+            ORDER BY target
+            LIMIT $limit
+        }
+        RETURN u.username AS source, target, rating
+        LIMIT $limit
+        """,
+    # A friendship is stored as a relationship each way, so only the one going
+    # out of the lesser username is exported
+    "FRIENDS_WITH": """
+        MATCH (u:User)
+        WHERE u.username >= $source
+        WITH u
+        ORDER BY u.username
+        CALL {
+            WITH u
+            MATCH (u)-[:FRIENDS_WITH]->(f:User)
+            WHERE u.username < f.username AND (u.username > $source OR f.username > $target)
+            RETURN f.username AS target
+            ORDER BY target
+            LIMIT $limit
+        }
+        RETURN u.username AS source, target
+        LIMIT $limit
+        """,
+}
+
+def decode_checkpoint(token: str | None, size: int) -> list | None:
+    """
+    Get the key of the last record written from a checkpoint token, with the
+    given number of parts, or None if the token is malformed. An export
+    without a token starts from an empty key, before every record.
+    """
+    if not token:
+        return [""] * size
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+    except (ValueError, binascii.Error):
+        return None
+    if not isinstance(key, list) or len(key) != size:
+        return None
+    if not all(isinstance(part, str) for part in key):
+        return None
+    return key
+
+def artists(after: list):
+    """
+    Stream the NDJSON lines of the artists after the key, with their releases
+    and tracks.
+    """
+    cursor = routing.db().artists.find(
+        {
+            "_id": {
+                "$gt": after[0],
+            },
+        },
+        {
+            "version": False,
+            "ingest_hash": False,
+            "releases.version": False,
+            "releases.ratings": False,
+        },
+        sort = [("_id", 1)],
+        batch_size = settings.EXPORT_BATCH_SIZE,
+    )
+    records = ({"id": artist.pop("_id"), **artist} for artist in cursor)
+    return _lines(records, lambda artist: [artist["id"]], after)
+
+def users(after: list):
+    """
+    Stream the NDJSON lines of the users after the key, without their
+    relationships (which are exported as edges) or credentials.
+    """
+    cursor = routing.db().users.find(
+        {
+            "username": {
+                "$gt": after[0],
+            },
+        },
+        {
+            "_id": False,
+            "username": True,
+            "name": True,
+            "bio": True,
+        },
+        sort = [("username", 1)],
+        batch_size = settings.EXPORT_BATCH_SIZE,
+    )
+    return _lines(cursor, lambda user: [user["username"]], after)
+
+def edges(edge_type: str, after: list):
+    """
+    Stream the NDJSON lines of the relationships of a type after the key.
+    """
+    return _lines(
+        _edge_records(edge_type, after),
+        lambda edge: [edge["source"], edge["target"]],
+        after,
+    )
+
+def _edge_records(edge_type: str, after: list):
+    # Reads the relationships of a type a page at a time, each page starting
+    # right after the last relationship of the previous one
+    source, target = after
+    while True:
+        records = routing.read(
+            EDGE_QUERIES[edge_type],
+            source = source,
+            target = target,
+            limit = settings.EXPORT_BATCH_SIZE,
+        )
+        for record in records:
+            yield {"type": edge_type, **record.data()}
+        if len(records) < settings.EXPORT_BATCH_SIZE:
+            return
+        source, target = records[-1]["source"], records[-1]["target"]
+
+def _lines(records, key, after: list):
+    # Writes each record as a line, with a checkpoint after every batch and
+    # a last one when done
+    last_key = after
+    qt_records = 0
+    for record in records:
+        yield json.dumps(record, default = str) + "\n"
+        last_key = key(record)
+        qt_records += 1
+        if qt_records % settings.EXPORT_BATCH_SIZE == 0:
+            yield json.dumps({"checkpoint": _encode(last_key)}) + "\n"
+
+    yield json.dumps({"checkpoint": _encode(last_key), "done": True}) + "\n"
+
+def _encode(key: list) -> str:
+    # Builds the checkpoint token of a key
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("ascii")
@@ -0,0 +1,194 @@
+"""
+Module for the friends activity feeds.
+
+Activities (ratings and follows) are fanned out on write: each one is pushed
+to the capped feed of every friend of its author. Authors with more friends
+than FANOUT_LIMIT are fanned out on read instead: their activities only go to
+their own capped activity log, which their friends' feeds merge in when read.
+
+Feeds are paged newest first by a cursor of the creation time and the ID of
+the last item returned, so items created at the same time as it aren't
+skipped on the next page.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime, timezone
+from bson import ObjectId
+from pymongo import UpdateOne
+from harmonics_api.configs import mongodb
+from harmonics_api.utils import routing
+
+FEED_SIZE = 500
+FANOUT_LIMIT = 1_000
+MAX_PAGE_SIZE = 100
+
+def record(username: str, friends: list, activity: dict) -> None:
+    """
+    Record an activity (with its 'created_at' timestamp) of a user and fan it
+    out to the feeds of the user's friends.
+    """
+    item = {
+        "id": str(ObjectId()),
+        "username": username,
+        **activity,
+    }
+    capped_push = {
+        "$push": {
+            "items": {
+                "$each": [item],
+                "$sort": {
+                    "created_at": -1,
+                },
+                "$slice": FEED_SIZE,
+            },
+        },
+    }
+    high_degree = len(friends) > FANOUT_LIMIT
+
+    mongodb.db.activities.update_one(
+        {
+            "_id": username,
+        },
+        {
+            **capped_push,
+            "$set": {
+                "high_degree": high_degree,
+            },
+        },
+        upsert = True,
+    )
+
+    if high_degree or not friends:
+        return
+
+    mongodb.db.feeds.bulk_write(
+        [UpdateOne({"_id": friend}, capped_push, upsert = True) for friend in friends],
+        ordered = False,
+    )
+
+def forget(username: str, friends: list) -> None:
+    """
+    Remove the feed and activities of a user, including those in the feeds of
+    the user's friends.
+    """
+    mongodb.db.feeds.delete_one(
+        {
+            "_id": username,
+        },
+    )
+    mongodb.db.activities.delete_one(
+        {
+            "_id": username,
+        },
+    )
+    mongodb.db.feeds.update_many(
+        {
+            "_id": {
+                "$in": friends,
+            },
+        },
+        {
+            "$pull": {
+                "items": {
+                    "username": username,
+                },
+            },
+        },
+    )
+
+def unlink(username: str, friend_username: str) -> None:
+    """
+    Remove the activities of two users who stopped being friends from each
+    other's feed.
+    """
+    mongodb.db.feeds.bulk_write(
+        [
+            UpdateOne(
+                {
+                    "_id": owner,
+                },
+                {
+                    "$pull": {
+                        "items": {
+                            "username": author,
+                        },
+                    },
+                },
+            )
+            for owner, author in ((username, friend_username), (friend_username, username))
+        ],
+        ordered = False,
+    )
+
+def encode_cursor(item: dict) -> str:
+    """
+    Build the cursor of the page after an item.
+    """
+    key = [item["created_at"].isoformat(), item.get("id", "")]
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("ascii")
+
+def decode_cursor(value: str) -> tuple | None:
+    """
+    Get the creation time and ID of the item a page starts after from its
+    cursor, or from a timestamp alone. Returns None if the value is neither.
+    """
+    try:
+        created_at, item_id = json.loads(base64.urlsafe_b64decode(value.encode("ascii")))
+        created_at = datetime.fromisoformat(created_at)
+    except (ValueError, TypeError, binascii.Error):
+        try:
+            created_at, item_id = datetime.fromisoformat(value), ""
+        except ValueError:
+            return None
+    if not isinstance(item_id, str):
+        return None
+    if not created_at.tzinfo:
+        created_at = created_at.replace(tzinfo = timezone.utc)
+    return created_at, item_id
+
+def get_feed(username: str, friends: list, before: tuple | None, limit: int) -> list:
+    """
+    Get the page of a user's feed with the latest activities after the
+    cursor 'before' (the creation time and ID of the last item of the
+    previous page), merging in the activities of the high-degree friends.
+    """
+    feed = routing.db().feeds.find_one(
+        {
+            "_id": username,
+        },
+        {
+            "items": True,
+        },
+    )
+    items = feed["items"] if feed else []
+
+    activities_cursor = routing.db().activities.find(
+        {
+            "_id": {
+                "$in": friends,
+            },
+            "high_degree": True,
+        },
+        {
+            "items": True,
+        },
+    )
+    for activities in activities_cursor:
+        items.extend(activities["items"])
+
+    # Activities fanned out before an unfriending took effect are left out
+    current_friends = set(friends)
+    items = [item for item in items if item["username"] in current_friends]
+    for item in items:
+        item["created_at"] = item["created_at"].replace(tzinfo = timezone.utc)
+    if before:
+        items = [item for item in items if _key(item) < before]
+
+    items.sort(key = _key, reverse = True)
+    return items[:limit]
+
+def _key(item: dict) -> tuple:
+    # Orders the items by creation time, then by ID (activities recorded
+    # before the items had IDs sort first among those created at the same time)
+    return item["created_at"], item.get("id", "")
@@ -0,0 +1,286 @@
+"""
+Module for the write-behind follower counters.
+
+Follows and unfollows don't write to the artist document. Each worker adds
+them to an in-memory delta per artist, and a background thread flushes the
+deltas every FOLLOWERS_FLUSH_SECONDS in one bulk write to the artists and
+their views, so a viral artist takes one write per flush instead of one per
+follow. The same flush sets the Neo4j follower popularity of the flushed
+artists from their new follower counts, and their score, which combines it
+with their Spotify popularity and is what orders the genre recommendations.
+
+The follower counts (and the scores) lag behind the follows by at most
+FOLLOWERS_FLUSH_SECONDS plus the duration of a flush. The deltas of a worker
+that dies before flushing are lost, which 'harmonics-api rebuild
+follower-counts' repairs.
+"""
+import math
+import threading
+import time
+from datetime import datetime, timezone
+from neo4j.exceptions import DriverError, Neo4jError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from harmonics_api.configs import mongodb, neo4j, settings
+from harmonics_api.utils import views
+
+REBUILD_BATCH_SIZE = 1_000
+
+# The score of an artist is the mean of its Spotify popularity and its
+# follower popularity, or the latter alone when the former is unknown
+SCORE_EXPRESSION = "(coalesce(a.popularity, a.follower_popularity) + a.follower_popularity) / 2.0"
+
+POPULARITY_STATEMENT = f"""
+    UNWIND $artists AS artist
+    MATCH (a:Artist {{id: artist.id}})
+    SET a.follower_popularity = artist.follower_popularity
+    SET a.score = {SCORE_EXPRESSION}
+    """
+
+stats = {
+    "flushes": 0,
+    "flushed_artists": 0,
+    "failures": 0,
+    "last_error": None,
+    "last_flushed_at": None,
+}
+
+# Deltas not written to the artists yet, deltas not written to their views
+# yet, and artists whose Neo4j popularity is out of date, all kept until a
+# flush succeeds
+_lock = threading.Lock()
+_pending = {
+    "deltas": {},
+    "view_deltas": {},
+    "popularity": set(),
+}
+
+def add(artist_id: str, amount: int) -> None:
+    """
+    Add a follow (amount = 1) or an unfollow (amount = -1) of an artist to the
+    next flush.
+    """
+    with _lock:
+        _pending["deltas"][artist_id] = _pending["deltas"].get(artist_id, 0) + amount
+
+def popularity(qt_followers: int) -> int:
+    """
+    Map a follower count to the 0-100 popularity of the catalog, on a log
+    scale that reaches 100 at a million followers.
+    """
+    return round(100 * min(math.log10(1 + max(qt_followers, 0)) / 6, 1.0))
+
+def score(spotify_popularity: int | None, qt_followers: int) -> float:
+    """
+    Combine the Spotify popularity of an artist, if known, with the
+    popularity of its follower count into its 0-100 score, like
+    SCORE_EXPRESSION.
+    """
+    follower_popularity = popularity(qt_followers)
+    if spotify_popularity is None:
+        return follower_popularity
+    return (spotify_popularity + follower_popularity) / 2
+
+def flush() -> int:
+    """
+    Write the buffered deltas to the artists and their views, then update
+    the Neo4j popularity of the changed artists. Returns the number of
+    artists whose counters were written.
+    """
+    with _lock:
+        deltas = {artist_id: delta for artist_id, delta in _pending["deltas"].items() if delta}
+        _pending["deltas"] = {}
+
+    if deltas:
+        try:
+            mongodb.db.artists.bulk_write(
+                [
+                    UpdateOne(
+                        {
+                            "_id": artist_id,
+                        },
+                        {
+                            "$inc": {
+                                "qt_followers": delta,
+                                "version": 1,
+                            },
+                        },
+                    )
+                    for artist_id, delta in deltas.items()
+                ],
+                ordered = False,
+            )
+        except BulkWriteError as e:
+            # The other updates were applied, so only the failed ones are
+            # retried, and the views and popularity of the others follow
+            artist_ids = list(deltas)
+            failed = {artist_ids[error["index"]] for error in e.details["writeErrors"]}
+            _requeue("deltas", {artist_id: deltas[artist_id] for artist_id in failed})
+            _written({
+                artist_id: delta for artist_id, delta in deltas.items() if artist_id not in failed
+            })
+            raise
+        except PyMongoError:
+            _requeue("deltas", deltas)
+            raise
+
+        _written(deltas)
+
+    with _lock:
+        view_deltas = {
+            artist_id: delta for artist_id, delta in _pending["view_deltas"].items() if delta
+        }
+        _pending["view_deltas"] = {}
+    if view_deltas:
+        try:
+            views.add_followers(view_deltas)
+        except PyMongoError:
+            _requeue("view_deltas", view_deltas)
+            raise
+
+    with _lock:
+        artist_ids = list(_pending["popularity"])
+    if artist_ids:
+        _set_popularity(mongodb.db.artists.find(
+            {
+                "_id": {
+                    "$in": artist_ids,
+                },
+            },
+            {
+                "qt_followers": True,
+            },
+        ))
+        with _lock:
+            _pending["popularity"].difference_update(artist_ids)
+
+    stats["flushes"] += 1
+    stats["flushed_artists"] += len(deltas)
+    stats["last_flushed_at"] = datetime.now(timezone.utc).isoformat()
+    return len(deltas)
+
+def rebuild() -> int:
+    """
+    Recount the followers of every artist from the users' follows, setting
+    them on the artists, their views and their Neo4j scores, and return
+    the number of artists. Deltas buffered by running workers are flushed on
+    top of the recount, so it's best run while the API is stopped.
+    """
+    counts = {
+        count["_id"]: count["qt_followers"]
+        for count in mongodb.db.users.aggregate([
+            {
+                "$unwind": "$follows",
+            },
+            {
+                "$group": {
+                    "_id": "$follows.id",
+                    "qt_followers": {
+                        "$sum": 1,
+                    },
+                },
+            },
+        ])
+    }
+
+    qt_artists = 0
+    artist_ids = []
+    for artist in mongodb.db.artists.find({}, {"_id": True}):
+        artist_ids.append(artist["_id"])
+        if len(artist_ids) == REBUILD_BATCH_SIZE:
+            _set_counts(artist_ids, counts)
+            qt_artists += len(artist_ids)
+            artist_ids = []
+    if artist_ids:
+        _set_counts(artist_ids, counts)
+        qt_artists += len(artist_ids)
+
+    return qt_artists
+
+def metrics() -> dict:
+    """
+    Report the deltas waiting for a flush and the flush counters.
+    """
+    with _lock:
+        pending_artists = len(_pending["deltas"])
+        pending_views = len(_pending["view_deltas"])
+        pending_popularity = len(_pending["popularity"])
+
+    return {
+        "flush_seconds": settings.FOLLOWERS_FLUSH_SECONDS,
+        "pending_artists": pending_artists,
+        "pending_views": pending_views,
+        "pending_popularity": pending_popularity,
+        **stats,
+    }
+
+def start() -> None:
+    """
+    Start the background thread that flushes the deltas.
+    """
+    threading.Thread(target = _work, name = "followers-flush", daemon = True).start()
+
+def _written(deltas: dict) -> None:
+    # Queues the views and the popularity of artists whose counters were written
+    with _lock:
+        _pending["popularity"].update(deltas)
+    _requeue("view_deltas", deltas)
+
+def _requeue(key: str, deltas: dict) -> None:
+    # Adds deltas that failed to be written back to the next flush
+    with _lock:
+        for artist_id, delta in deltas.items():
+            _pending[key][artist_id] = _pending[key].get(artist_id, 0) + delta
+
+def _set_counts(artist_ids: list, counts: dict) -> None:
+    # Sets the recounted followers of a batch of artists
+    mongodb.db.artists.bulk_write(
+        [
+            UpdateOne(
+                {
+                    "_id": artist_id,
+                },
+                {
+                    "$set": {
+                        "qt_followers": counts.get(artist_id, 0),
+                    },
+                    "$inc": {
+                        "version": 1,
+                    },
+                },
+            )
+            for artist_id in artist_ids
+        ],
+        ordered = False,
+    )
+    views.set_followers({artist_id: counts.get(artist_id, 0) for artist_id in artist_ids})
+    _set_popularity(
+        {
+            "_id": artist_id,
+            "qt_followers": counts.get(artist_id, 0),
+        }
+        for artist_id in artist_ids
+    )
+
+def _set_popularity(artists) -> None:
+    # Sets the Neo4j follower popularity (and so the score) of the artists
+    # from their follower counts
+    neo4j.driver.execute_query(
+        POPULARITY_STATEMENT,
+        artists = [
+            {
+                "id": artist["_id"],
+                "follower_popularity": popularity(artist.get("qt_followers", 0)),
+            }
+            for artist in artists
+        ],
+    )
+
+def _work() -> None:
+    while True:
+        time.sleep(settings.FOLLOWERS_FLUSH_SECONDS)
+        try:
+            flush()
+        except (PyMongoError, Neo4jError, DriverError) as e:
+            stats["failures"] += 1
+            stats["last_error"] = str(e)
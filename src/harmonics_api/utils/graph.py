@@ -0,0 +1,422 @@
+"""
+Module for the in-process graph engine.
+
+With GRAPH_ENGINE=memory the graph is loaded from Neo4j into compressed
+sparse row (CSR) NumPy arrays, with the node IDs interned as integers, and
+the recommendation traversals run in-process instead of as Cypher queries.
+The user mutations are applied on top of the loaded arrays as they commit,
+and the graph is reloaded from Neo4j every GRAPH_RESYNC_SECONDS, which is
+also when the mutations handled by other workers show up.
+"""
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from harmonics_api.configs import neo4j, settings
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ENABLED = settings.GRAPH_ENGINE == "memory"
+
+LOAD_QUERIES = {
+    "users": """
+        MATCH (u:User)
+        RETURN u.username AS username
+        """,
+    "artists": """
+        MATCH (a:Artist)
+        RETURN a.id AS id, a.score AS score
+        """,
+    "genres": """
+        MATCH (a:Artist)-[:BELONGS_TO]->(g:Genre)
+        RETURN a.id AS artist_id, g.name AS genre
+        """,
+    "follows": """
+        MATCH (u:User)-[:FOLLOWS]->(a:Artist)
+        RETURN u.username AS username, a.id AS artist_id
+        """,
+    "ratings": """
+        MATCH (u:User)-[r:RATED]->(rel:Release)
+        RETURN u.username AS username, rel.id AS release_id, r.rating AS rating
+        """,
+    "friendships": """
+        MATCH (u1:User)-[:FRIENDS_WITH]->(u2:User)
+        RETURN u1.username AS username1, u2.username AS username2
+        """,
+}
+
+# Relations changed by the user mutations, the others only change on resync
+DYNAMIC_RELATIONS = ("follows", "friends", "ratings", "raters")
+
+# Relations from users, mapped to their reverse relations
+USER_RELATIONS = {
+    "follows": None,
+    "friends": "friends",
+    "ratings": "raters",
+}
+
+stats = {
+    "syncs": 0,
+    "failures": 0,
+    "last_error": None,
+    "last_synced_at": None,
+    "sync_seconds": None,
+}
+
+# The lock guards the snapshot, the changes applied on top of it and the log
+# of events applied while a resync is loading
+_lock = threading.Lock()
+_state = {
+    "snapshot": {},
+    "changes": {relation: {} for relation in DYNAMIC_RELATIONS},
+    "loading": False,
+    "log": [],
+}
+
+def load() -> dict:
+    """
+    Load the graph from Neo4j into a snapshot of interned nodes and CSR
+    adjacency arrays.
+    """
+    users = _nodes()
+    artists = _nodes()
+    genres = _nodes()
+    releases = _nodes()
+
+    for record in _stream("users"):
+        _intern(users, record["username"])
+
+    scores = []
+    for record in _stream("artists"):
+        _intern(artists, record["id"])
+        scores.append(record["score"] or 0)
+    scores = np.array(scores, dtype = np.float64)
+
+    artist_genres = ([], [])
+    for record in _of_loaded_artists(_stream("genres"), artists):
+        artist_genres[0].append(artists["ids"][record["artist_id"]])
+        artist_genres[1].append(_intern(genres, record["genre"]))
+
+    follows = ([], [])
+    for record in _of_loaded_artists(_stream("follows"), artists):
+        follows[0].append(_intern(users, record["username"]))
+        follows[1].append(artists["ids"][record["artist_id"]])
+
+    ratings = ([], [], [])
+    for record in _stream("ratings"):
+        ratings[0].append(_intern(users, record["username"]))
+        ratings[1].append(_intern(releases, record["release_id"]))
+        ratings[2].append(record["rating"])
+
+    friendships = set()
+    for record in _stream("friendships"):
+        user1 = _intern(users, record["username1"])
+        user2 = _intern(users, record["username2"])
+        friendships.update(((user1, user2), (user2, user1)))
+    friends = tuple(zip(*friendships)) or ((), ())
+
+    # Each genre's artists are kept from the highest to the lowest score
+    by_score = np.argsort(-scores[artist_genres[0]], kind = "stable")
+    genre_artists = (
+        np.array(artist_genres[1], dtype = np.int64)[by_score],
+        np.array(artist_genres[0], dtype = np.int64)[by_score],
+    )
+
+    return {
+        "users": users,
+        "artists": artists,
+        "genres": genres,
+        "releases": releases,
+        "scores": scores,
+        "follows": _csr(follows[0], follows[1], len(users["keys"])),
+        "friends": _csr(friends[0], friends[1], len(users["keys"])),
+        "ratings": _csr(ratings[0], ratings[1], len(users["keys"]), ratings[2]),
+        "raters": _csr(ratings[1], ratings[0], len(releases["keys"]), ratings[2]),
+        "artist_genres": _csr(artist_genres[0], artist_genres[1], len(artists["keys"])),
+        "genre_artists": _csr(genre_artists[0], genre_artists[1], len(genres["keys"])),
+    }
+
+def sync() -> None:
+    """
+    Reload the graph from Neo4j and swap it in, replaying the events applied
+    while it was loading.
+    """
+    started = time.monotonic()
+    with _lock:
+        _state["loading"] = True
+        _state["log"] = []
+
+    try:
+        snapshot = load()
+    finally:
+        with _lock:
+            _state["loading"] = False
+
+    with _lock:
+        _state["snapshot"] = snapshot
+        _state["changes"] = {relation: {} for relation in DYNAMIC_RELATIONS}
+        for event_type, params in _state["log"]:
+            _apply(event_type, params)
+        _state["log"] = []
+
+    stats["syncs"] += 1
+    stats["last_synced_at"] = datetime.now(timezone.utc).isoformat()
+    stats["sync_seconds"] = time.monotonic() - started
+
+def start() -> None:
+    """
+    Load the graph and start the background thread that resyncs it.
+    """
+    if np is None:
+        raise RuntimeError("GRAPH_ENGINE=memory requires NumPy, install harmonics-api[graph]")
+
+    sync()
+    threading.Thread(target = _work, name = "graph-resync", daemon = True).start()
+
+def apply(event_type: str, params: dict) -> None:
+    """
+    Apply a committed user mutation (an outbox event) to the graph.
+    """
+    with _lock:
+        _apply(event_type, params)
+        if _state["loading"]:
+            _state["log"].append((event_type, params))
+
+def metrics() -> dict:
+    """
+    Report the size of the graph, the changes applied since the last resync
+    and the resync counters.
+    """
+    with _lock:
+        snapshot = _state["snapshot"]
+        qt_changes = sum(
+            len(targets)
+            for changes in _state["changes"].values()
+            for targets in changes.values()
+        )
+        sizes = {}
+        if snapshot:
+            sizes = {
+                "qt_users": len(snapshot["users"]["keys"]),
+                "qt_artists": len(snapshot["artists"]["keys"]),
+                "qt_releases": len(snapshot["releases"]["keys"]),
+                "qt_follows": len(snapshot["follows"]["indices"]),
+                "qt_friendships": len(snapshot["friends"]["indices"]) // 2,
+                "qt_ratings": len(snapshot["ratings"]["indices"]),
+            }
+
+    return {
+        "enabled": ENABLED,
+        **sizes,
+        "qt_changes": qt_changes,
+        **stats,
+    }
+
+def artist_recs(username: str) -> dict | None:
+    """
+    Get the user's top genre and the most popular artists of it the user
+    doesn't follow, like recs.get_artist_recs.
+    """
+    with _lock:
+        snapshot = _state["snapshot"]
+        user = snapshot["users"]["ids"].get(username)
+        if user is None:
+            return None
+
+        followed, _ = _edges(snapshot, "follows", user)
+        genres, _ = _gather(snapshot["artist_genres"], followed)
+        if not genres.size:
+            return None
+        genre = int(np.argmax(np.bincount(genres)))
+
+        artists, _ = _gather(snapshot["genre_artists"], np.array([genre]))
+        artists = artists[~np.isin(artists, followed)][:10]
+
+        return {
+            "genre": snapshot["genres"]["keys"][genre],
+            "artist_ids": [snapshot["artists"]["keys"][artist] for artist in artists.tolist()],
+        }
+
+def friends_ratings(username: str) -> list:
+    """
+    Get the highest (6 or more) ratings of the user's friends, like
+    recs.FRIENDS_RATINGS_QUERY.
+    """
+    with _lock:
+        snapshot = _state["snapshot"]
+        user = snapshot["users"]["ids"].get(username)
+        if user is None:
+            return []
+
+        results = []
+        friends, _ = _edges(snapshot, "friends", user)
+        for friend in friends.tolist():
+            releases, ratings = _edges(snapshot, "ratings", friend)
+            for release, rating in zip(releases.tolist(), ratings.tolist()):
+                if rating >= 6:
+                    results.append({
+                        "friend_username": snapshot["users"]["keys"][friend],
+                        "release_id": snapshot["releases"]["keys"][release],
+                        "rating": rating,
+                    })
+
+    results.sort(key = lambda result: result["rating"], reverse = True)
+    return results[:10]
+
+def friend_recs_by_reviews(username: str) -> dict | None:
+    """
+    Pick one of the user's highest rated releases at random and get the
+    non-friends who rated it highly, like recs.FRIEND_RECS_BY_REVIEWS_QUERY.
+    """
+    with _lock:
+        snapshot = _state["snapshot"]
+        user = snapshot["users"]["ids"].get(username)
+        if user is None:
+            return None
+
+        releases, ratings = _edges(snapshot, "ratings", user)
+        releases = releases[ratings >= 6]
+        if not releases.size:
+            return None
+        release = random.choice(releases.tolist())
+
+        raters, ratings = _edges(snapshot, "raters", release)
+        friends, _ = _edges(snapshot, "friends", user)
+        candidates = (ratings >= 6) & (raters != user) & ~np.isin(raters, friends)
+        raters = raters[candidates]
+        ratings = ratings[candidates]
+        by_rating = np.argsort(-ratings, kind = "stable")[:10]
+
+        return {
+            "release_id": snapshot["releases"]["keys"][release],
+            "candidates": [
+                {
+                    "username": snapshot["users"]["keys"][rater],
+                    "rating": rating,
+                }
+                for rater, rating in zip(raters[by_rating].tolist(), ratings[by_rating].tolist())
+            ],
+        }
+
+def _apply(event_type: str, params: dict) -> None:
+    snapshot = _state["snapshot"]
+    if not snapshot:
+        return
+    users = snapshot["users"]
+
+    match event_type:
+        case "create_user":
+            _intern(users, params["username"])
+        case "follow" | "unfollow":
+            artist = snapshot["artists"]["ids"].get(params["artist_id"])
+            if artist is None:
+                return
+            user = _intern(users, params["username"])
+            _change("follows", user, artist, 1 if event_type == "follow" else None)
+        case "rate" | "unrate":
+            user = _intern(users, params["username"])
+            release = _intern(snapshot["releases"], params["release_id"])
+            rating = params["rating"] if event_type == "rate" else None
+            _change("ratings", user, release, rating)
+            _change("raters", release, user, rating)
+        case "befriend" | "unfriend":
+            user1 = _intern(users, params["username"])
+            user2 = _intern(users, params["friend_username"])
+            value = 1 if event_type == "befriend" else None
+            _change("friends", user1, user2, value)
+            _change("friends", user2, user1, value)
+        case "delete_user":
+            user = users["ids"].get(params["username"])
+            if user is not None:
+                _remove_edges(snapshot, user)
+
+def _remove_edges(snapshot: dict, user: int) -> None:
+    for relation, reverse in USER_RELATIONS.items():
+        targets, _ = _edges(snapshot, relation, user)
+        for target in targets.tolist():
+            _change(relation, user, target, None)
+            if reverse:
+                _change(reverse, target, user, None)
+
+def _change(relation: str, source: int, target: int, value) -> None:
+    # None removes the edge, anything else adds it with that value
+    _state["changes"][relation].setdefault(source, {})[target] = value
+
+def _edges(snapshot: dict, relation: str, node: int) -> tuple:
+    # The targets and values of a node's edges, with the changes applied
+    csr = snapshot[relation]
+    if node < len(csr["indptr"]) - 1:
+        first, last = csr["indptr"][node], csr["indptr"][node + 1]
+        targets = csr["indices"][first:last]
+        values = csr["data"][first:last]
+    else:
+        targets = np.empty(0, dtype = np.int64)
+        values = np.empty(0, dtype = np.int64)
+
+    changes = _state["changes"].get(relation, {}).get(node)
+    if not changes:
+        return targets, values
+
+    unchanged = ~np.isin(targets, np.array(list(changes), dtype = np.int64))
+    added = [(target, value) for target, value in changes.items() if value is not None]
+    return (
+        np.concatenate((targets[unchanged], np.array([t for t, _ in added], dtype = np.int64))),
+        np.concatenate((values[unchanged], np.array([v for _, v in added], dtype = np.int64))),
+    )
+
+def _gather(csr: dict, nodes) -> tuple:
+    # The targets and values of the edges of several nodes of a static relation
+    nodes = nodes[nodes < len(csr["indptr"]) - 1]
+    starts = csr["indptr"][nodes]
+    lengths = csr["indptr"][nodes + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    return csr["indices"][offsets], csr["data"][offsets]
+
+def _csr(sources, targets, qt_nodes: int, values = None) -> dict:
+    sources = np.array(sources, dtype = np.int64)
+    order = np.argsort(sources, kind = "stable")
+    indptr = np.zeros(qt_nodes + 1, dtype = np.int64)
+    np.cumsum(np.bincount(sources, minlength = qt_nodes), out = indptr[1:])
+    if values is None:
+        values = np.ones(len(sources), dtype = np.int64)
+    return {
+        "indptr": indptr,
+        "indices": np.array(targets, dtype = np.int32)[order],
+        "data": np.array(values, dtype = np.int16)[order],
+    }
+
+def _nodes() -> dict:
+    return {
+        "ids": {},
+        "keys": [],
+    }
+
+def _intern(nodes: dict, key: str) -> int:
+    node = nodes["ids"].get(key)
+    if node is None:
+        node = len(nodes["keys"])
+        nodes["ids"][key] = node
+        nodes["keys"].append(key)
+    return node
+
+def _of_loaded_artists(records, artists: dict):
+    # Each query reads the graph as it is when it runs, so the relationships
+    # of artists created after the artists were read are left to the next sync
+    return (record for record in records if record["artist_id"] in artists["ids"])
+
+def _stream(name: str):
+    with neo4j.driver.session() as session:
+        yield from session.run(LOAD_QUERIES[name])
+
+def _work() -> None:
+    while True:
+        time.sleep(settings.GRAPH_RESYNC_SECONDS)
+        # Any error is recorded, so the graph keeps being resynced
+        try:
+            sync()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            stats["failures"] += 1
+            stats["last_error"] = str(e)
@@ -1,15 +1,60 @@
 """
 Module for the helper functions of the app.
 """
-from harmonics_api.configs import mongodb, neo4j
+import hashlib
+from flask import Response
+from harmonics_api.utils import outbox, ratings, routing, views
+
+EXISTS_QUERIES = {
+    "rating": """
+        RETURN EXISTS(
+            (:User {username: $username})-[:RATED]->(:Release {id: $release_id})
+        ) AS exists
+        """,
+    "follow": """
+        RETURN EXISTS(
+            (:User {username: $username})-[:FOLLOWS]->(:Artist {id: $artist_id})
+        ) AS exists
+        """,
+    "friendship": """
+        RETURN EXISTS(
+            (:User {username: $username1})-[:FRIENDS_WITH]-(:User {username: $username2})
+        ) AS exists
+        """,
+    "genre": """
+        MATCH (g:Genre {name: $genre})
+        RETURN COUNT(g) > 0 AS exists
+        """,
+}
+
+# Fields of the user document that mirror the user's relationships in Neo4j
+USER_RELATIONSHIP_FIELDS = {
+    "follow": "follows.id",
+    "friendship": "friends",
+}
 
 def exists(entity: str, *identifiers: str) -> bool:
     """
     Check if an entity exists in the database.
     """
+    # With the outbox Neo4j lags behind MongoDB, so relationships are checked
+    # in MongoDB, which is always up to date
+    if outbox.ENABLED and entity == "rating":
+        return ratings.exists(*identifiers)
+    if outbox.ENABLED and entity in USER_RELATIONSHIP_FIELDS:
+        return routing.db().users.find_one(
+            {
+                "username": identifiers[0],
+                USER_RELATIONSHIP_FIELDS[entity]: identifiers[1],
+            },
+            {
+                "_id": True,
+            },
+        ) is not None
+
     match entity:
         case "user":
-            return mongodb.db.users.find_one(
+            return routing.db().users.find_one(
                 {
                     "username": identifiers[0],
                 },
@@ -18,7 +63,7 @@ def exists(entity: str, *identifiers: str) -> bool:
                 },
             ) is not None
         case "artist":
-            return mongodb.db.artists.find_one(
+            return routing.db().artists.find_one(
                 {
                     "_id": identifiers[0],
                 },
@@ -27,7 +72,7 @@ def exists(entity: str, *identifiers: str) -> bool:
                 },
             ) is not None
         case "release":
-            return mongodb.db.artists.find_one(
+            return routing.db().artists.find_one(
                 {
                     "releases.id": identifiers[0],
                 },
@@ -36,42 +81,173 @@ def exists(entity: str, *identifiers: str) -> bool:
                 },
             ) is not None
         case "rating":
-            return neo4j.driver.execute_query(
-                """
-                RETURN EXISTS(
-                    (:User {username: $username})-[:RATED]->(:Release {id: $release_id})
-                ) AS exists
-                """,
+            return routing.read_single(
+                EXISTS_QUERIES["rating"],
                 username = identifiers[0],
                 release_id = identifiers[1],
-            )[0][0]["exists"]
+            )["exists"]
         case "follow":
-            return neo4j.driver.execute_query(
-                """
-                RETURN EXISTS(
-                    (:User {username: $username})-[:FOLLOWS]->(:Artist {id: $artist_id})
-                ) AS exists
-                """,
+            return routing.read_single(
+                EXISTS_QUERIES["follow"],
                 username = identifiers[0],
                 artist_id = identifiers[1],
-            )[0][0]["exists"]
+            )["exists"]
         case "friendship":
-            return neo4j.driver.execute_query(
-                """
-                RETURN EXISTS(
-                    (:User {username: $username1})-[:FRIENDS_WITH]-(:User {username: $username2})
-                ) AS exists
-                """,
+            return routing.read_single(
+                EXISTS_QUERIES["friendship"],
                 username1 = identifiers[0],
                 username2 = identifiers[1],
-            )[0][0]["exists"]
+            )["exists"]
         case "genre":
-            return neo4j.driver.execute_query(
-                """
-                MATCH (g:Genre {name: $genre})
-                RETURN COUNT(g) > 0 AS exists
-                """,
+            return routing.read_single(
+                EXISTS_QUERIES["genre"],
                 genre = identifiers[0],
-            )[0][0]["exists"]
+            )["exists"]
+        case _:
+            raise ValueError(f"Unknown entity type: {entity}")
+
+def get_version(entity: str, identifier: str) -> str | None:
+    """
+    Get the version of a user, artist or release, which changes with every
+    change to it, without reading the rest of its document. Returns None if
+    it doesn't exist.
+    """
+    # The document ID is part of the version, so a user deleted and
+    # registered again doesn't reuse the versions of the old account
+    match entity:
+        case "user":
+            document = routing.db().users.find_one(
+                {
+                    "username": identifier,
+                },
+                {
+                    "version": {
+                        "$ifNull": ["$version", 0],
+                    },
+                },
+            )
+        case "artist":
+            # Artists are served from their views, which have their own versions
+            document = views.get_artist_view(identifier, ("version",))
+            if document:
+                document.setdefault("version", 0)
+        case "release":
+            document = routing.db().artists.find_one(
+                {
+                    "releases.id": identifier,
+                },
+                {
+                    "version": {
+                        "$ifNull": [
+                            {
+                                "$first": {
+                                    "$map": {
+                                        "input": {
+                                            "$filter": {
+                                                "input": "$releases",
+                                                "cond": {
+                                                    "$eq": ["$$this.id", identifier],
+                                                },
+                                            },
+                                        },
+                                        "in": "$$this.version",
+                                    },
+                                },
+                            },
+                            0,
+                        ],
+                    },
+                },
+            )
         case _:
             raise ValueError(f"Unknown entity type: {entity}")
+
+    if not document:
+        return None
+    return f"{document['_id']}.{document['version']}"
+
+def get_etag(entity: str, identifier: str, fields: list) -> str | None:
+    """
+    Build the strong ETag of a resource representation from the version of
+    the resource and the fields requested. Returns None if the resource
+    doesn't exist.
+    """
+    version = get_version(entity, identifier)
+    if version is None:
+        return None
+    representation = f"{version}:{','.join(fields)}"
+    return hashlib.sha256(representation.encode("utf-8")).hexdigest()[:32]
+
+def not_modified(etag: str) -> Response:
+    """
+    Build the empty 304 response for a representation the client already has.
+    """
+    response = Response(status = 304)
+    response.set_etag(etag)
+    return response
+
+def split_list_parameter(value: str) -> list:
+    """
+    Split a comma-separated query parameter into its non-empty items.
+    """
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+def parse_limit(value: str | None, default: int, maximum: int | None = None) -> int | None:
+    """
+    Parse the 'limit' query parameter (the default when it's missing), or
+    return None if it isn't an integer from 1 up to the maximum.
+    """
+    if value is None:
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        return None
+    if limit < 1 or (maximum is not None and limit > maximum):
+        return None
+    return limit
+
+def parse_fields(value: str | None, allowed: dict, key: str) -> tuple:
+    """
+    Parse the 'fields' query parameter into the list of requested fields (all
+    the allowed ones, the keys of 'allowed', when it's missing) and the list
+    of unknown ones. The key of the resource is always included, so it's
+    accepted but left out.
+    """
+    if not value:
+        return list(allowed), []
+
+    fields = [field for field in split_list_parameter(value) if field != key]
+    return (
+        [field for field in fields if field in allowed],
+        [field for field in fields if field not in allowed],
+    )
+
+def release_summary_pipeline(release_id: str) -> list:
+    """
+    Build the aggregation pipeline for the summary (ID, name and artist name)
+    of a release.
+    """
+    return [
+        {
+            "$match": {
+                "releases.id": release_id,
+            },
+        },
+        {
+            "$unwind": "$releases",
+        },
+        {
+            "$match": {
+                "releases.id": release_id,
+            },
+        },
+        {
+            "$project": {
+                "_id": False,
+                "id": "$releases.id",
+                "name": "$releases.name",
+                "artist": "$name",
+            },
+        },
+    ]
@@ -0,0 +1,189 @@
+"""
+Module for the genre affinity leaderboard.
+
+For every genre and user following artists of it, the 'genre_leaderboard'
+collection holds how many artists of the genre the user follows. The user
+routes keep the counts up to date, the ingest command moves them when the
+genres of an artist change, and indexes on (genre, follows) and
+(username, follows) make both the top users of a genre and the top genre of
+a user a read of the first entries, whatever the size of the genre.
+"""
+from pymongo import UpdateOne
+from harmonics_api.configs import mongodb
+from harmonics_api.utils import routing
+
+def add_follow(username: str, genres: list, amount: int, session = None) -> None:
+    """
+    Add (amount = 1) or remove (amount = -1) a follow of an artist in the
+    given genres to a user's counts.
+    """
+    for genre in genres:
+        mongodb.db.genre_leaderboard.update_one(
+            {
+                "genre": genre,
+                "username": username,
+            },
+            {
+                "$inc": {
+                    "follows": amount,
+                },
+            },
+            upsert = True,
+            session = session,
+        )
+
+    if amount < 0:
+        mongodb.db.genre_leaderboard.delete_many(
+            {
+                "username": username,
+                "genre": {
+                    "$in": genres,
+                },
+                "follows": {
+                    "$lte": 0,
+                },
+            },
+            session = session,
+        )
+
+def move_artist(artist_id: str, old_genres: list, new_genres: list) -> None:
+    """
+    Move the follows of an artist whose genres changed out of the genres it
+    left and into the ones it joined, for every user following it.
+    """
+    changes = [(genre, -1) for genre in old_genres if genre not in new_genres]
+    changes += [(genre, 1) for genre in new_genres if genre not in old_genres]
+    if not changes:
+        return
+
+    usernames = [
+        user["username"]
+        for user in mongodb.db.users.find(
+            {
+                "follows.id": artist_id,
+            },
+            {
+                "username": True,
+            },
+        )
+    ]
+    if not usernames:
+        return
+
+    mongodb.db.genre_leaderboard.bulk_write(
+        [
+            UpdateOne(
+                {
+                    "genre": genre,
+                    "username": username,
+                },
+                {
+                    "$inc": {
+                        "follows": amount,
+                    },
+                },
+                upsert = True,
+            )
+            for username in usernames
+            for genre, amount in changes
+        ],
+        ordered = False,
+    )
+    mongodb.db.genre_leaderboard.delete_many(
+        {
+            "username": {
+                "$in": usernames,
+            },
+            "genre": {
+                "$in": [genre for genre, amount in changes if amount < 0],
+            },
+            "follows": {
+                "$lte": 0,
+            },
+        },
+    )
+
+def remove_user(username: str, session = None) -> None:
+    """
+    Remove all counts of a user.
+    """
+    mongodb.db.genre_leaderboard.delete_many(
+        {
+            "username": username,
+        },
+        session = session,
+    )
+
+def get_top_genre(username: str) -> str | None:
+    """
+    Get the genre with the most artists followed by a user, or None if the
+    user follows no artists.
+    """
+    entry = routing.db().genre_leaderboard.find_one(
+        {
+            "username": username,
+        },
+        {
+            "_id": False,
+            "genre": True,
+        },
+        sort = [("follows", -1)],
+    )
+    return entry["genre"] if entry else None
+
+def get_top_users(genre: str, excluded: set, limit: int) -> list:
+    """
+    Get the usernames of the users following the most artists of a genre,
+    leaving out the excluded ones.
+    """
+    entries_cursor = routing.db().genre_leaderboard.find(
+        {
+            "genre": genre,
+        },
+        {
+            "_id": False,
+            "username": True,
+        },
+        sort = [("follows", -1)],
+        batch_size = limit + len(excluded),
+    )
+
+    usernames = []
+    for entry in entries_cursor:
+        if entry["username"] in excluded:
+            continue
+        usernames.append(entry["username"])
+        if len(usernames) == limit:
+            break
+    entries_cursor.close()
+    return usernames
+
+def rebuild() -> int:
+    """
+    Rebuild the leaderboard from the users' follows and return the number of
+    users counted.
+    """
+    artist_genres = {
+        artist["_id"]: artist["genres"]
+        for artist in mongodb.db.artists.find({}, {"genres": True})
+    }
+
+    mongodb.db.genre_leaderboard.delete_many({})
+
+    qt_users = 0
+    for user in mongodb.db.users.find({}, {"username": True, "follows": True}):
+        counts = {}
+        for follow in user["follows"]:
+            for genre in artist_genres.get(follow["id"], []):
+                counts[genre] = counts.get(genre, 0) + 1
+        if counts:
+            mongodb.db.genre_leaderboard.insert_many([
+                {
+                    "genre": genre,
+                    "username": user["username"],
+                    "follows": follows,
+                }
+                for genre, follows in counts.items()
+            ])
+        qt_users += 1
+    return qt_users
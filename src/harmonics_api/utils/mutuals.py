@@ -0,0 +1,147 @@
+"""
+Module for the mutual friends counts behind the friend recommendations.
+
+The counts come from a bounded two-hop traversal over FRIENDS_WITH: at most
+MAX_FRIENDS friends of the user are sampled, and friends with more than
+MAX_DEGREE friends of their own are skipped, so celebrity accounts don't
+blow up the query. The counts of each user are cached in the
+'mutual_friends' collection until a friendship change reaches them or they
+are MAX_CACHE_AGE old.
+
+With the outbox, Neo4j only has a friendship change once the outbox is
+drained, so the counts of a user aren't cached while a change that reaches
+them is still in the outbox: they'd be computed without it and outlive the
+invalidation made when it was committed.
+"""
+from datetime import datetime, timedelta, timezone
+from harmonics_api.configs import mongodb
+from harmonics_api.utils import outbox, routing
+
+MAX_FRIENDS = 200
+MAX_DEGREE = 1_000
+MAX_CANDIDATES = 10
+MAX_CACHE_AGE = timedelta(minutes = 5)
+
+# Outbox events that change friendships in Neo4j
+FRIENDSHIP_EVENTS = ("befriend", "unfriend")
+
+MUTUAL_FRIENDS_QUERY = """
+    MATCH (u:User {username: $username})-[:FRIENDS_WITH]-(friend:User)
+    WITH u, friend
+    ORDER BY rand()
+    LIMIT $max_friends
+    WITH u, friend
+    WHERE COUNT { (friend)-[:FRIENDS_WITH]-() } <= $max_degree
+    MATCH (friend)-[:FRIENDS_WITH]-(candidate:User)
+    WHERE candidate <> u
+    AND NOT EXISTS {
+        MATCH (u)-[:FRIENDS_WITH]-(candidate)
+    }
+    WITH candidate, count(DISTINCT friend) AS mutual_friends
+    ORDER BY mutual_friends DESC
+    LIMIT $max_candidates
+    RETURN collect({username: candidate.username, mutual_friends: mutual_friends}) AS candidates
+    """
+
+def get_candidates(username: str) -> list:
+    """
+    Get the users with the most mutual friends with a user (and who aren't
+    friends with them), with their counts.
+    """
+    cached = routing.db().mutual_friends.find_one(
+        {
+            "_id": username,
+        },
+    )
+    now = datetime.now(timezone.utc)
+    if cached and now - cached["computed_at"].replace(tzinfo = timezone.utc) < MAX_CACHE_AGE:
+        return cached["candidates"]
+
+    cacheable = not _has_pending_friendships(username)
+    candidates = routing.read_single(
+        MUTUAL_FRIENDS_QUERY,
+        username = username,
+        max_friends = MAX_FRIENDS,
+        max_degree = MAX_DEGREE,
+        max_candidates = MAX_CANDIDATES,
+    )["candidates"]
+
+    if not cacheable:
+        return candidates
+
+    mongodb.db.mutual_friends.replace_one(
+        {
+            "_id": username,
+        },
+        {
+            "_id": username,
+            "candidates": candidates,
+            "computed_at": now,
+        },
+        upsert = True,
+    )
+    return candidates
+
+def invalidate(username: str, friends: list) -> None:
+    """
+    Drop the cached counts that a new or removed friendship of a user can
+    change: the user's own and, unless the user is skipped by the traversal
+    for having too many friends, those of the user's friends.
+    """
+    affected = [username]
+    if len(friends) <= MAX_DEGREE:
+        affected.extend(friends)
+
+    mongodb.db.mutual_friends.delete_many(
+        {
+            "_id": {
+                "$in": affected,
+            },
+        },
+    )
+
+def _has_pending_friendships(username: str) -> bool:
+    # Checks whether the outbox still holds a change of the friendships of
+    # the user or of the user's friends, or the deletion of any user (whose
+    # former friends no longer list them)
+    if not outbox.ENABLED:
+        return False
+
+    user = mongodb.db.users.find_one(
+        {
+            "username": username,
+        },
+        {
+            "friends": True,
+        },
+    )
+    usernames = [username, *(user["friends"] if user else [])]
+
+    return mongodb.db.outbox.find_one(
+        {
+            "$or": [
+                {
+                    "type": "delete_user",
+                },
+                {
+                    "type": {
+                        "$in": FRIENDSHIP_EVENTS,
+                    },
+                    "params.username": {
+                        "$in": usernames,
+                    },
+                },
+                {
+                    "type": {
+                        "$in": FRIENDSHIP_EVENTS,
+                    },
+                    "params.friend_username": {
+                        "$in": usernames,
+                    },
+                },
+            ],
+        },
+        {
+            "_id": True,
+        },
+    ) is not None
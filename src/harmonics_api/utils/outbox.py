@@ -0,0 +1,276 @@
+"""
+Module for the transactional outbox that keeps Neo4j in sync with MongoDB.
+
+In "outbox" mode every user mutation appends an event to the 'outbox'
+collection inside the same MongoDB transaction as its document writes, and a
+background worker drains the events into Neo4j in UNWIND batches. In "sync"
+mode (the default) the same statements run right away, inside the request.
+"""
+import itertools
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from neo4j.exceptions import DriverError, Neo4jError
+from pymongo import ReplaceOne
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from harmonics_api.configs import mongodb, neo4j, settings
+from harmonics_api.utils import graph, routing
+
+ENABLED = settings.NEO4J_SYNC_MODE == "outbox"
+
+# Every statement receives a list of events, so a single event and a batch
+# of them take the same path. All of them are safe to replay.
+STATEMENTS = {
+    "create_user": """
+        UNWIND $events AS event
+        MERGE (:User {username: event.username})
+        """,
+    "delete_user": """
+        UNWIND $events AS event
+        MATCH (u:User {username: event.username})
+        DETACH DELETE u
+        """,
+    "rate": """
+        UNWIND $events AS event
+        MATCH (r:Release {id: event.release_id})
+        MATCH (u:User {username: event.username})
+        MERGE (u)-[rel:RATED]->(r)
+        ON CREATE SET rel.rating = event.rating
+        """,
+    "unrate": """
+        UNWIND $events AS event
+        MATCH (u:User {username: event.username})-[r:RATED]->(:Release {id: event.release_id})
+        DELETE r
+        """,
+    "follow": """
+        UNWIND $events AS event
+        MATCH (u:User {username: event.username})
+        MATCH (a:Artist {id: event.artist_id})
+        MERGE (u)-[:FOLLOWS]->(a)
+        """,
+    "unfollow": """
+        UNWIND $events AS event
+        MATCH (u:User {username: event.username})-[f:FOLLOWS]->(:Artist {id: event.artist_id})
+        DELETE f
+        """,
+    "befriend": """
+        UNWIND $events AS event
+        MATCH (u1:User {username: event.username})
+        MATCH (u2:User {username: event.friend_username})
+        MERGE (u1)-[:FRIENDS_WITH]->(u2)
+        MERGE (u1)<-[:FRIENDS_WITH]-(u2)
+        """,
+    "unfriend": """
+        UNWIND $events AS event
+        MATCH (u1:User {username: event.username})-[f1:FRIENDS_WITH]->(u2:User {username: event.friend_username})
+        MATCH (u1)<-[f2:FRIENDS_WITH]-(u2)
+        DELETE f1, f2
+        """,
+}
+
+stats = {
+    "applied": 0,
+    "dead_lettered": 0,
+    "batches": 0,
+    "failures": 0,
+    "last_error": None,
+    "last_applied_at": None,
+}
+
+_WORKER_ID = uuid.uuid4().hex
+
+# Events published by the transaction running in the current thread
+_published = threading.local()
+
+@contextmanager
+def transaction():
+    """
+    Open a MongoDB transaction when the outbox is enabled and yield its session.
+    Yields None in sync mode, so the writes behave as plain writes. Once the
+    writes are committed, the published events are applied to the in-process
+    graph.
+    """
+    _published.events = []
+
+    if not ENABLED:
+        yield None
+    else:
+        with mongodb.client.start_session() as session:
+            with session.start_transaction():
+                yield session
+
+    if graph.ENABLED:
+        for event_type, params in _published.events:
+            graph.apply(event_type, params)
+
+def publish(event_type: str, session, **params) -> None:
+    """
+    Publish a graph change, either to the outbox or straight to Neo4j.
+    """
+    if event_type not in STATEMENTS:
+        raise ValueError(f"Unknown event type: {event_type}")
+    _published.events.append((event_type, params))
+
+    if not ENABLED:
+        routing.write(STATEMENTS[event_type], events = [params])
+        return
+
+    mongodb.db.outbox.insert_one(
+        {
+            "type": event_type,
+            "params": params,
+        },
+        session = session,
+    )
+
+def drain(batch_size: int = settings.OUTBOX_BATCH_SIZE) -> int:
+    """
+    Apply the oldest pending events to Neo4j and return how many were handled,
+    or 0 if another worker holds the lease.
+
+    Events are read in insertion order and consecutive events of the same type
+    are sent as one UNWIND batch, so the order of a user's changes is kept.
+    Writes to the same user document conflict inside transactions, which is
+    what makes the insertion order of a user's events match their commit order.
+    Events of an unknown type are moved to 'outbox_dead_letters' instead, so
+    they don't stall the events behind them.
+    """
+    if not _acquire_lease():
+        return 0
+
+    events = tuple(
+        mongodb.db.outbox.find(
+            {},
+            sort = [("_id", 1)],
+            limit = batch_size,
+        )
+    )
+
+    qt_handled = 0
+    for event_type, run in itertools.groupby(events, key = lambda event: event["type"]):
+        batch = tuple(run)
+        # The lease is renewed before each batch, so a long drain keeps it,
+        # and stops if another worker took it over in the meantime
+        if qt_handled > 0 and not _acquire_lease():
+            break
+
+        if event_type in STATEMENTS:
+            neo4j.driver.execute_query(
+                STATEMENTS[event_type],
+                events = [event["params"] for event in batch],
+            )
+            stats["applied"] += len(batch)
+        else:
+            _dead_letter(batch, f"Unknown event type: {event_type}")
+            stats["dead_lettered"] += len(batch)
+        mongodb.db.outbox.delete_many(
+            {
+                "_id": {
+                    "$in": [event["_id"] for event in batch],
+                },
+            },
+        )
+        stats["batches"] += 1
+        stats["last_applied_at"] = datetime.now(timezone.utc).isoformat()
+        qt_handled += len(batch)
+
+    return qt_handled
+
+def metrics() -> dict:
+    """
+    Report the outbox backlog, its lag and the worker counters.
+    """
+    oldest = mongodb.db.outbox.find_one(
+        {},
+        {
+            "_id": True,
+        },
+        sort = [("_id", 1)],
+    )
+
+    lag_seconds = 0.0
+    if oldest:
+        lag_seconds = (
+            datetime.now(timezone.utc) - oldest["_id"].generation_time
+        ).total_seconds()
+
+    return {
+        "mode": settings.NEO4J_SYNC_MODE,
+        "pending": mongodb.db.outbox.count_documents({}),
+        "dead_letters": mongodb.db.outbox_dead_letters.count_documents({}),
+        "lag_seconds": lag_seconds,
+        **stats,
+    }
+
+def start_worker() -> None:
+    """
+    Start the background thread that drains the outbox.
+    """
+    threading.Thread(target = _work, name = "outbox-worker", daemon = True).start()
+
+def _acquire_lease() -> bool:
+    """
+    Take or renew the lease that makes this process the only outbox consumer.
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        mongodb.db.outbox_lease.update_one(
+            {
+                "_id": "worker",
+                "$or": [
+                    {
+                        "owner": _WORKER_ID,
+                    },
+                    {
+                        "expires_at": {
+                            "$lt": now,
+                        },
+                    },
+                ],
+            },
+            {
+                "$set": {
+                    "owner": _WORKER_ID,
+                    "expires_at": now + timedelta(seconds = settings.OUTBOX_LEASE_SECONDS),
+                },
+            },
+            upsert = True,
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+def _dead_letter(events: tuple, reason: str) -> None:
+    # Keeps events that can't be applied, keyed by their IDs so moving them
+    # again after a crash doesn't duplicate them
+    now = datetime.now(timezone.utc)
+    mongodb.db.outbox_dead_letters.bulk_write(
+        [
+            ReplaceOne(
+                {
+                    "_id": event["_id"],
+                },
+                {
+                    **event,
+                    "reason": reason,
+                    "dead_lettered_at": now,
+                },
+                upsert = True,
+            )
+            for event in events
+        ],
+        ordered = False,
+    )
+
+def _work() -> None:
+    while True:
+        try:
+            if drain() == settings.OUTBOX_BATCH_SIZE:
+                continue
+        except (PyMongoError, Neo4jError, DriverError) as e:
+            stats["failures"] += 1
+            stats["last_error"] = str(e)
+
+        time.sleep(settings.OUTBOX_POLL_SECONDS)
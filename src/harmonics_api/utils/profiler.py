@@ -0,0 +1,112 @@
+"""
+Module for the on-demand sampling profiler.
+
+While a profile runs, a thread takes the stack of every thread handling a
+request each SAMPLE_INTERVAL seconds, with sys._current_frames(), which
+costs the request threads nothing when no profile is running. The samples
+are folded into collapsed stacks ("frame;frame;frame count", the input of
+flame graph tools) and classified by what the sampled thread was doing.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+SAMPLE_INTERVAL = 0.005
+MAX_SECONDS = 60
+
+# Where a sample is counted, by the first of these that shows up in its stack
+CATEGORIES = (
+    ("json_encoding", (f"{os.sep}json{os.sep}", f"{os.sep}flask{os.sep}json{os.sep}")),
+    ("result_decoding", (f"{os.sep}bson{os.sep}",)),
+    ("driver_io", (f"{os.sep}pymongo{os.sep}", f"{os.sep}neo4j{os.sep}")),
+    ("route_logic", (f"{os.sep}harmonics_api{os.sep}",)),
+)
+
+# Threads handling a request, and whether a profile is running
+_lock = threading.Lock()
+_request_threads = set()
+_state = {
+    "running": False,
+}
+
+def init_app(app) -> None:
+    """
+    Register the request hooks that keep track of the request threads.
+    """
+    app.before_request(_before_request)
+    app.teardown_request(_teardown_request)
+
+def profile(seconds: float) -> dict | None:
+    """
+    Sample the request threads for some seconds and return the collapsed
+    stacks and the breakdown of the samples, or None if another profile is
+    already running.
+    """
+    with _lock:
+        if _state["running"]:
+            return None
+        _state["running"] = True
+
+    try:
+        stacks = Counter()
+        own_thread = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frames = sys._current_frames() # pylint: disable=protected-access
+            with _lock:
+                thread_ids = list(_request_threads)
+            for thread_id in thread_ids:
+                if thread_id != own_thread and thread_id in frames:
+                    stacks[_collapse(frames[thread_id])] += 1
+            del frames
+            time.sleep(SAMPLE_INTERVAL)
+    finally:
+        _state["running"] = False
+
+    breakdown = Counter()
+    for stack, count in stacks.items():
+        breakdown[_categorize(stack)] += count
+
+    qt_samples = sum(stacks.values())
+    return {
+        "seconds": seconds,
+        "interval": SAMPLE_INTERVAL,
+        "samples": qt_samples,
+        "breakdown": {
+            category: {
+                "samples": breakdown[category],
+                "share": breakdown[category] / qt_samples if qt_samples else 0.0,
+            }
+            for category in (*(name for name, _ in CATEGORIES), "other")
+        },
+        "collapsed": "\n".join(
+            f"{stack} {count}" for stack, count in stacks.most_common()
+        ),
+    }
+
+def _collapse(frame) -> str:
+    # Folds a stack into "file:function;..." from the outermost frame
+    names = []
+    while frame is not None:
+        names.append(f"{frame.f_code.co_filename}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+def _categorize(stack: str) -> str:
+    # Picks the category of a sample by the innermost frame that has one,
+    # so a route that's encoding JSON counts as JSON encoding
+    for frame in reversed(stack.split(";")):
+        for category, paths in CATEGORIES:
+            if any(path in frame for path in paths):
+                return category
+    return "other"
+
+def _before_request() -> None:
+    with _lock:
+        _request_threads.add(threading.get_ident())
+
+def _teardown_request(_error) -> None:
+    with _lock:
+        _request_threads.discard(threading.get_ident())
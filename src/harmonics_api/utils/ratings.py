@@ -0,0 +1,357 @@
+"""
+Module for the ratings, stored one per document in the 'ratings' collection.
+
+Ratings used to be embedded twice, in 'artists.releases[].ratings' and in
+'users.ratings', and the 'migrate-ratings' command moves them out while the
+API keeps serving. Until a release or user is migrated its embedded array
+keeps being the source of its ratings and counts, and once it is the array
+is gone and the release or user holds rating counters instead. Every write
+here picks the side by the presence of the array, in the same atomic update,
+so it never races with the migration of the document.
+"""
+from harmonics_api.configs import mongodb
+from harmonics_api.utils import routing
+
+def exists(username: str, release_id: str) -> bool:
+    """
+    Check if a user rated a release.
+    """
+    if mongodb.db.ratings.find_one(
+        {
+            "release_id": release_id,
+            "username": username,
+        },
+        {
+            "_id": True,
+        },
+    ) is not None:
+        return True
+
+    # Ratings from before the 'ratings' collection only have a document once migrated
+    return mongodb.db.users.find_one(
+        {
+            "username": username,
+            "ratings.id": release_id,
+        },
+        {
+            "_id": True,
+        },
+    ) is not None
+
+def add(username: str, release: dict, rating: int, created_at, session = None) -> list:
+    """
+    Add the rating of a user to a release (with its summary: ID, name and
+    artist name) and return the user's friends.
+    """
+    user = mongodb.db.users.find_one_and_update(
+        {
+            "username": username,
+            "ratings": {
+                "$exists": True,
+            },
+        },
+        {
+            "$inc": {
+                "version": 1,
+            },
+            "$push": {
+                "ratings": {
+                    "id": release["id"],
+                    "artist": release["artist"],
+                    "name": release["name"],
+                    "rating": rating,
+                    "created_at": created_at,
+                },
+            },
+        },
+        {
+            "friends": True,
+        },
+        session = session,
+    )
+    if user is None:
+        user = mongodb.db.users.find_one_and_update(
+            {
+                "username": username,
+            },
+            {
+                "$inc": {
+                    "qt_ratings": 1,
+                    "version": 1,
+                },
+            },
+            {
+                "friends": True,
+            },
+            session = session,
+        )
+
+    result = mongodb.db.artists.update_one(
+        {
+            "releases": {
+                "$elemMatch": {
+                    "id": release["id"],
+                    "ratings": {
+                        "$exists": True,
+                    },
+                },
+            },
+        },
+        {
+            "$push": {
+                "releases.$.ratings": {
+                    "username": username,
+                    "rating": rating,
+                    "created_at": created_at,
+                },
+            },
+            "$inc": {
+                "version": 1,
+                "releases.$.version": 1,
+            },
+        },
+        session = session,
+    )
+    if result.matched_count == 0:
+        mongodb.db.artists.update_one(
+            {
+                "releases.id": release["id"],
+            },
+            {
+                "$inc": {
+                    "version": 1,
+                    "releases.$.version": 1,
+                    "releases.$.rating_sum": rating,
+                    "releases.$.qt_ratings": 1,
+                },
+            },
+            session = session,
+        )
+
+    # An upsert, since the migration may have copied the rating already
+    mongodb.db.ratings.update_one(
+        {
+            "release_id": release["id"],
+            "username": username,
+        },
+        {
+            "$setOnInsert": {
+                "artist": release["artist"],
+                "name": release["name"],
+                "rating": rating,
+                "created_at": created_at,
+            },
+        },
+        upsert = True,
+        session = session,
+    )
+
+    return user["friends"]
+
+def remove(username: str, release_id: str, session = None) -> int | None:
+    """
+    Remove the rating of a user from a release and return it, or None if
+    there was no such rating.
+    """
+    document = mongodb.db.ratings.find_one_and_delete(
+        {
+            "release_id": release_id,
+            "username": username,
+        },
+        {
+            "rating": True,
+        },
+        session = session,
+    )
+    rating = document["rating"] if document else None
+
+    user = mongodb.db.users.find_one_and_update(
+        {
+            "username": username,
+            "ratings": {
+                "$exists": True,
+            },
+        },
+        {
+            "$pull": {
+                "ratings": {
+                    "id": release_id,
+                },
+            },
+            "$inc": {
+                "version": 1,
+            },
+        },
+        {
+            "ratings": {
+                "$elemMatch": {
+                    "id": release_id,
+                },
+            },
+        },
+        session = session,
+    )
+    if user is None:
+        mongodb.db.users.update_one(
+            {
+                "username": username,
+            },
+            {
+                "$inc": {
+                    "qt_ratings": -1,
+                    "version": 1,
+                },
+            },
+            session = session,
+        )
+    elif user.get("ratings"):
+        rating = user["ratings"][0]["rating"]
+
+    if rating is not None:
+        _remove_from_release(username, release_id, rating, session)
+    return rating
+
+def remove_user(username: str, session = None) -> dict:
+    """
+    Remove all ratings of a user from their releases and return them, as a
+    map of release ID to rating. The user document is left to the caller.
+    """
+    user = mongodb.db.users.find_one(
+        {
+            "username": username,
+        },
+        {
+            "ratings.id": True,
+            "ratings.rating": True,
+        },
+        session = session,
+    )
+
+    user_ratings = {item["id"]: item["rating"] for item in user.get("ratings", [])}
+    for document in mongodb.db.ratings.find(
+        {
+            "username": username,
+        },
+        {
+            "release_id": True,
+            "rating": True,
+        },
+        session = session,
+    ):
+        user_ratings.setdefault(document["release_id"], document["rating"])
+
+    for release_id, rating in user_ratings.items():
+        _remove_from_release(username, release_id, rating, session)
+
+    mongodb.db.ratings.delete_many(
+        {
+            "username": username,
+        },
+        session = session,
+    )
+    return user_ratings
+
+def get_user_ratings(username: str) -> list | None:
+    """
+    Get all ratings of a user, oldest first, or None if the user doesn't exist.
+    """
+    user = routing.db().users.find_one(
+        {
+            "username": username,
+        },
+        {
+            "ratings": True,
+        },
+    )
+    if not user:
+        return None
+    if "ratings" in user:
+        return user["ratings"]
+
+    return list(routing.db().ratings.find(
+        {
+            "username": username,
+        },
+        {
+            "_id": False,
+            "id": "$release_id",
+            "artist": True,
+            "name": True,
+            "rating": True,
+            "created_at": True,
+        },
+        sort = [("created_at", 1)],
+    ))
+
+def get_release_ratings(release_id: str) -> list:
+    """
+    Get all ratings of a migrated release, oldest first.
+    """
+    return list(routing.db().ratings.find(
+        {
+            "release_id": release_id,
+        },
+        {
+            "_id": False,
+            "username": True,
+            "rating": True,
+            "created_at": True,
+        },
+        sort = [("created_at", 1)],
+    ))
+
+def release_counters(release: dict) -> tuple:
+    """
+    Get the sum and the number of the ratings of a release document.
+    """
+    if "ratings" in release:
+        return (
+            sum(rating["rating"] for rating in release["ratings"]),
+            len(release["ratings"]),
+        )
+    return release.get("rating_sum", 0), release.get("qt_ratings", 0)
+
+def _remove_from_release(username: str, release_id: str, rating: int, session) -> None:
+    # Pulls the rating from the release's array, or takes it out of its
+    # counters if the release was migrated
+    result = mongodb.db.artists.update_one(
+        {
+            "releases": {
+                "$elemMatch": {
+                    "id": release_id,
+                    "ratings": {
+                        "$exists": True,
+                    },
+                },
+            },
+        },
+        {
+            "$pull": {
+                "releases.$.ratings": {
+                    "username": username,
+                },
+            },
+            "$inc": {
+                "version": 1,
+                "releases.$.version": 1,
+            },
+        },
+        session = session,
+    )
+    if result.matched_count > 0:
+        return
+
+    mongodb.db.artists.update_one(
+        {
+            "releases.id": release_id,
+        },
+        {
+            "$inc": {
+                "version": 1,
+                "releases.$.version": 1,
+                "releases.$.rating_sum": -rating,
+                "releases.$.qt_ratings": -1,
+            },
+        },
+        session = session,
+    )
@@ -0,0 +1,245 @@
+"""
+Module for routing reads between the primary and the secondary members.
+
+The reads of each GET endpoint go either to the primaries (the Neo4j cluster
+leader and the MongoDB primary) or to the secondaries (the Neo4j followers
+and read replicas, and the MongoDB secondaries), by READ_ROUTING_DEFAULT and
+the per-endpoint READ_ROUTING_OVERRIDES. Mutations, and anything outside of a
+request (the CLI commands and background workers), always use the primaries.
+
+A secondary can be behind the write a user just made, so the Neo4j bookmarks
+of a successful mutation on '/<username>/...' are kept for the user for
+READ_YOUR_WRITES_SECONDS and returned in the Harmonics-Consistency header.
+While they're kept by the worker, or sent back by the client in the same
+header (for when the next request lands on another worker), the user's
+Neo4j reads wait for the bookmarks on whichever member serves them, and the
+user's MongoDB reads go to the primary.
+
+The header is signed with CONSISTENCY_SECRET, so a client can't send back
+bookmarks or an expiry of its own, and bookmarks Neo4j rejects anyway make
+the request fall back to the primary without them.
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import secrets
+import threading
+import time
+from flask import g, has_request_context, request
+from neo4j import READ_ACCESS, WRITE_ACCESS, Bookmarks, unit_of_work
+from neo4j.exceptions import Neo4jError
+from harmonics_api.configs import mongodb, neo4j, settings
+from harmonics_api.utils import deadlines, tracing
+
+POLICIES = ("primary", "secondary")
+HEADER = "Harmonics-Consistency"
+
+# Without a shared secret, each worker only honors the tokens it signed
+SECRET = (settings.CONSISTENCY_SECRET or secrets.token_hex(32)).encode("utf-8")
+
+# Errors of Neo4j rejecting the bookmarks a transaction waits for
+REJECTED_BOOKMARK_CODES = (
+    "Neo.ClientError.Transaction.InvalidBookmark",
+    "Neo.ClientError.Transaction.InvalidBookmarkMixture",
+    "Neo.TransientError.Transaction.BookmarkTimeout",
+)
+
+# Policy of each endpoint overridden by READ_ROUTING_OVERRIDES ("endpoint=policy,...")
+ENDPOINT_POLICIES = {
+    endpoint.strip(): policy.strip()
+    for endpoint, policy in (
+        override.split("=", 1)
+        for override in settings.READ_ROUTING_OVERRIDES.split(",")
+        if "=" in override
+    )
+}
+
+for _policy in (settings.READ_ROUTING_DEFAULT, *ENDPOINT_POLICIES.values()):
+    if _policy not in POLICIES:
+        raise ValueError(f"Unknown read routing policy: {_policy}")
+
+# Bookmarks of the latest mutations of each user, with when they stop being kept
+_lock = threading.Lock()
+_recent_writes = {}
+
+def init_app(app) -> None:
+    """
+    Register the request hooks that pick the policy of each request and keep
+    the bookmarks of mutations.
+    """
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+
+def use_secondaries() -> bool:
+    """
+    Check if the reads of the current request may be served by secondaries.
+    """
+    if not has_request_context() or "read_policy" not in g:
+        return False
+    return g.read_policy == "secondary" and not g.recent_write
+
+def db():
+    """
+    Get the MongoDB database to read from in the current request.
+    """
+    return mongodb.secondary_db if use_secondaries() else mongodb.db
+
+def read(query: str, **parameters) -> list:
+    """
+    Run a read-only query in Neo4j and return its records.
+    """
+    @unit_of_work(timeout = deadlines.neo4j_timeout())
+    def work(transaction):
+        return list(transaction.run(query, parameters))
+
+    def run():
+        secondary = has_request_context() and g.get("read_policy") == "secondary"
+        access_mode = READ_ACCESS if secondary else WRITE_ACCESS
+        with _traced("read", query), _session(access_mode) as session:
+            if secondary:
+                return session.execute_read(work)
+            return session.execute_write(work)
+
+    return _without_rejected_bookmarks(run)
+
+def read_single(query: str, **parameters):
+    """
+    Run a read-only query in Neo4j and return its only record, or None if it
+    returns no records.
+    """
+    records = read(query, **parameters)
+    return records[0] if records else None
+
+def write(query: str, **parameters) -> None:
+    """
+    Run a write query in Neo4j, keeping its bookmarks for the user of the
+    current request.
+    """
+    @unit_of_work(timeout = deadlines.neo4j_timeout())
+    def work(transaction):
+        transaction.run(query, parameters).consume()
+
+    def run():
+        with _traced("write", query), _session(WRITE_ACCESS) as session:
+            session.execute_write(work)
+            return session.last_bookmarks()
+
+    bookmarks = _without_rejected_bookmarks(run)
+
+    if has_request_context() and "written_bookmarks" in g:
+        g.written_bookmarks.update(bookmarks.raw_values)
+
+def _session(access_mode: str):
+    # Opens a session that waits for the bookmarks the request depends on
+    bookmarks = g.get("bookmarks") if has_request_context() else None
+    return neo4j.driver.session(
+        default_access_mode = access_mode,
+        bookmarks = Bookmarks.from_raw_values(bookmarks) if bookmarks else None,
+    )
+
+def _without_rejected_bookmarks(run):
+    # Runs a transaction, running it again on the primary without the
+    # bookmarks of the request if Neo4j rejects them
+    try:
+        return run()
+    except Neo4jError as e:
+        if e.code not in REJECTED_BOOKMARK_CODES or not has_request_context():
+            raise
+        if not g.get("bookmarks"):
+            raise
+        g.bookmarks = []
+        g.read_policy = "primary"
+        return run()
+
+def _traced(access: str, query: str):
+    # Records a Neo4j transaction in the trace of the request
+    statement = " ".join(query.split())
+    return tracing.span(
+        f"neo4j.{access}",
+        {
+            "db.system": "neo4j",
+            "db.operation": access,
+            "db.statement": statement,
+        },
+        f"neo4j {statement}",
+    )
+
+def _before_request() -> None:
+    g.written_bookmarks = set()
+    if request.method != "GET":
+        g.read_policy = "primary"
+    else:
+        g.read_policy = ENDPOINT_POLICIES.get(request.endpoint, settings.READ_ROUTING_DEFAULT)
+
+    recent_writes = [_decode(request.headers.get(HEADER))]
+    username = (request.view_args or {}).get("username")
+    if username:
+        with _lock:
+            recent_writes.append(_recent_writes.get(username))
+    recent_writes = [
+        recent_write
+        for recent_write in recent_writes
+        if recent_write and recent_write["until"] > time.time()
+    ]
+
+    g.recent_write = bool(recent_writes)
+    g.bookmarks = sorted({
+        bookmark
+        for recent_write in recent_writes
+        for bookmark in recent_write["bookmarks"]
+    })
+
+def _after_request(response):
+    username = (request.view_args or {}).get("username")
+    if request.method == "GET" or not username or response.status_code >= 400:
+        return response
+
+    now = time.time()
+    recent_write = {
+        "bookmarks": sorted(g.written_bookmarks),
+        "until": now + settings.READ_YOUR_WRITES_SECONDS,
+    }
+    with _lock:
+        for expired in [name for name, entry in _recent_writes.items() if entry["until"] <= now]:
+            del _recent_writes[expired]
+        _recent_writes[username] = recent_write
+
+    response.headers[HEADER] = _encode(recent_write)
+    return response
+
+def _encode(recent_write: dict) -> str:
+    # Builds the signed Harmonics-Consistency token of a write
+    payload = base64.urlsafe_b64encode(json.dumps(recent_write).encode("utf-8")).decode("ascii")
+    return f"{payload}.{_sign(payload)}"
+
+def _sign(payload: str) -> str:
+    # Signs the payload of a Harmonics-Consistency token
+    return hmac.new(SECRET, payload.encode("utf-8"), hashlib.sha256).hexdigest()
+
+def _decode(token: str | None) -> dict | None:
+    # Reads a Harmonics-Consistency token, ignoring malformed and unsigned
+    # ones, and never trusting it for longer than READ_YOUR_WRITES_SECONDS
+    payload, _, signature = (token or "").partition(".")
+    if not payload or not hmac.compare_digest(
+        signature.encode("utf-8"),
+        _sign(payload).encode("ascii"),
+    ):
+        return None
+    try:
+        recent_write = json.loads(base64.urlsafe_b64decode(payload.encode("ascii")))
+    except (ValueError, binascii.Error):
+        return None
+    if (
+        not isinstance(recent_write, dict)
+        or not isinstance(recent_write.get("until"), (int, float))
+        or not isinstance(recent_write.get("bookmarks"), list)
+        or not all(isinstance(bookmark, str) for bookmark in recent_write["bookmarks"])
+    ):
+        return None
+    recent_write["until"] = min(
+        recent_write["until"],
+        time.time() + settings.READ_YOUR_WRITES_SECONDS,
+    )
+    return recent_write
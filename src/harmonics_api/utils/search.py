@@ -0,0 +1,361 @@
+"""
+Module for the search indexes of the app.
+
+The indexes live in their own collections, derived from the catalog and the
+users and kept up to date at ingest time and by the user routes, so searching
+never scans the 'artists' or 'users' collections.
+"""
+import math
+import re
+import unicodedata
+from pymongo import UpdateOne
+from harmonics_api.configs import mongodb, neo4j
+from harmonics_api.utils import followers, routing
+
+MAX_RESULTS = 50
+# Name search only scores the entries sharing enough trigrams with the query
+# to reach NAME_MIN_SIMILARITY, and ranks the NAME_CANDIDATES sharing the most
+NAME_CANDIDATES = 200
+NAME_MIN_SIMILARITY = 0.3
+POPULARITY_WEIGHT = 0.2
+
+def tokenize(text: str) -> list:
+    """
+    Split a text into lowercase, accent-free word tokens.
+    """
+    normalized = unicodedata.normalize("NFKD", text.casefold())
+    stripped = "".join(char for char in normalized if not unicodedata.combining(char))
+    return re.findall(r"\w+", stripped)
+
+def trigrams(text: str) -> list:
+    """
+    Split a text into the padded trigrams of its tokens, so that names still
+    match when the query has typos.
+    """
+    grams = set()
+    for token in tokenize(text):
+        padded = f"  {token} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return sorted(grams)
+
+def index_tracks(artist: dict) -> None:
+    """
+    Replace the track search entries of an artist with its current tracks.
+    """
+    mongodb.db.track_search.delete_many(
+        {
+            "artist.id": artist["_id"],
+        },
+    )
+
+    entries = []
+    for release in artist["releases"]:
+        for position, track in enumerate(release["tracks"]):
+            entries.append({
+                "_id": f"{release['id']}:{position}",
+                "name": track["name"],
+                "tokens": sorted(set(tokenize(track["name"]))),
+                "artist": {
+                    "id": artist["_id"],
+                    "name": artist["name"],
+                },
+                "release": {
+                    "id": release["id"],
+                    "name": release["name"],
+                },
+            })
+
+    if entries:
+        mongodb.db.track_search.insert_many(entries, ordered = False)
+
+def rebuild_tracks() -> int:
+    """
+    Rebuild the track search index from the whole catalog and return the
+    number of artists indexed.
+    """
+    artists_cursor = mongodb.db.artists.find(
+        {},
+        {
+            "name": True,
+            "releases.id": True,
+            "releases.name": True,
+            "releases.tracks.name": True,
+        },
+    )
+
+    qt_artists = 0
+    for artist in artists_cursor:
+        index_tracks(artist)
+        qt_artists += 1
+    return qt_artists
+
+def search_tracks(query: str, limit: int) -> list:
+    """
+    Find tracks whose names contain every token of the query, the last one
+    being matched as a prefix so partially typed words autocomplete.
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+
+    complete_tokens, prefix = tokens, None
+    if not query[-1].isspace():
+        complete_tokens, prefix = tokens[:-1], tokens[-1]
+
+    conditions = [{"tokens": token} for token in complete_tokens]
+    if prefix:
+        conditions.append({"tokens": {"$regex": f"^{re.escape(prefix)}"}})
+
+    tracks_cursor = routing.db().track_search.find(
+        {
+            "$and": conditions,
+        },
+        {
+            "_id": False,
+            "name": True,
+            "artist": True,
+            "release": True,
+        },
+    ).limit(min(limit, MAX_RESULTS))
+
+    return list(tracks_cursor)
+
+def index_artist_name(artist: dict, popularity: int | None = None) -> None:
+    """
+    Add or replace the name search entry of an artist, ranked by its score,
+    which combines its Spotify popularity (0-100), when known, with its
+    follower count.
+    """
+    normalized_popularity = followers.score(popularity, artist.get("qt_followers", 0)) / 100
+
+    mongodb.db.name_search.replace_one(
+        {
+            "_id": f"artist:{artist['_id']}",
+        },
+        {
+            "kind": "artist",
+            "key": artist["_id"],
+            "name": artist["name"],
+            "grams": trigrams(artist["name"]),
+            "popularity": normalized_popularity,
+        },
+        upsert = True,
+    )
+
+def index_user_name(user: dict) -> None:
+    """
+    Add or replace the name search entry of a user, matching both the username
+    and the display name.
+    """
+    mongodb.db.name_search.replace_one(
+        {
+            "_id": f"user:{user['username']}",
+        },
+        {
+            "kind": "user",
+            "key": user["username"],
+            "name": user.get("name"),
+            "grams": trigrams(f"{user['username']} {user.get('name') or ''}"),
+            "popularity": _user_popularity(len(user.get("friends", []))),
+        },
+        upsert = True,
+    )
+
+def refresh_user_popularities(usernames: list) -> None:
+    """
+    Update the popularity of the name search entries of users whose number of
+    friends changed.
+    """
+    users_cursor = mongodb.db.users.find(
+        {
+            "username": {
+                "$in": usernames,
+            },
+        },
+        {
+            "_id": False,
+            "username": True,
+            "friends": True,
+        },
+    )
+
+    operations = [
+        UpdateOne(
+            {
+                "_id": f"user:{user['username']}",
+            },
+            {
+                "$set": {
+                    "popularity": _user_popularity(len(user.get("friends", []))),
+                },
+            },
+        )
+        for user in users_cursor
+    ]
+    if operations:
+        mongodb.db.name_search.bulk_write(operations, ordered = False)
+
+def unindex_user_name(username: str) -> None:
+    """
+    Remove the name search entry of a user.
+    """
+    mongodb.db.name_search.delete_one(
+        {
+            "_id": f"user:{username}",
+        },
+    )
+
+def rebuild_artist_names() -> int:
+    """
+    Rebuild the artist name search entries and return the number of artists indexed.
+    """
+    records, _, _ = neo4j.driver.execute_query(
+        """
+        MATCH (a:Artist)
+        RETURN a.id AS id, a.popularity AS popularity
+        """,
+    )
+    popularities = {record["id"]: record["popularity"] for record in records}
+
+    artists_cursor = mongodb.db.artists.find(
+        {},
+        {
+            "name": True,
+            "qt_followers": True,
+        },
+    )
+
+    qt_artists = 0
+    for artist in artists_cursor:
+        index_artist_name(artist, popularities.get(artist["_id"]))
+        qt_artists += 1
+    return qt_artists
+
+def rebuild_user_names() -> int:
+    """
+    Rebuild the user name search entries and return the number of users indexed.
+    """
+    users_cursor = mongodb.db.users.find(
+        {},
+        {
+            "_id": False,
+            "username": True,
+            "name": True,
+            "friends": True,
+        },
+    )
+
+    qt_users = 0
+    for user in users_cursor:
+        index_user_name(user)
+        qt_users += 1
+    return qt_users
+
+def search_names_pipeline(kind: str, query_grams: list) -> list:
+    """
+    Build the aggregation pipeline for the name search candidates, the entries
+    sharing the most trigrams with the query. Entries too dissimilar to reach
+    NAME_MIN_SIMILARITY are dropped before the sort, and nothing is cut
+    before it.
+    """
+    min_shared = min_shared_grams(len(query_grams))
+    return [
+        {
+            # An entry sharing min_shared of the query trigrams shares at
+            # least one of any len(query_grams) - min_shared + 1 of them, so
+            # the index only reads the entries holding one of those
+            "$match": {
+                "kind": kind,
+                "grams": {
+                    "$in": query_grams[:len(query_grams) - min_shared + 1],
+                },
+            },
+        },
+        {
+            "$addFields": {
+                "qt_shared": {
+                    "$size": {
+                        "$setIntersection": ["$grams", query_grams],
+                    },
+                },
+            },
+        },
+        {
+            "$match": {
+                "qt_shared": {
+                    "$gte": min_shared,
+                },
+                "$expr": {
+                    "$gte": [
+                        {"$multiply": [2, "$qt_shared"]},
+                        {
+                            "$multiply": [
+                                NAME_MIN_SIMILARITY,
+                                {"$add": [{"$size": "$grams"}, len(query_grams)]},
+                            ],
+                        },
+                    ],
+                },
+            },
+        },
+        {
+            "$sort": {
+                "qt_shared": -1,
+            },
+        },
+        {
+            "$limit": NAME_CANDIDATES,
+        },
+        {
+            "$project": {
+                "_id": False,
+                "key": True,
+                "name": True,
+                "popularity": True,
+                "similarity": {
+                    "$divide": [
+                        {"$multiply": [2, "$qt_shared"]},
+                        {"$add": [{"$size": "$grams"}, len(query_grams)]},
+                    ],
+                },
+            },
+        },
+    ]
+
+def min_shared_grams(qt_query_grams: int) -> int:
+    """
+    Get the fewest trigrams an entry must share with a query of the given
+    number of trigrams to reach NAME_MIN_SIMILARITY. Sharing s trigrams, an
+    entry has at least s, so its similarity is at most 2s / (s + q).
+    """
+    return max(
+        math.ceil(NAME_MIN_SIMILARITY * qt_query_grams / (2 - NAME_MIN_SIMILARITY) - 1e-9),
+        1,
+    )
+
+def search_names(kind: str, query: str, limit: int) -> list:
+    """
+    Find the artists or users whose names are similar to the query, ranked by
+    trigram similarity blended with their popularity.
+    """
+    query_grams = trigrams(query)
+    if not query_grams:
+        return []
+
+    candidates_cursor = routing.db().name_search.aggregate(
+        search_names_pipeline(kind, query_grams),
+    )
+
+    ranked = sorted(
+        candidates_cursor,
+        key = lambda candidate: (
+            (1 - POPULARITY_WEIGHT) * candidate["similarity"]
+            + POPULARITY_WEIGHT * candidate["popularity"]
+        ),
+        reverse = True,
+    )
+    return ranked[:min(limit, MAX_RESULTS)]
+
+def _user_popularity(qt_friends: int) -> float:
+    # Normalizes the number of friends of a user, reaching 1.0 at 1000 friends
+    return min(math.log10(1 + qt_friends) / 3, 1.0)
@@ -0,0 +1,209 @@
+"""
+Module for the similar artists index.
+
+Artists are embedded by a truncated SVD of the artist x feature matrix,
+where the features are the users following the artist (weighted down for
+users who follow many artists) and the genres of the artist. Similar artists
+are those whose normalized embeddings have the highest dot product.
+
+Each rebuild writes its vectors to a new version directory, as a
+memory-mapped .npy file next to the list of artist IDs, and then atomically
+points the CURRENT file to it. Workers notice the new version on their next
+read and map it, so the index is rebuilt without downtime.
+"""
+import json
+import os
+import shutil
+import threading
+from datetime import datetime, timezone
+from harmonics_api.configs import mongodb, settings
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DIMENSIONS = 64
+OVERSAMPLING = 16
+POWER_ITERATIONS = 4
+GENRE_WEIGHT = 2.0
+KEPT_VERSIONS = 2
+
+# The index is replaced as a whole when a new version is mapped, so a read
+# never mixes the IDs of a version with the vectors of another
+_lock = threading.Lock()
+_state = {
+    "index": {
+        "version": None,
+        "ids": {},
+        "keys": [],
+        "vectors": [],
+    },
+}
+
+def rebuild() -> int:
+    """
+    Build a new version of the index from the follows and genres in MongoDB,
+    make it the current one and return the number of artists indexed.
+    """
+    if np is None:
+        raise RuntimeError("The similar artists index requires NumPy, install harmonics-api[graph]")
+
+    artist_ids, matrix = _read_matrix()
+    vectors = _embed(matrix)
+
+    version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    version_dir = os.path.join(settings.SIMILAR_ARTISTS_DIR, version)
+    os.makedirs(version_dir)
+
+    stored = np.lib.format.open_memmap(
+        os.path.join(version_dir, "vectors.npy"),
+        mode = "w+",
+        dtype = np.float32,
+        shape = vectors.shape,
+    )
+    stored[:] = vectors
+    stored.flush()
+    with open(os.path.join(version_dir, "ids.json"), "w", encoding = "utf-8") as ids_file:
+        json.dump(list(artist_ids), ids_file)
+
+    current_path = os.path.join(settings.SIMILAR_ARTISTS_DIR, "CURRENT")
+    with open(f"{current_path}.tmp", "w", encoding = "utf-8") as current_file:
+        current_file.write(version)
+    os.replace(f"{current_path}.tmp", current_path)
+
+    # Workers that still map an older version keep reading it until they switch
+    versions = sorted(
+        name for name in os.listdir(settings.SIMILAR_ARTISTS_DIR)
+        if os.path.isdir(os.path.join(settings.SIMILAR_ARTISTS_DIR, name))
+    )
+    for old_version in versions[:-KEPT_VERSIONS]:
+        shutil.rmtree(os.path.join(settings.SIMILAR_ARTISTS_DIR, old_version))
+
+    return len(artist_ids)
+
+def get_similar(artist_id: str, limit: int) -> list | None:
+    """
+    Get the IDs and scores of the artists most similar to an artist, or None
+    if the artist isn't in the index.
+    """
+    index = _current_index()
+    artist = index["ids"].get(artist_id)
+    if artist is None:
+        return None
+
+    scores = index["vectors"] @ index["vectors"][artist]
+    scores[artist] = -np.inf
+    limit = min(limit, len(scores) - 1)
+    if limit <= 0:
+        return []
+
+    top = np.argpartition(-scores, limit - 1)[:limit]
+    top = top[np.argsort(-scores[top])]
+    return [
+        {
+            "id": index["keys"][similar],
+            "score": float(scores[similar]),
+        }
+        for similar in top.tolist()
+    ]
+
+def _read_matrix() -> tuple:
+    # Reads the sparse artist x feature matrix (as coordinates) from MongoDB,
+    # with the user columns first and the genre columns after them
+    artist_ids = {}
+    genres = {}
+    genre_entries = ([], [])
+    for artist in mongodb.db.artists.find({}, {"genres": True}):
+        artist_ids[artist["_id"]] = len(artist_ids)
+        for genre in artist["genres"]:
+            genre_entries[0].append(artist_ids[artist["_id"]])
+            genre_entries[1].append(genres.setdefault(genre, len(genres)))
+
+    qt_users = 0
+    follow_entries = ([], [], [])
+    for user in mongodb.db.users.find({}, {"follows.id": True}):
+        followed = [follow["id"] for follow in user["follows"] if follow["id"] in artist_ids]
+        for artist_id in followed:
+            follow_entries[0].append(artist_ids[artist_id])
+            follow_entries[1].append(qt_users)
+            follow_entries[2].append(1 / np.sqrt(len(followed)))
+        qt_users += 1
+
+    matrix = {
+        "rows": np.array(follow_entries[0] + genre_entries[0], dtype = np.int64),
+        "columns": np.concatenate((
+            np.array(follow_entries[1], dtype = np.int64),
+            np.array(genre_entries[1], dtype = np.int64) + qt_users,
+        )),
+        "values": np.concatenate((
+            np.array(follow_entries[2], dtype = np.float64),
+            np.full(len(genre_entries[0]), GENRE_WEIGHT),
+        )),
+        "shape": (len(artist_ids), qt_users + len(genres)),
+    }
+    return artist_ids, matrix
+
+def _current_index() -> dict:
+    # Maps the current version of the index, if it changed since the last read
+    try:
+        with open(
+            os.path.join(settings.SIMILAR_ARTISTS_DIR, "CURRENT"),
+            encoding = "utf-8",
+        ) as current_file:
+            version = current_file.read().strip()
+    except FileNotFoundError:
+        return _state["index"]
+
+    with _lock:
+        if version == _state["index"]["version"] or np is None:
+            return _state["index"]
+
+        version_dir = os.path.join(settings.SIMILAR_ARTISTS_DIR, version)
+        with open(os.path.join(version_dir, "ids.json"), encoding = "utf-8") as ids_file:
+            keys = json.load(ids_file)
+        _state["index"] = {
+            "version": version,
+            "ids": {artist_id: artist for artist, artist_id in enumerate(keys)},
+            "keys": keys,
+            "vectors": np.load(os.path.join(version_dir, "vectors.npy"), mmap_mode = "r"),
+        }
+        return _state["index"]
+
+def _embed(matrix: dict):
+    # Randomized truncated SVD (Halko et al.) of the sparse matrix, returning
+    # the normalized artist embeddings
+    n_artists, n_features = matrix["shape"]
+    rank = min(DIMENSIONS, n_artists, n_features)
+    if rank == 0:
+        return np.zeros((n_artists, 0), dtype = np.float32)
+
+    rng = np.random.default_rng(0)
+    sample = rng.standard_normal((n_features, min(rank + OVERSAMPLING, n_features)))
+    basis, _ = np.linalg.qr(_multiply(matrix, sample))
+    for _ in range(POWER_ITERATIONS):
+        projection, _ = np.linalg.qr(_multiply_transposed(matrix, basis))
+        basis, _ = np.linalg.qr(_multiply(matrix, projection))
+
+    # basis.T @ matrix is small (rank x features), so its SVD is exact
+    u, singular_values, _ = np.linalg.svd(
+        _multiply_transposed(matrix, basis).T,
+        full_matrices = False,
+    )
+    vectors = (basis @ u[:, :rank]) * singular_values[:rank]
+
+    norms = np.linalg.norm(vectors, axis = 1, keepdims = True)
+    norms[norms == 0] = 1
+    return (vectors / norms).astype(np.float32)
+
+def _multiply(matrix: dict, dense):
+    # matrix @ dense
+    result = np.zeros((matrix["shape"][0], dense.shape[1]))
+    np.add.at(result, matrix["rows"], matrix["values"][:, None] * dense[matrix["columns"]])
+    return result
+
+def _multiply_transposed(matrix: dict, dense):
+    # matrix.T @ dense
+    result = np.zeros((matrix["shape"][1], dense.shape[1]))
+    np.add.at(result, matrix["columns"], matrix["values"][:, None] * dense[matrix["rows"]])
+    return result
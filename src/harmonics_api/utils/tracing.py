@@ -0,0 +1,303 @@
+"""
+Module for the per-request traces.
+
+Each traced request (TRACE_SAMPLE_RATE of them, when TRACE_FILE is set) gets
+a server span, with a client span for every MongoDB command (from a pymongo
+command listener) and every Neo4j transaction (from the routing module)
+made while handling it. When the request ends its trace is appended to
+TRACE_FILE, rotated every TRACE_MAX_BYTES, as one line of OTLP/JSON (the
+format of the OpenTelemetry file exporter), so it can be loaded by any
+OTLP-compatible tool.
+
+Commands and queries are grouped by their shape, the statement with its
+values left out, and a request that runs the same shape more than
+TRACE_REPEAT_THRESHOLD times (an N+1 pattern, such as one update per
+friend) is flagged with the 'harmonics.repeated_queries' attribute.
+"""
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from flask import g, has_request_context, request
+from pymongo import monitoring
+from harmonics_api.configs import settings
+
+ENABLED = bool(settings.TRACE_FILE)
+
+SERVER_KIND = 2
+CLIENT_KIND = 3
+ERROR_STATUS = 2
+
+# Commands that are part of another command (the next batches of a cursor)
+# or of a transaction, and aren't counted as repetitions
+UNCOUNTED_COMMANDS = ("getMore", "killCursors", "commitTransaction", "abortTransaction")
+
+# Fields of each command with the documents that make up its shape
+SHAPE_FIELDS = ("filter", "query", "pipeline", "updates", "deletes", "documents")
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+stats = {
+    "traced_requests": 0,
+    "flagged_requests": 0,
+    "last_flagged": None,
+}
+
+_lock = threading.Lock()
+_logger = logging.getLogger("harmonics_api.traces")
+
+if ENABLED:
+    _handler = RotatingFileHandler(
+        settings.TRACE_FILE,
+        maxBytes = settings.TRACE_MAX_BYTES,
+        backupCount = settings.TRACE_BACKUP_COUNT,
+        encoding = "utf-8",
+    )
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    _logger.addHandler(_handler)
+    _logger.setLevel(logging.INFO)
+    _logger.propagate = False
+
+class CommandListener(monitoring.CommandListener):
+    """
+    Listener that records the MongoDB commands of a traced request as spans.
+    """
+    def started(self, event):
+        trace = _current()
+        if trace is None:
+            return
+        command = event.command
+        collection = command.get(event.command_name)
+        shape = json.dumps(
+            {
+                field: _shape(command[field])
+                for field in SHAPE_FIELDS
+                if field in command
+            },
+            sort_keys = True,
+            default = str,
+        )
+        trace["pending"][event.request_id] = _open(
+            trace,
+            f"mongodb.{event.command_name}",
+            {
+                "db.system": "mongodb",
+                "db.operation": event.command_name,
+                "db.mongodb.collection": collection if isinstance(collection, str) else "",
+                "db.statement": shape,
+            },
+        )
+        if event.command_name not in UNCOUNTED_COMMANDS:
+            trace["shapes"][f"mongodb {event.command_name} {collection} {shape}"] += 1
+
+    def succeeded(self, event):
+        self._finish(event, None)
+
+    def failed(self, event):
+        self._finish(event, str(event.failure))
+
+    def _finish(self, event, error):
+        trace = _current()
+        if trace is None or event.request_id not in trace["pending"]:
+            return
+        opened = trace["pending"].pop(event.request_id)
+        end = opened["start"] + event.duration_micros * 1_000
+        trace["spans"].append(_otlp_span(opened, end, error))
+
+def init_app(app) -> None:
+    """
+    Register the request hooks that start and write the trace of each
+    sampled request.
+    """
+    if not ENABLED:
+        return
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+
+@contextmanager
+def span(name: str, attributes: dict, shape: str):
+    """
+    Record the block as a client span of the current trace, counting its
+    shape for the repetition check. Does nothing outside a traced request.
+    """
+    trace = _current()
+    if trace is None:
+        yield
+        return
+
+    trace["shapes"][shape] += 1
+    opened = _open(trace, name, attributes)
+    trace["stack"].append(opened["spanId"])
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        trace["stack"].pop()
+        trace["spans"].append(_otlp_span(opened, time.time_ns(), error))
+
+def metrics() -> dict:
+    """
+    Report how many requests were traced and flagged for repeated queries.
+    """
+    return {
+        "enabled": ENABLED,
+        "sample_rate": settings.TRACE_SAMPLE_RATE,
+        "repeat_threshold": settings.TRACE_REPEAT_THRESHOLD,
+        **stats,
+    }
+
+def _current() -> dict | None:
+    # Gets the trace of the current request, if it's traced
+    if not has_request_context():
+        return None
+    return g.get("trace")
+
+def _shape(value):
+    # Replaces the values of a statement, keeping its structure
+    if isinstance(value, dict):
+        return {key: _shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_shape(value[0])] if value else []
+    return "?"
+
+def _open(trace: dict, name: str, attributes: dict) -> dict:
+    # Starts a client span under the innermost open span
+    return {
+        "traceId": trace["trace_id"],
+        "spanId": os.urandom(8).hex(),
+        "parentSpanId": trace["stack"][-1],
+        "name": name,
+        "kind": CLIENT_KIND,
+        "start": time.time_ns(),
+        "attributes": attributes,
+    }
+
+def _otlp_span(opened: dict, end: int, error: str | None) -> dict:
+    # Ends a span, in OTLP/JSON
+    span_json = {
+        "traceId": opened["traceId"],
+        "spanId": opened["spanId"],
+        "name": opened["name"],
+        "kind": opened["kind"],
+        "startTimeUnixNano": str(opened["start"]),
+        "endTimeUnixNano": str(end),
+        "attributes": [
+            _otlp_attribute(key, value)
+            for key, value in opened["attributes"].items()
+        ],
+        "status": {},
+    }
+    if opened["parentSpanId"]:
+        span_json["parentSpanId"] = opened["parentSpanId"]
+    if error is not None:
+        span_json["status"] = {
+            "code": ERROR_STATUS,
+            "message": error,
+        }
+    return span_json
+
+def _otlp_attribute(key: str, value) -> dict:
+    # Builds an attribute in OTLP/JSON, with the value typed by its Python type
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, list):
+        return {
+            "key": key,
+            "value": {
+                "arrayValue": {
+                    "values": [{"stringValue": str(item)} for item in value],
+                },
+            },
+        }
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+def _before_request() -> None:
+    if random.random() >= settings.TRACE_SAMPLE_RATE:
+        return
+
+    # A W3C 'traceparent' header makes the request part of the caller's trace
+    parent = TRACEPARENT.match(request.headers.get("traceparent", ""))
+    trace_id = parent.group(1) if parent else os.urandom(16).hex()
+    route = request.url_rule.rule if request.url_rule else request.path
+    server = {
+        "traceId": trace_id,
+        "spanId": os.urandom(8).hex(),
+        "parentSpanId": parent.group(2) if parent else None,
+        "name": f"{request.method} {route}",
+        "kind": SERVER_KIND,
+        "start": time.time_ns(),
+        "attributes": {
+            "http.request.method": request.method,
+            "url.path": request.path,
+            "http.route": route,
+        },
+    }
+    g.trace = {
+        "trace_id": trace_id,
+        "server": server,
+        "stack": [server["spanId"]],
+        "pending": {},
+        "spans": [],
+        "shapes": Counter(),
+    }
+
+def _after_request(response):
+    trace = _current()
+    if trace is not None:
+        trace["server"]["attributes"]["http.response.status_code"] = response.status_code
+    return response
+
+def _teardown_request(error) -> None:
+    trace = g.pop("trace", None)
+    if trace is None:
+        return
+
+    server = trace["server"]
+    server["attributes"].setdefault("http.response.status_code", 500)
+    repeated = [
+        f"{count}x {shape}"
+        for shape, count in trace["shapes"].most_common()
+        if count > settings.TRACE_REPEAT_THRESHOLD
+    ]
+    if repeated:
+        server["attributes"]["harmonics.repeated_queries"] = repeated
+
+    spans = [
+        _otlp_span(server, time.time_ns(), str(error) if error else None),
+        *trace["spans"],
+    ]
+    with _lock:
+        stats["traced_requests"] += 1
+        if repeated:
+            stats["flagged_requests"] += 1
+            stats["last_flagged"] = server["name"]
+
+    _logger.info(json.dumps({
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [_otlp_attribute("service.name", "harmonics-api")],
+                },
+                "scopeSpans": [
+                    {
+                        "scope": {
+                            "name": "harmonics_api",
+                        },
+                        "spans": spans,
+                    },
+                ],
+            },
+        ],
+    }))
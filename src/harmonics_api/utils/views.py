@@ -0,0 +1,233 @@
+"""
+Module for the materialized artist views.
+
+An artist view holds everything the artist routes return, precomputed from the
+artist document at ingest time: the release summaries with their years and the
+alphabetized tracks with the releases they appear on. Only the follower and
+rating counters change between ingests: the user routes keep the rating
+counters current, and the follower flushes write the follower counters.
+
+Every write to a view increments its own 'version' in the same update, so
+the ETags of the artist resources, built from it, always match the view
+they're served from.
+"""
+from pymongo import UpdateOne
+from harmonics_api.configs import mongodb
+from harmonics_api.utils import ratings, routing
+
+def build_artist_view(artist: dict) -> dict:
+    """
+    Build the view of an artist from its catalog document.
+    """
+    tracks = {}
+    for release in artist["releases"]:
+        for track in release["tracks"]:
+            track_releases = tracks.setdefault(track["name"], [])
+            track_releases.append({
+                "id": release["id"],
+                "name": release["name"],
+            })
+
+    rating_counters = [ratings.release_counters(release) for release in artist["releases"]]
+
+    return {
+        "_id": artist["_id"],
+        "name": artist["name"],
+        "genres": artist["genres"],
+        "bio": artist.get("bio"),
+        "qt_followers": artist["qt_followers"],
+        "rating_sum": sum(rating_sum for rating_sum, _ in rating_counters),
+        "qt_ratings": sum(qt_ratings for _, qt_ratings in rating_counters),
+        "releases": [
+            {
+                "id": release["id"],
+                "name": release["name"],
+                "release_year": _release_year(release.get("release_date")),
+            }
+            for release in artist["releases"]
+        ],
+        "tracks": [
+            {
+                "name": name,
+                "releases": tracks[name],
+            }
+            for name in sorted(tracks)
+        ],
+    }
+
+def refresh_artist_view(artist: dict) -> dict:
+    """
+    Build the view of an artist and store it, returning the view.
+    """
+    view = build_artist_view(artist)
+    mongodb.db.artist_views.update_one(
+        {
+            "_id": view["_id"],
+        },
+        {
+            "$set": {field: value for field, value in view.items() if field != "_id"},
+            "$inc": {
+                "version": 1,
+            },
+        },
+        upsert = True,
+    )
+    return view
+
+def get_artist_view(artist_id: str, fields: tuple) -> dict | None:
+    """
+    Get the given fields of the view of an artist, materializing the view on
+    the first read if the artist was loaded without one. Returns None if the
+    artist doesn't exist.
+    """
+    view = routing.db().artist_views.find_one(
+        {
+            "_id": artist_id,
+        },
+        {
+            "_id": True,
+            **{field: True for field in fields},
+        },
+    )
+    if view:
+        return view
+
+    return _materialize([artist_id], fields).get(artist_id)
+
+def get_artist_views(artist_ids: list, fields: tuple) -> dict:
+    """
+    Get the given fields of the views of several artists with one query,
+    keyed by artist ID. Artists that don't exist are left out.
+    """
+    views_cursor = routing.db().artist_views.find(
+        {
+            "_id": {
+                "$in": artist_ids,
+            },
+        },
+        {
+            "_id": True,
+            **{field: True for field in fields},
+        },
+    )
+    views_found = {view["_id"]: view for view in views_cursor}
+
+    missing_ids = [artist_id for artist_id in artist_ids if artist_id not in views_found]
+    if missing_ids:
+        views_found.update(_materialize(missing_ids, fields))
+    return views_found
+
+def rebuild_artist_views() -> int:
+    """
+    Rebuild the views of every artist and return the number of artists.
+    """
+    qt_artists = 0
+    for artist in mongodb.db.artists.find({}):
+        refresh_artist_view(artist)
+        qt_artists += 1
+    return qt_artists
+
+def add_followers(deltas: dict) -> None:
+    """
+    Add to the follower counters of artist views, by artist ID.
+    """
+    _update_followers("$inc", deltas)
+
+def set_followers(counts: dict) -> None:
+    """
+    Set the follower counters of artist views, by artist ID.
+    """
+    _update_followers("$set", counts)
+
+def add_rating(release_id: str, rating: int, amount: int, session = None) -> None:
+    """
+    Add (amount = 1) or remove (amount = -1) a rating of a release to the
+    rating counters of its artist's view.
+    """
+    mongodb.db.artist_views.update_one(
+        {
+            "releases.id": release_id,
+        },
+        {
+            "$inc": {
+                "rating_sum": rating * amount,
+                "qt_ratings": amount,
+                "version": 1,
+            },
+        },
+        session = session,
+    )
+
+def _update_followers(operator: str, values: dict) -> None:
+    # Applies an update operator to the follower counters in one bulk write
+    if not values:
+        return
+
+    operations = []
+    for artist_id, value in values.items():
+        update = {
+            "$inc": {
+                "version": 1,
+            },
+        }
+        update.setdefault(operator, {})["qt_followers"] = value
+        operations.append(UpdateOne(
+            {
+                "_id": artist_id,
+            },
+            update,
+        ))
+    mongodb.db.artist_views.bulk_write(operations, ordered = False)
+
+def _materialize(artist_ids: list, fields: tuple) -> dict:
+    # Builds the missing views of the artists with one bulk write and returns
+    # their given fields, keyed by artist ID. A view is only inserted if it's
+    # still missing, so one written in the meantime (or not replicated yet to
+    # where it was looked up) is kept
+    artists_cursor = mongodb.db.artists.find(
+        {
+            "_id": {
+                "$in": artist_ids,
+            },
+        },
+    )
+    operations = []
+    for artist in artists_cursor:
+        view = build_artist_view(artist)
+        del view["_id"]
+        # Starts from the artist's version, so a view built again doesn't
+        # reuse the versions of the one it replaces
+        view["version"] = artist.get("version", 0)
+        operations.append(UpdateOne(
+            {
+                "_id": artist["_id"],
+            },
+            {
+                "$setOnInsert": view,
+            },
+            upsert = True,
+        ))
+    if not operations:
+        return {}
+
+    mongodb.db.artist_views.bulk_write(operations, ordered = False)
+    views_cursor = mongodb.db.artist_views.find(
+        {
+            "_id": {
+                "$in": artist_ids,
+            },
+        },
+        {
+            "_id": True,
+            **{field: True for field in fields},
+        },
+    )
+    return {view["_id"]: view for view in views_cursor}
+
+def _release_year(release_date: str | None) -> int | None:
+    # Gets the year of a release date ("YYYY", "YYYY-MM" or "YYYY-MM-DD"),
+    # or None if it's missing or malformed
+    try:
+        return int(release_date[:4])
+    except (TypeError, ValueError):
+        return None
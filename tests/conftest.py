@@ -0,0 +1,55 @@
+"""
+Fixtures of the tests, which run against an in-memory MongoDB (mongomock)
+and a mocked Neo4j driver instead of the real databases.
+"""
+import sys
+import types
+from unittest import mock
+import mongomock
+import pytest
+
+# mongomock's bulk builder predates the 'sort' option pymongo passes to it
+for _name in ("add_update", "add_replace"):
+    _method = getattr(mongomock.collection.BulkOperationBuilder, _name)
+    setattr(
+        mongomock.collection.BulkOperationBuilder,
+        _name,
+        lambda self, *args, _method = _method, sort = None, **kwargs: _method(self, *args, **kwargs),
+    )
+
+# The connection singletons connect when imported, so they're replaced
+# before any module of the app imports them
+_mongodb = types.ModuleType("harmonics_api.configs.mongodb")
+_mongodb.URI = "mongodb://localhost"
+_mongodb.pool_stats = {
+    "checked_out": 0,
+    "max_checked_out": 0,
+    "checkout_failures": 0,
+}
+_neo4j = types.ModuleType("harmonics_api.configs.neo4j")
+
+import harmonics_api.configs  # pylint: disable=wrong-import-position
+
+sys.modules["harmonics_api.configs.mongodb"] = _mongodb
+sys.modules["harmonics_api.configs.neo4j"] = _neo4j
+harmonics_api.configs.mongodb = _mongodb
+harmonics_api.configs.neo4j = _neo4j
+
+@pytest.fixture(autouse = True)
+def db():
+    """
+    A fresh in-memory database, served as both the primary and the secondary.
+    """
+    _mongodb.client = mongomock.MongoClient()
+    _mongodb.db = _mongodb.client["music_catalog"]
+    _mongodb.secondary_db = _mongodb.db
+    return _mongodb.db
+
+@pytest.fixture(autouse = True)
+def driver():
+    """
+    A fresh mocked Neo4j driver, whose queries return no records by default.
+    """
+    _neo4j.driver = mock.MagicMock()
+    _neo4j.driver.execute_query.return_value = ([], None, None)
+    return _neo4j.driver
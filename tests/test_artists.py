@@ -0,0 +1,19 @@
+"""
+Tests of the artist routes.
+"""
+import pytest
+from flask import Flask
+from harmonics_api.routes import artists
+
+@pytest.fixture(name = "client")
+def fixture_client():
+    app = Flask(__name__)
+    app.register_blueprint(artists.bp, url_prefix = "/v1/artists")
+    return app.test_client()
+
+@pytest.mark.parametrize("limit", ["0", "-3", "ten", "51"])
+def test_similar_artists_reject_invalid_limits(client, limit):
+    response = client.get(f"/v1/artists/a1/similar?limit={limit}")
+
+    assert response.status_code == 400
+    assert response.json["code"] == "InvalidQueryParameter"
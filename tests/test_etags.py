@@ -0,0 +1,62 @@
+"""
+Tests of the ETags and conditional GETs.
+"""
+import pytest
+from flask import Flask
+from harmonics_api.routes import artists
+from harmonics_api.utils import views
+
+@pytest.fixture(name = "client")
+def fixture_client(db):
+    db.artists.insert_one({
+        "_id": "a1",
+        "name": "Alpha",
+        "genres": ["pop"],
+        "bio": "Bio",
+        "qt_followers": 0,
+        "version": 3,
+        "releases": [
+            {
+                "id": "r1",
+                "name": "One",
+                "release_date": "2020",
+                "tracks": [],
+                "rating_sum": 0,
+                "qt_ratings": 0,
+            },
+        ],
+    })
+    app = Flask(__name__)
+    app.register_blueprint(artists.bp, url_prefix = "/v1/artists")
+    return app.test_client()
+
+def test_artist_revalidates_until_its_view_changes(client):
+    response = client.get("/v1/artists/a1")
+    etag = response.headers["ETag"]
+    assert response.status_code == 200
+
+    response = client.get("/v1/artists/a1", headers = {"If-None-Match": etag})
+    assert response.status_code == 304
+
+    views.add_followers({"a1": 1})
+
+    response = client.get("/v1/artists/a1", headers = {"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json["qt_followers"] == 1
+    assert response.headers["ETag"] != etag
+
+def test_artist_etag_depends_on_the_fields(client):
+    full = client.get("/v1/artists/a1").headers["ETag"]
+    names = client.get("/v1/artists/a1?fields=name").headers["ETag"]
+
+    assert full != names
+    assert client.get(
+        "/v1/artists/a1?fields=name",
+        headers = {"If-None-Match": full},
+    ).status_code == 200
+
+def test_unknown_artist_has_no_etag(client):
+    response = client.get("/v1/artists/a2")
+
+    assert response.status_code == 404
+    assert "ETag" not in response.headers
@@ -0,0 +1,56 @@
+"""
+Tests of the NDJSON exports.
+"""
+import json
+from harmonics_api.utils import export
+
+class _Record(dict):
+    def data(self) -> dict:
+        """
+        The record as a dictionary, like a Neo4j record.
+        """
+        return dict(self)
+
+def test_edges_are_read_a_page_at_a_time(monkeypatch):
+    edges = [("ana", "a1"), ("ana", "a2"), ("bob", "a1")]
+    calls = []
+
+    def read(query, source, target, limit):
+        calls.append((source, target))
+        page = [edge for edge in edges if edge > (source, target)][:limit]
+        return [_Record(source = edge[0], target = edge[1]) for edge in page]
+
+    monkeypatch.setattr(export.settings, "EXPORT_BATCH_SIZE", 2)
+    monkeypatch.setattr(export.routing, "read", read)
+
+    lines = [json.loads(line) for line in export.edges("FOLLOWS", ["", ""])]
+
+    assert [(line["source"], line["target"]) for line in lines if "type" in line] == edges
+    assert calls == [("", ""), ("ana", "a2")]
+    assert lines[-1]["done"]
+    assert export.decode_checkpoint(lines[-1]["checkpoint"], 2) == ["bob", "a1"]
+
+def test_friendships_are_exported_once(monkeypatch):
+    # Each friendship is stored as a relationship each way
+    relationships = [("ana", "bob"), ("bob", "ana"), ("bob", "cid"), ("cid", "bob")]
+    queries = []
+
+    def read(query, source, target, limit):
+        queries.append(query)
+        page = [
+            relationship
+            for relationship in relationships
+            if relationship[0] < relationship[1] and relationship > (source, target)
+        ][:limit]
+        return [_Record(source = edge[0], target = edge[1]) for edge in page]
+
+    monkeypatch.setattr(export.routing, "read", read)
+
+    lines = [json.loads(line) for line in export.edges("FRIENDS_WITH", ["", ""])]
+
+    assert [line for line in lines if "type" in line] == [
+        {"type": "FRIENDS_WITH", "source": "ana", "target": "bob"},
+        {"type": "FRIENDS_WITH", "source": "bob", "target": "cid"},
+    ]
+    assert "(u)-[:FRIENDS_WITH]->(f:User)" in queries[0]
+    assert "u.username < f.username" in queries[0]
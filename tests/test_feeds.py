@@ -0,0 +1,66 @@
+"""
+Tests of the friends activity feeds.
+"""
+from datetime import datetime, timezone
+from flask import Flask
+from harmonics_api.routes import users
+from harmonics_api.utils import feeds
+
+NOW = datetime(2025, 1, 1, tzinfo = timezone.utc)
+
+def _record(username: str, friends: list, artist_id: str) -> None:
+    feeds.record(
+        username,
+        friends,
+        {
+            "type": "follow",
+            "created_at": NOW,
+            "artist": {"id": artist_id, "name": artist_id},
+        },
+    )
+
+def test_pages_keep_items_created_at_the_same_time():
+    for artist_id in ("a1", "a2", "a3"):
+        _record("bob", ["ana"], artist_id)
+
+    first_page = feeds.get_feed("ana", ["bob"], None, 2)
+    cursor = feeds.decode_cursor(feeds.encode_cursor(first_page[-1]))
+    second_page = feeds.get_feed("ana", ["bob"], cursor, 2)
+
+    artist_ids = [item["artist"]["id"] for item in first_page + second_page]
+    assert sorted(artist_ids) == ["a1", "a2", "a3"]
+
+def test_a_timestamp_cursor_starts_before_it():
+    _record("bob", ["ana"], "a1")
+
+    assert feeds.get_feed("ana", ["bob"], feeds.decode_cursor(NOW.isoformat()), 10) == []
+    assert feeds.decode_cursor("yesterday") is None
+
+def test_unfriending_removes_the_items_of_each_other(db):
+    _record("bob", ["ana", "cid"], "a1")
+    _record("ana", ["bob"], "a2")
+
+    feeds.unlink("ana", "bob")
+
+    assert db.feeds.find_one({"_id": "ana"})["items"] == []
+    assert db.feeds.find_one({"_id": "bob"})["items"] == []
+    assert len(db.feeds.find_one({"_id": "cid"})["items"]) == 1
+
+def test_items_of_former_friends_are_left_out():
+    _record("bob", ["ana"], "a1")
+
+    assert feeds.get_feed("ana", [], None, 10) == []
+
+def test_feed_rejects_invalid_limits(db):
+    db.users.insert_one({"username": "ana", "friends": []})
+    app = Flask(__name__)
+    app.register_blueprint(users.bp, url_prefix = "/v1/users")
+    client = app.test_client()
+
+    for limit in ("0", "-5", "101"):
+        response = client.get(f"/v1/users/ana/feed?limit={limit}")
+        assert response.status_code == 400
+
+    response = client.get("/v1/users/ana/feed?limit=5")
+    assert response.status_code == 200
+    assert response.json["next"] is None
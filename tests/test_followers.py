@@ -0,0 +1,94 @@
+"""
+Tests of the write-behind follower counters.
+"""
+from unittest import mock
+import pytest
+from pymongo.errors import BulkWriteError, PyMongoError
+from harmonics_api.utils import followers, views
+
+@pytest.fixture(autouse = True)
+def pending():
+    """
+    Empty buffers for each test.
+    """
+    followers._pending["deltas"].clear()  # pylint: disable=protected-access
+    followers._pending["view_deltas"].clear()  # pylint: disable=protected-access
+    followers._pending["popularity"].clear()  # pylint: disable=protected-access
+
+def _insert_artist(db, artist_id: str) -> None:
+    db.artists.insert_one(
+        {
+            "_id": artist_id,
+            "qt_followers": 0,
+            "version": 0,
+        },
+    )
+    db.artist_views.insert_one(
+        {
+            "_id": artist_id,
+            "qt_followers": 0,
+            "version": 0,
+        },
+    )
+
+def test_score_combines_both_popularities():
+    assert followers.score(None, 999_999) == 100
+    assert followers.score(80, 0) == 40
+    assert followers.score(80, 999) == 65
+
+def test_flush_writes_the_counters_and_the_follower_popularity(db, driver):
+    _insert_artist(db, "a1")
+    followers.add("a1", 1)
+    followers.add("a1", 1)
+
+    assert followers.flush() == 1
+
+    assert db.artists.find_one({"_id": "a1"})["qt_followers"] == 2
+    assert db.artist_views.find_one({"_id": "a1"})["qt_followers"] == 2
+    driver.execute_query.assert_called_once_with(
+        followers.POPULARITY_STATEMENT,
+        artists = [{"id": "a1", "follower_popularity": followers.popularity(2)}],
+    )
+    assert "SET a.popularity" not in followers.POPULARITY_STATEMENT
+
+def test_flush_requeues_the_view_deltas_when_the_views_fail(db, monkeypatch):
+    _insert_artist(db, "a1")
+    followers.add("a1", 1)
+
+    def fail(deltas):
+        raise PyMongoError("views down")
+
+    monkeypatch.setattr(views, "add_followers", fail)
+    with pytest.raises(PyMongoError):
+        followers.flush()
+    monkeypatch.undo()
+
+    assert db.artists.find_one({"_id": "a1"})["qt_followers"] == 1
+    assert db.artist_views.find_one({"_id": "a1"})["qt_followers"] == 0
+
+    followers.flush()
+
+    assert db.artists.find_one({"_id": "a1"})["qt_followers"] == 1
+    assert db.artist_views.find_one({"_id": "a1"})["qt_followers"] == 1
+
+def test_flush_retries_only_the_failed_writes(db):
+    _insert_artist(db, "a1")
+    _insert_artist(db, "a2")
+    followers.add("a1", 1)
+    followers.add("a2", 1)
+    bulk_write = db.artists.bulk_write
+
+    def fail_the_second(operations, ordered):
+        bulk_write(operations[:1], ordered = ordered)
+        raise BulkWriteError({"writeErrors": [{"index": 1, "errmsg": "timeout"}]})
+
+    with mock.patch.object(db.artists, "bulk_write", side_effect = fail_the_second):
+        with pytest.raises(BulkWriteError):
+            followers.flush()
+
+    followers.flush()
+
+    assert db.artists.find_one({"_id": "a1"})["qt_followers"] == 1
+    assert db.artists.find_one({"_id": "a2"})["qt_followers"] == 1
+    assert db.artist_views.find_one({"_id": "a1"})["qt_followers"] == 1
+    assert db.artist_views.find_one({"_id": "a2"})["qt_followers"] == 1
@@ -0,0 +1,131 @@
+"""
+Tests of the in-process graph engine.
+"""
+from unittest import mock
+import pytest
+from harmonics_api.utils import graph
+
+pytest.importorskip("numpy")
+
+GRAPH = {
+    "users": [
+        {"username": "ana"},
+        {"username": "bob"},
+        {"username": "cid"},
+    ],
+    "artists": [
+        {"id": "a1", "score": 10},
+        {"id": "a2", "score": 90},
+        {"id": "a3", "score": 50},
+        {"id": "a4", "score": None},
+    ],
+    "genres": [
+        {"artist_id": "a1", "genre": "rock"},
+        {"artist_id": "a2", "genre": "rock"},
+        {"artist_id": "a3", "genre": "rock"},
+        {"artist_id": "a4", "genre": "jazz"},
+    ],
+    "follows": [
+        {"username": "ana", "artist_id": "a1"},
+    ],
+    "ratings": [
+        {"username": "ana", "release_id": "r1", "rating": 9},
+        {"username": "bob", "release_id": "r1", "rating": 7},
+        {"username": "cid", "release_id": "r1", "rating": 8},
+        {"username": "bob", "release_id": "r2", "rating": 4},
+    ],
+    "friendships": [
+        {"username1": "ana", "username2": "bob"},
+    ],
+}
+
+@pytest.fixture(autouse = True)
+def loaded(driver):
+    """
+    The graph above, loaded from the mocked Neo4j driver.
+    """
+    queries = {query: name for name, query in graph.LOAD_QUERIES.items()}
+    driver.session.return_value.__enter__.return_value.run.side_effect = (
+        lambda query: GRAPH[queries[query]]
+    )
+    graph.sync()
+
+def test_artist_recs_rank_the_unfollowed_artists_by_score():
+    assert graph.artist_recs("ana") == {
+        "genre": "rock",
+        "artist_ids": ["a2", "a3"],
+    }
+    assert graph.artist_recs("bob") is None
+    assert graph.artist_recs("nobody") is None
+
+def test_applied_follows_change_the_recs():
+    graph.apply("follow", {"username": "ana", "artist_id": "a2"})
+    assert graph.artist_recs("ana")["artist_ids"] == ["a3"]
+
+    graph.apply("unfollow", {"username": "ana", "artist_id": "a2"})
+    assert graph.artist_recs("ana")["artist_ids"] == ["a2", "a3"]
+
+def test_friends_ratings_keep_the_high_ones():
+    assert graph.friends_ratings("ana") == [
+        {"friend_username": "bob", "release_id": "r1", "rating": 7},
+    ]
+
+def test_friend_recs_by_reviews_leave_out_friends():
+    assert graph.friend_recs_by_reviews("ana") == {
+        "release_id": "r1",
+        "candidates": [{"username": "cid", "rating": 8}],
+    }
+
+    graph.apply("befriend", {"username": "ana", "friend_username": "cid"})
+    assert graph.friend_recs_by_reviews("ana")["candidates"] == []
+    assert graph.friends_ratings("cid") == [
+        {"friend_username": "ana", "release_id": "r1", "rating": 9},
+    ]
+
+def test_sync_replaces_the_changes_with_neo4j():
+    graph.apply("create_user", {"username": "dan"})
+    graph.apply("follow", {"username": "dan", "artist_id": "a4"})
+    assert graph.artist_recs("dan") == {"genre": "jazz", "artist_ids": []}
+
+    graph.sync()
+
+    assert graph.artist_recs("dan") is None
+    assert graph.metrics()["qt_changes"] == 0
+
+def test_sync_replays_the_events_applied_while_loading(driver):
+    run = driver.session.return_value.__enter__.return_value.run
+    load = run.side_effect
+
+    def load_while_following(query):
+        if query == graph.LOAD_QUERIES["users"]:
+            graph.apply("follow", {"username": "ana", "artist_id": "a2"})
+        return load(query)
+
+    run.side_effect = load_while_following
+    graph.sync()
+
+    assert graph.artist_recs("ana")["artist_ids"] == ["a3"]
+
+def test_load_skips_artists_created_while_loading(monkeypatch):
+    monkeypatch.setitem(GRAPH, "genres", GRAPH["genres"] + [{"artist_id": "a5", "genre": "pop"}])
+    monkeypatch.setitem(GRAPH, "follows", GRAPH["follows"] + [{"username": "bob", "artist_id": "a5"}])
+
+    graph.sync()
+
+    assert graph.artist_recs("bob") is None
+    assert graph.artist_recs("ana")["artist_ids"] == ["a2", "a3"]
+
+class _Stop(BaseException):
+    pass
+
+def test_resync_thread_survives_any_error(monkeypatch):
+    monkeypatch.setattr(graph.time, "sleep", mock.Mock(side_effect = [None, None, _Stop]))
+    monkeypatch.setattr(graph, "sync", mock.Mock(side_effect = [KeyError("a5"), None]))
+    failures = graph.stats["failures"]
+
+    with pytest.raises(_Stop):
+        graph._work()  # pylint: disable=protected-access
+
+    assert graph.sync.call_count == 2
+    assert graph.stats["failures"] == failures + 1
+    assert graph.stats["last_error"] == "'a5'"
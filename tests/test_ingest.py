@@ -0,0 +1,87 @@
+"""
+Tests of the 'ingest' command.
+"""
+import json
+from neo4j.exceptions import ServiceUnavailable
+from harmonics_api.commands import ingest
+
+def _artist(genres: list, release_name: str = "First") -> dict:
+    return {
+        "id": "a1",
+        "name": "Artist",
+        "genres": genres,
+        "bio": "Bio",
+        "popularity": 50,
+        "releases": [
+            {
+                "id": "r1",
+                "name": release_name,
+                "release_date": "2020-01-01",
+                "tracks": [
+                    {
+                        "track_number": 1,
+                        "name": "Track",
+                        "duration": 180,
+                    },
+                ],
+            },
+        ],
+    }
+
+def _write(tmp_path, *artists) -> str:
+    path = tmp_path / "artists.ndjson"
+    path.write_text("".join(json.dumps(artist) + "\n" for artist in artists), encoding = "utf-8")
+    return str(path)
+
+def test_ingest_skips_unchanged_artists(db, driver, tmp_path):
+    path = _write(tmp_path, _artist(["rock"]))
+
+    assert ingest.run([path], 1, 10) == 0
+    queries = driver.execute_query.call_count
+    version = db.artists.find_one({"_id": "a1"}).get("version")
+
+    assert ingest.run([path], 1, 10) == 0
+    assert driver.execute_query.call_count == queries
+    assert db.artists.find_one({"_id": "a1"}).get("version") == version
+    assert db.artist_views.find_one({"_id": "a1"})["name"] == "Artist"
+
+def test_ingest_keeps_the_counters(db, tmp_path):
+    ingest.run([_write(tmp_path, _artist(["rock"]))], 1, 10)
+    db.artists.update_one(
+        {"_id": "a1"},
+        {"$set": {"qt_followers": 7, "releases.0.qt_ratings": 2, "releases.0.rating_sum": 15}},
+    )
+
+    assert ingest.run([_write(tmp_path, _artist(["rock"], "Renamed"))], 1, 10) == 0
+
+    artist = db.artists.find_one({"_id": "a1"})
+    assert artist["qt_followers"] == 7
+    assert artist["releases"][0]["name"] == "Renamed"
+    assert artist["releases"][0]["qt_ratings"] == 2
+    assert artist["releases"][0]["version"] == 1
+
+def test_ingest_moves_the_leaderboard_of_changed_genres(db, tmp_path):
+    ingest.run([_write(tmp_path, _artist(["rock", "pop"]))], 1, 10)
+    db.users.insert_one({"username": "ana", "follows": [{"id": "a1"}]})
+    db.genre_leaderboard.insert_many([
+        {"genre": "rock", "username": "ana", "follows": 1},
+        {"genre": "pop", "username": "ana", "follows": 2},
+    ])
+
+    assert ingest.run([_write(tmp_path, _artist(["pop", "jazz"]))], 1, 10) == 0
+
+    counts = {
+        entry["genre"]: entry["follows"]
+        for entry in db.genre_leaderboard.find({"username": "ana"})
+    }
+    assert counts == {"pop": 2, "jazz": 1}
+
+def test_ingest_reports_a_failed_batch_and_goes_on(db, driver, tmp_path, capsys):
+    second = {**_artist(["rock"]), "id": "a2"}
+    driver.execute_query.side_effect = [ServiceUnavailable("down")] + [([], None, None)] * 3
+
+    assert ingest.run([_write(tmp_path, _artist(["rock"]), second)], 1, 1) == 1
+
+    assert db.artists.find_one({"_id": "a1"}) is None
+    assert db.artists.find_one({"_id": "a2"}) is not None
+    assert "batch of artists 'a1' to 'a1': down" in capsys.readouterr().out
@@ -0,0 +1,96 @@
+"""
+Tests of the 'migrate-ratings' command.
+"""
+from harmonics_api.commands import migrate_ratings
+
+def _insert_catalog(db) -> None:
+    db.artists.insert_one(
+        {
+            "_id": "a1",
+            "name": "Artist",
+            "releases": [
+                {
+                    "id": "r1",
+                    "name": "Release",
+                    "version": 0,
+                    "ratings": [
+                        {"username": "ana", "rating": 8},
+                        {"username": "bob", "rating": 5},
+                    ],
+                },
+            ],
+        },
+    )
+    db.users.insert_one(
+        {
+            "username": "ana",
+            "version": 0,
+            "ratings": [
+                {"id": "r1", "artist": "Artist", "name": "Release", "rating": 8},
+            ],
+        },
+    )
+
+def test_migrate_moves_the_embedded_ratings(db):
+    _insert_catalog(db)
+
+    assert migrate_ratings.run(1) == 0
+
+    release = db.artists.find_one({"_id": "a1"})["releases"][0]
+    assert "ratings" not in release
+    assert (release["rating_sum"], release["qt_ratings"]) == (13, 2)
+    user = db.users.find_one({"username": "ana"})
+    assert "ratings" not in user
+    assert user["qt_ratings"] == 1
+    assert sorted(
+        (rating["username"], rating["rating"]) for rating in db.ratings.find()
+    ) == [("ana", 8), ("bob", 5)]
+
+def test_migrate_again_changes_nothing(db):
+    _insert_catalog(db)
+    migrate_ratings.run(10)
+
+    assert migrate_ratings.run(10) == 0
+
+    assert db.ratings.count_documents({}) == 2
+
+def test_migrate_keeps_the_ratings_the_api_wrote(db):
+    _insert_catalog(db)
+    db.ratings.insert_one({"release_id": "r1", "username": "ana", "rating": 3})
+
+    migrate_ratings.run(10)
+
+    assert db.ratings.find_one({"release_id": "r1", "username": "ana"})["rating"] == 3
+
+def test_migrate_starts_over_when_a_release_changes(db, monkeypatch):
+    _insert_catalog(db)
+    copy = migrate_ratings._copy  # pylint: disable=protected-access
+    attempts = []
+
+    def copy_then_remove_a_rating(ratings, batch_size):
+        inserted_ids = copy(ratings, batch_size)
+        if not attempts:
+            release = db.artists.find_one({"_id": "a1"})["releases"][0]
+            release["ratings"] = release["ratings"][:1]
+            release["version"] += 1
+            db.artists.update_one({"_id": "a1"}, {"$set": {"releases": [release]}})
+        attempts.append(len(ratings))
+        return inserted_ids
+
+    monkeypatch.setattr(migrate_ratings, "_copy", copy_then_remove_a_rating)
+
+    assert migrate_ratings.run(10) == 0
+
+    assert attempts[:2] == [2, 1]
+    assert db.ratings.find_one({"release_id": "r1", "username": "bob"}) is None
+    assert db.artists.find_one({"_id": "a1"})["releases"][0]["qt_ratings"] == 1
+
+def test_migrate_reports_what_kept_changing(db, monkeypatch, capsys):
+    _insert_catalog(db)
+    monkeypatch.setattr(migrate_ratings, "MAX_ATTEMPTS", 0)
+
+    assert migrate_ratings.run(10) == 1
+
+    output = capsys.readouterr().out
+    assert "release 'r1'" in output
+    assert "user 'ana'" in output
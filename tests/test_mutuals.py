@@ -0,0 +1,47 @@
+"""
+Tests of the mutual friends cache.
+"""
+import pytest
+from harmonics_api.utils import mutuals, outbox
+
+CANDIDATES = [{"username": "cid", "mutual_friends": 1}]
+
+@pytest.fixture(autouse = True)
+def graph(db, monkeypatch):
+    """
+    Ana is friends with Bob, and the outbox is enabled.
+    """
+    db.users.insert_many([
+        {"username": "ana", "friends": ["bob"]},
+        {"username": "bob", "friends": ["ana"]},
+    ])
+    monkeypatch.setattr(outbox, "ENABLED", True)
+    monkeypatch.setattr(
+        mutuals.routing,
+        "read_single",
+        lambda query, **parameters: {"candidates": CANDIDATES},
+    )
+
+def test_candidates_are_cached(db):
+    assert mutuals.get_candidates("ana") == CANDIDATES
+
+    assert db.mutual_friends.find_one({"_id": "ana"})["candidates"] == CANDIDATES
+
+@pytest.mark.parametrize("event", [
+    {"type": "befriend", "params": {"username": "ana", "friend_username": "dan"}},
+    {"type": "unfriend", "params": {"username": "eve", "friend_username": "bob"}},
+    {"type": "delete_user", "params": {"username": "fay"}},
+])
+def test_candidates_are_not_cached_before_the_outbox_drains(db, event):
+    db.outbox.insert_one(event)
+
+    assert mutuals.get_candidates("ana") == CANDIDATES
+
+    assert db.mutual_friends.find_one({"_id": "ana"}) is None
+
+def test_changes_of_other_users_keep_the_cache(db):
+    db.outbox.insert_one({"type": "befriend", "params": {"username": "eve", "friend_username": "dan"}})
+
+    mutuals.get_candidates("ana")
+
+    assert db.mutual_friends.find_one({"_id": "ana"}) is not None
@@ -0,0 +1,76 @@
+"""
+Tests of the outbox drain.
+"""
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+from harmonics_api.utils import outbox
+
+def _publish(db, event_type: str, **params) -> None:
+    db.outbox.insert_one(
+        {
+            "type": event_type,
+            "params": params,
+        },
+    )
+
+def test_drain_batches_consecutive_events_of_a_type(db, driver):
+    _publish(db, "follow", username = "ana", artist_id = "a1")
+    _publish(db, "follow", username = "bob", artist_id = "a1")
+    _publish(db, "unfollow", username = "ana", artist_id = "a1")
+
+    assert outbox.drain() == 3
+
+    assert driver.execute_query.call_args_list == [
+        mock.call(
+            outbox.STATEMENTS["follow"],
+            events = [
+                {"username": "ana", "artist_id": "a1"},
+                {"username": "bob", "artist_id": "a1"},
+            ],
+        ),
+        mock.call(
+            outbox.STATEMENTS["unfollow"],
+            events = [{"username": "ana", "artist_id": "a1"}],
+        ),
+    ]
+    assert db.outbox.count_documents({}) == 0
+
+def test_drain_dead_letters_unknown_events(db, driver):
+    _publish(db, "legacy_event", username = "ana")
+    _publish(db, "create_user", username = "bob")
+
+    assert outbox.drain() == 2
+
+    driver.execute_query.assert_called_once_with(
+        outbox.STATEMENTS["create_user"],
+        events = [{"username": "bob"}],
+    )
+    dead_letter = db.outbox_dead_letters.find_one()
+    assert dead_letter["type"] == "legacy_event"
+    assert dead_letter["reason"] == "Unknown event type: legacy_event"
+    assert db.outbox.count_documents({}) == 0
+
+def test_drain_skips_when_another_worker_holds_the_lease(db, driver):
+    db.outbox_lease.insert_one(
+        {
+            "_id": "worker",
+            "owner": "another-worker",
+            "expires_at": datetime.now(timezone.utc) + timedelta(minutes = 1),
+        },
+    )
+    _publish(db, "create_user", username = "ana")
+
+    assert outbox.drain() == 0
+
+    driver.execute_query.assert_not_called()
+    assert db.outbox.count_documents({}) == 1
+
+def test_drain_stops_when_the_lease_is_lost(db, driver):
+    _publish(db, "create_user", username = "ana")
+    _publish(db, "delete_user", username = "bob")
+
+    with mock.patch.object(outbox, "_acquire_lease", side_effect = [True, False]):
+        assert outbox.drain() == 1
+
+    driver.execute_query.assert_called_once()
+    assert [event["type"] for event in db.outbox.find()] == ["delete_user"]
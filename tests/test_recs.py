@@ -0,0 +1,67 @@
+"""
+Tests of the artist recommendations.
+"""
+from flask import Flask
+from harmonics_api.routes import recs
+from harmonics_api.utils import coalesce
+
+def test_artist_recs_filter_the_shared_candidates(monkeypatch):
+    queries = []
+
+    def read(query, **parameters):
+        queries.append((query, parameters))
+        return [{"id": f"a{position}"} for position in range(12)]
+
+    monkeypatch.setattr(recs.routing, "read", read)
+    monkeypatch.setattr(
+        recs.routing,
+        "read_single",
+        lambda query, **parameters: {"genre": "rock", "followed_ids": ["a0", "a2"]},
+    )
+
+    assert recs.get_artist_recs("ana") == {
+        "genre": "rock",
+        "artist_ids": ["a1", "a3", "a4", "a5", "a6", "a7", "a8", "a9", "a10", "a11"],
+    }
+    assert queries == [
+        (recs.GENRE_CANDIDATES_QUERY, {"genre": "rock", "limit": recs.GENRE_CANDIDATES}),
+    ]
+    assert coalesce.stats["genre_candidates"]["calls"] >= 1
+
+def test_artist_recs_fall_back_when_the_user_follows_the_candidates(monkeypatch):
+    candidates = [f"a{position}" for position in range(recs.GENRE_CANDIDATES)]
+    fallback = {
+        "genre": "rock",
+        "artist_ids": ["b1"],
+    }
+
+    def read_single(query, **parameters):
+        if query == recs.TOP_GENRE_QUERY:
+            return {"genre": "rock", "followed_ids": candidates}
+        return fallback
+
+    monkeypatch.setattr(recs, "get_genre_candidates", lambda genre: candidates)
+    monkeypatch.setattr(recs.routing, "read_single", read_single)
+
+    assert recs.get_artist_recs("ana") is fallback
+
+def test_artist_recs_without_a_top_genre(monkeypatch):
+    monkeypatch.setattr(recs.routing, "read_single", lambda query, **parameters: None)
+
+    assert recs.get_artist_recs("ana") is None
+
+def test_friend_recs_by_reviews_without_candidates(db, monkeypatch):
+    db.users.insert_one({"username": "ana"})
+    monkeypatch.setattr(
+        recs.routing,
+        "read_single",
+        lambda query, **parameters: {"release_id": "r1", "candidates": []},
+    )
+    app = Flask(__name__)
+    app.register_blueprint(recs.bp, url_prefix = "/v1/recs")
+
+    response = app.test_client().get("/v1/recs/ana/friends?by=reviews")
+
+    assert response.status_code == 404
+    assert response.json["code"] == "NoFriendRecsByReviewsFound"
+    assert "'r1'" in response.json["message"]
@@ -0,0 +1,84 @@
+"""
+Tests of the read routing and the Harmonics-Consistency header.
+"""
+import base64
+import json
+import time
+import pytest
+from flask import Flask, g, jsonify
+from neo4j.exceptions import Neo4jError
+from harmonics_api.utils import routing
+
+@pytest.fixture(name = "client")
+def fixture_client():
+    app = Flask(__name__)
+    routing.init_app(app)
+
+    @app.route("/v1/users/<username>/follows", methods = ["POST"])
+    def follow(username):
+        g.written_bookmarks.add(f"bookmark:{username}")
+        return jsonify({}), 201
+
+    @app.route("/v1/artists/<artist_id>", methods = ["GET"])
+    def get_artist(artist_id):
+        return jsonify({
+            "recent_write": g.recent_write,
+            "bookmarks": g.bookmarks,
+            "secondaries": routing.use_secondaries(),
+        }), 200
+
+    return app.test_client()
+
+def _forge(recent_write: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(recent_write).encode("utf-8")).decode("ascii")
+
+def test_signed_token_pins_the_reads_to_the_primaries(client):
+    token = client.post("/v1/users/ana/follows").headers[routing.HEADER]
+
+    response = client.get("/v1/artists/a1", headers = {routing.HEADER: token})
+
+    assert response.json == {
+        "recent_write": True,
+        "bookmarks": ["bookmark:ana"],
+        "secondaries": False,
+    }
+
+@pytest.mark.parametrize("token", [
+    _forge({"until": time.time() + 10 ** 9, "bookmarks": ["forged"]}),
+    _forge({"until": time.time() + 10 ** 9, "bookmarks": ["forged"]}) + ".0000",
+    "not a token",
+    "é.é",
+])
+def test_unsigned_tokens_are_ignored(client, token):
+    response = client.get("/v1/artists/a1", headers = {routing.HEADER: token})
+
+    assert response.json == {
+        "recent_write": False,
+        "bookmarks": [],
+        "secondaries": True,
+    }
+
+def test_token_expiry_is_clamped():
+    payload = _forge({"until": time.time() + 10 ** 9, "bookmarks": []})
+    token = f"{payload}.{routing._sign(payload)}"  # pylint: disable=protected-access
+
+    recent_write = routing._decode(token)  # pylint: disable=protected-access
+
+    assert recent_write["until"] <= time.time() + routing.settings.READ_YOUR_WRITES_SECONDS
+
+class _RejectedBookmarks(Neo4jError):
+    code = "Neo.ClientError.Transaction.InvalidBookmark"
+
+def test_rejected_bookmarks_fall_back_to_the_primary(driver):
+    app = Flask(__name__)
+    session = driver.session.return_value.__enter__.return_value
+    session.execute_read.side_effect = _RejectedBookmarks()
+    session.execute_write.return_value = ["record"]
+
+    with app.test_request_context("/v1/artists/a1"):
+        g.read_policy = "secondary"
+        g.bookmarks = ["bogus"]
+
+        assert routing.read("RETURN 1") == ["record"]
+        assert g.bookmarks == []
+        assert driver.session.call_args.kwargs["bookmarks"] is None
@@ -0,0 +1,95 @@
+"""
+Tests of the search routes.
+"""
+import pytest
+from flask import Flask
+from harmonics_api.routes import search
+from harmonics_api.utils import search as search_index
+
+@pytest.fixture(name = "client")
+def fixture_client():
+    app = Flask(__name__)
+    app.register_blueprint(search.bp, url_prefix = "/v1/search")
+    return app.test_client()
+
+@pytest.mark.parametrize("kind", ["tracks", "artists", "users"])
+@pytest.mark.parametrize("limit", ["0", "-1", "ten"])
+def test_search_rejects_invalid_limits(client, kind, limit):
+    response = client.get(f"/v1/search/{kind}?q=love&limit={limit}")
+
+    assert response.status_code == 400
+    assert response.json["code"] == "InvalidQueryParameter"
+
+def test_search_tracks_caps_the_limit(client, db):
+    db.track_search.insert_many(
+        {
+            "_id": f"r1:{position}",
+            "name": "Love",
+            "tokens": ["love"],
+            "artist": {"id": "a1", "name": "Alpha"},
+            "release": {"id": "r1", "name": "One"},
+        }
+        for position in range(60)
+    )
+
+    response = client.get("/v1/search/tracks?q=love&limit=1000")
+
+    assert response.status_code == 200
+    assert len(response.json["items"]) == 50
+
+def test_user_popularity_follows_friendships(db):
+    db.users.insert_many([
+        {"username": "ana", "friends": []},
+        {"username": "bob", "friends": []},
+    ])
+    search_index.index_user_name({"username": "ana", "friends": []})
+    db.users.update_one({"username": "ana"}, {"$set": {"friends": ["bob"] * 999}})
+
+    search_index.refresh_user_popularities(["ana", "bob"])
+
+    assert db.name_search.find_one({"_id": "user:ana"})["popularity"] == 1.0
+
+def _similarity(grams: list, query_grams: list) -> float:
+    shared = len(set(grams) & set(query_grams))
+    return 2 * shared / (len(grams) + len(query_grams))
+
+def test_name_prefilter_keeps_every_similar_enough_name():
+    names = ["the beatles", "beatles", "beetles", "the beat", "teh beatels", "abba", "the"]
+    for query in names:
+        query_grams = search_index.trigrams(query)
+        pipeline = search_index.search_names_pipeline("artist", query_grams)
+        prefilter = set(pipeline[0]["$match"]["grams"]["$in"])
+        min_shared = pipeline[2]["$match"]["qt_shared"]["$gte"]
+        for name in names:
+            grams = search_index.trigrams(name)
+            if _similarity(grams, query_grams) >= search_index.NAME_MIN_SIMILARITY:
+                assert prefilter & set(grams)
+                assert len(set(grams) & set(query_grams)) >= min_shared
+
+def test_best_name_match_is_never_cut_before_ranking(db):
+    query_grams = search_index.trigrams("the beatles")
+    db.name_search.insert_many(
+        {
+            "kind": "artist",
+            "key": f"a{position}",
+            "name": f"the {position}",
+            "grams": search_index.trigrams(f"the {position}"),
+            "popularity": 0.0,
+        }
+        for position in range(6_000)
+    )
+    db.name_search.insert_one(
+        {
+            "kind": "artist",
+            "key": "beatles",
+            "name": "The Beatles",
+            "grams": query_grams,
+            "popularity": 0.0,
+        },
+    )
+    pipeline = search_index.search_names_pipeline("artist", query_grams)
+    sort = next(position for position, stage in enumerate(pipeline) if "$sort" in stage)
+
+    assert not any("$limit" in stage for stage in pipeline[:sort])
+    prefiltered = db.name_search.aggregate(pipeline[:1])
+    assert "beatles" in {entry["key"] for entry in prefiltered}
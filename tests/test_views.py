@@ -0,0 +1,97 @@
+"""
+Tests of the materialized artist views.
+"""
+import mongomock
+from harmonics_api.utils import routing, views
+
+def _artist(artist_id: str, **fields) -> dict:
+    return {
+        "_id": artist_id,
+        "name": f"Artist {artist_id}",
+        "genres": ["pop"],
+        "qt_followers": 3,
+        "releases": [
+            {
+                "id": f"{artist_id}-r1",
+                "name": "One",
+                "release_date": "2020-05-01",
+                "tracks": [
+                    {"track_number": 1, "name": "Song", "duration": 100},
+                ],
+                "rating_sum": 9,
+                "qt_ratings": 2,
+            },
+        ],
+        **fields,
+    }
+
+def test_build_artist_view_tolerates_missing_bios_and_dates():
+    artist = _artist("a1")
+    artist["releases"][0]["release_date"] = ""
+
+    view = views.build_artist_view(artist)
+
+    assert view["bio"] is None
+    assert view["releases"][0]["release_year"] is None
+    assert view["rating_sum"] == 9
+    assert view["qt_ratings"] == 2
+
+def test_get_artist_view_materializes_a_missing_view(db):
+    db.artists.insert_one(_artist("a1", bio = "Bio"))
+
+    view = views.get_artist_view("a1", ("name", "releases"))
+
+    assert view == {
+        "_id": "a1",
+        "name": "Artist a1",
+        "releases": [{"id": "a1-r1", "name": "One", "release_year": 2020}],
+    }
+    assert db.artist_views.count_documents({}) == 1
+
+def test_get_artist_view_keeps_a_view_the_secondary_missed(db, monkeypatch):
+    db.artists.insert_one(_artist("a1"))
+    stored_view = views.build_artist_view(_artist("a1"))
+    stored_view["qt_ratings"] = 3
+    db.artist_views.insert_one(stored_view)
+    lagging_secondary = mongomock.MongoClient()["music_catalog"]
+    monkeypatch.setattr(routing, "db", lambda: lagging_secondary)
+
+    view = views.get_artist_view("a1", ("qt_ratings",))
+
+    assert view["qt_ratings"] == 3
+
+def test_get_artist_view_of_an_unknown_artist(db):
+    assert views.get_artist_view("a1", ("name",)) is None
+    assert db.artist_views.count_documents({}) == 0
+
+def test_get_artist_views_materializes_missing_views_in_one_write(db, monkeypatch):
+    db.artists.insert_many([_artist("a1"), _artist("a2"), _artist("a3")])
+    db.artist_views.insert_one(views.build_artist_view(_artist("a1")))
+    bulk_writes = []
+    bulk_write = db.artist_views.bulk_write
+    monkeypatch.setattr(
+        db.artist_views,
+        "bulk_write",
+        lambda operations, **kwargs: bulk_writes.append(operations) or bulk_write(operations, **kwargs),
+    )
+
+    views_found = views.get_artist_views(["a1", "a2", "a3", "a4"], ("name",))
+
+    assert sorted(views_found) == ["a1", "a2", "a3"]
+    assert [len(operations) for operations in bulk_writes] == [2]
+    assert db.artist_views.count_documents({}) == 3
+
+def test_every_view_write_bumps_its_version(db):
+    artist = _artist("a1", version = 7)
+    db.artists.insert_one(artist)
+
+    assert views.get_artist_view("a1", ("version",))["version"] == 7
+    views.add_followers({"a1": 2})
+    views.set_followers({"a1": 10})
+    views.add_rating("a1-r1", 4, 1)
+    views.refresh_artist_view(artist)
+
+    view = db.artist_views.find_one({"_id": "a1"})
+    assert view["version"] == 11
+    assert view["qt_followers"] == 3
+    assert view["qt_ratings"] == 2